@@ -0,0 +1,49 @@
+from . import fileform, nsisfile, rangeio
+
+# Size of the first fetch of an operation, doubled at every following one.
+_MIN_FETCH_SIZE = 0x10000
+# Size of the windows searched for the firstheader.
+_SCAN_WINDOW_SIZE = 0x10000
+
+async def fetch_ranges(reader, range_file, func):
+    """
+    Returns func(), run again every time it reads bytes missing from
+    |range_file| once they are fetched from |reader|. Fetches double in size
+    while |func| keeps missing bytes so large reads take few round trips.
+    """
+    fetch_size = _MIN_FETCH_SIZE
+    while True:
+        try:
+            return func()
+        except rangeio.MissingRange as e:
+            size = max(e.size, fetch_size)
+            data = await reader.read_at(e.offset, size)
+            range_file.add(e.offset, data, eof=len(data) < size)
+            fetch_size *= 2
+
+async def open_nsis(reader, parse_level=nsisfile.PARSE_FULL):
+    """ See NSIS.open_async. """
+    range_file = rangeio.RangeFile()
+
+    firstheader = await fetch_ranges(reader, range_file,
+            lambda: fileform._find_appended_firstheader(range_file,
+                                                        _SCAN_WINDOW_SIZE))
+    if firstheader is None:
+        raise nsisfile.HeaderNotFound()
+
+    nsis = await fetch_ranges(reader, range_file,
+            lambda: nsisfile.NSIS(range_file, parse_level,
+                                  firstheader=firstheader))
+    nsis.reader = reader
+    return nsis
+
+async def parse(nsis, parse_level=nsisfile.PARSE_FULL):
+    """ See NSIS.parse_async. """
+    await fetch_ranges(nsis.reader, nsis.fd, lambda: nsis.parse(parse_level))
+
+async def file_data(nsis, offset):
+    """ See NSIS.file_data_async. """
+    return await fetch_ranges(nsis.reader, nsis.fd,
+            lambda: b''.join(fileform._iter_data_item(nsis.fd,
+                                                      nsis.firstheader,
+                                                      offset)))
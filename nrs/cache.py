@@ -0,0 +1,189 @@
+import hashlib
+import marshal
+import os
+import struct
+import sys
+import tempfile
+from . import fileform
+
+# Cache entry header: magic, format version, decoder (0 if stored), solid
+# flag, digest of the compressed header bytes, count of compressed bytes
+# read, compressed header size and inflated header size. The inflated
+# header follows, then the marshalled version and strings index, None if
+# they were not parsed yet when the entry was stored.
+_entry_pack = struct.Struct('<4sBBB16sIII')
+_MAGIC = b'NRSC'
+_FORMAT_VERSION = 4
+_SUFFIX = '.nrsc'
+
+# Compressed bytes hashed with the firstheader to key cache entries.
+_KEY_DATA_SIZE = 0x1000
+_DIGEST_SIZE = 16
+_READ_SIZE = 0x100000
+# The marshal format depends on the interpreter, entries are only shared by
+# interpreters of the same version.
+_RUNTIME_KEY = struct.pack('<BBB', marshal.version, *sys.version_info[:2])
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+def _digest(nsis_file, offset, size):
+    """ Hash |size| bytes of |nsis_file| at |offset|. """
+    digest = hashlib.blake2b(digest_size=_DIGEST_SIZE)
+    nsis_file.seek(offset)
+    while size > 0:
+        data = nsis_file.read(min(size, _READ_SIZE))
+        if not data:
+            break
+        digest.update(data)
+        size -= len(data)
+    return digest.digest()
+
+class ParseCache(object):
+    """
+    Size bounded on-disk cache of parsed installers in |directory|. Entries
+    hold the inflated header, decoder, and the version and strings index of
+    an installer if they were parsed, so loading it again skips
+    decompression and string symbolization. The least recently used entries
+    are evicted once the cache grows over |max_size| bytes.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # Running size of the entries, read from the directory on first
+        # store() and whenever it grows over |max_size|.
+        self._size = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, nsis_file, firstheader):
+        # Entries are keyed by a hash of the firstheader and the first
+        # compressed bytes, the digest stored in the entry is checked on load.
+        key = hashlib.blake2b(fileform._firstheader_pack.pack(*firstheader),
+                              digest_size=_DIGEST_SIZE)
+        key.update(_RUNTIME_KEY)
+        nsis_file.seek(firstheader.data_offset)
+        key.update(nsis_file.read(_KEY_DATA_SIZE))
+        return os.path.join(self.directory, key.hexdigest() + _SUFFIX)
+
+    def key(self, nsis_file, firstheader):
+        """
+        Returns the key of the entry of the installer of |firstheader| in
+        |nsis_file|, whose header was inflated, for store().
+        """
+        return (self._path(nsis_file, firstheader),
+                _digest(nsis_file, firstheader.data_offset,
+                        firstheader._raw_header_read_size))
+
+    def load(self, nsis_file, firstheader):
+        """
+        Returns the (header, (version_major, version_minor), strings index)
+        cached for the installer of |firstheader| in |nsis_file|, or None.
+        The version and index are None if they were not cached.
+        """
+        path = self._path(nsis_file, firstheader)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            magic, format_version, decoder, solid, digest, read_size, \
+                    data_size, header_size = _entry_pack.unpack_from(data)
+        except (IOError, OSError, struct.error):
+            self.misses += 1
+            return None
+
+        if magic != _MAGIC or format_version != _FORMAT_VERSION or \
+                digest != _digest(nsis_file, firstheader.data_offset,
+                                  read_size):
+            self.misses += 1
+            return None
+
+        header_end = _entry_pack.size + header_size
+        if len(data) < header_end:
+            self.misses += 1
+            return None
+        try:
+            version, index = marshal.loads(data[header_end:])
+        except (EOFError, ValueError, TypeError):
+            self.misses += 1
+            return None
+
+        header = fileform._load_header(firstheader,
+                                       data[_entry_pack.size:header_end],
+                                       data_size, decoder or None,
+                                       bool(solid))
+        firstheader._raw_header_read_size = read_size
+        # Entries are evicted by modification time.
+        os.utime(path, None)
+        self.hits += 1
+        return header, version, index
+
+    def store(self, nsis, key):
+        """
+        Cache the |nsis| installer under the |key| returned by key(). Only
+        what was already parsed is stored, the version and strings index are
+        left out if they were never used.
+        """
+        firstheader = nsis.firstheader
+        path, digest = key
+        raw_header = bytes(nsis.raw_header)
+        index = None
+        if nsis._string_table is not None:
+            index = nsis._string_table.index()
+        entry = _entry_pack.pack(
+                _MAGIC, _FORMAT_VERSION, nsis.header.decoder or 0,
+                int(nsis.header.solid), digest,
+                firstheader._raw_header_read_size,
+                firstheader._raw_header_c_size, len(raw_header))
+        payload = marshal.dumps((nsis._version, index))
+
+        # Entries are written to a temporary file first so concurrent readers
+        # never see a partial entry.
+        if self._size is None:
+            self._size = sum(entry[1] for entry in self._entries())
+        try:
+            self._size -= os.stat(path).st_size
+        except OSError:
+            pass
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(entry)
+                f.write(raw_header)
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except:
+            os.remove(tmp_path)
+            raise
+        self._size += len(entry) + len(raw_header) + len(payload)
+        if self._size > self.max_size:
+            self._evict()
+
+    def _entries(self):
+        """ Returns the (mtime, size, name) of every entry. """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(_SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        return entries
+
+    def _evict(self):
+        # Other processes sharing the directory may have stored or evicted
+        # entries, the running size is only an estimate until rescanned.
+        entries = self._entries()
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, name in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            size -= entry_size
+        self._size = size
@@ -0,0 +1,236 @@
+import bisect
+from collections import namedtuple, OrderedDict
+from . import disasm
+
+# Header code_on* callbacks.
+EVENTS = ['Init', 'InstSuccess', 'InstFailed', 'UserAbort', 'GUIInit',
+          'GUIEnd', 'MouseOverSection', 'VerifyInstDir', 'SelChange',
+          'RebootFailed']
+
+BasicBlock = namedtuple('BasicBlock', [
+        'start', # First entry number.
+        'end', # Entry number following the last entry.
+        'successors', # Start of the blocks control may flow to.
+        'calls', # Entry numbers called by the block.
+    ])
+
+Function = namedtuple('Function', [
+        'start', # First entry number.
+        'end', # Entry number following the last block.
+        'blocks', # BasicBlock list, sorted by start.
+        'calls', # Entry numbers of the functions called.
+    ])
+
+def handlers(nsis):
+    """
+    Returns the first entry of every section, page callback and code_on*
+    handler of |nsis| set, by name.
+    """
+    n = len(nsis.entries)
+    roots = OrderedDict()
+    for i, section in enumerate(nsis.sections):
+        roots['section_{}'.format(i)] = section.code
+    for i, page in enumerate(nsis.pages):
+        for fn in ['prefunc', 'showfunc', 'leavefunc']:
+            roots['page_{}_{}'.format(i, fn)] = getattr(page, fn)
+    for event in EVENTS:
+        roots['on' + event] = getattr(nsis.header, 'code_on' + event)
+    return OrderedDict((name, entry) for name, entry in roots.items()
+                            if 0 <= entry < n)
+
+def address_taken(nsis):
+    """
+    Returns the functions whose address is read by GetFunctionAddress in
+    |nsis|, as they may be called from a variable. The compiler turns it
+    into an AssignVar of the entry number + 1 as a decimal string, only
+    numbers addressing the entry following a Return, where functions start,
+    are kept.
+    """
+    instructions = nsis.instructions
+    n = len(instructions)
+    addresses = set()
+    for instruction in instructions:
+        if instruction.opcode != disasm.I_ASSIGNVAR:
+            continue
+        address = instruction.operands[1].value
+        if address & disasm.STR_LANG_FLAG:
+            continue
+        string = nsis.get_string(address)
+        if not string.isdigit() or not 0 < int(string) <= n:
+            continue
+        entry = int(string) - 1
+        if entry == 0 or instructions[entry - 1].opcode == disasm.I_RETURN:
+            addresses.add(entry)
+    return sorted(addresses)
+
+def _jumps(instruction):
+    return [op.value for op in instruction.operands
+                if op.type == disasm.O_JUMP]
+
+class ControlFlowGraph(object):
+    """
+    Basic blocks of the disasm.Instruction list |instructions|. |roots| maps
+    handler names to their first entry, see handlers(). |address_taken|
+    are the first entries of functions called from variables, see
+    address_taken().
+    """
+
+    def __init__(self, instructions, roots=None, address_taken=()):
+        self.roots = roots if roots is not None else OrderedDict()
+        self.address_taken = list(address_taken)
+        self.blocks = []
+        """ BasicBlock list, sorted by start. """
+
+        self.starts = []
+        """ Start of every block of |blocks|. """
+
+        n = len(instructions)
+        # Blocks start at handlers, jump and call targets and after any
+        # instruction which may not flow to the next entry. Calls are kept
+        # in their block.
+        leaders = bytearray(n + 1)
+        leaders[0] = leaders[n] = 1
+        for entry in list(self.roots.values()) + self.address_taken:
+            leaders[entry] = 1
+        for i, instruction in enumerate(instructions):
+            targets = _jumps(instruction)
+            for target in targets:
+                if target < n:
+                    leaders[target] = 1
+            opdef = disasm.OPCODES[instruction.opcode]
+            if opdef.flow == disasm.FLOW_STOP or \
+                    (targets and opdef.flow != disasm.FLOW_CALL):
+                leaders[i+1] = 1
+
+        start = 0
+        calls = []
+        for i, instruction in enumerate(instructions):
+            if instruction.opcode == disasm.I_CALL:
+                calls.extend(target for target in _jumps(instruction)
+                                if target < n)
+            if not leaders[i+1]:
+                continue
+            self.blocks.append(BasicBlock(start, i + 1,
+                                          self._successors(instruction,
+                                                           i + 1, n),
+                                          tuple(calls)))
+            self.starts.append(start)
+            start = i + 1
+            calls = []
+        self._index = dict((start, i) for i, start in enumerate(self.starts))
+
+    @staticmethod
+    def _successors(last, end, n):
+        opdef = disasm.OPCODES[last.opcode]
+        if opdef.flow == disasm.FLOW_STOP:
+            return ()
+        successors = []
+        if opdef.flow != disasm.FLOW_CALL:
+            successors = [target for target in _jumps(last) if target < n]
+        if end < n and not last.flags & disasm.FLa_NoFlow:
+            successors.append(end)
+        return tuple(sorted(set(successors)))
+
+    def block_at(self, entry):
+        """ Returns the BasicBlock holding |entry|. """
+        i = bisect.bisect_right(self.starts, entry) - 1
+        if i < 0 or entry >= self.blocks[i].end:
+            raise IndexError('entry out of range')
+        return self.blocks[i]
+
+    def graph(self, entry):
+        """
+        Returns the blocks reachable from |entry| without following calls,
+        sorted by start.
+        """
+        first = self.block_at(entry)
+        seen = set([first.start])
+        stack = [first]
+        while stack:
+            for successor in stack.pop().successors:
+                if successor not in seen:
+                    seen.add(successor)
+                    stack.append(self.blocks[self._index[successor]])
+        return [self.blocks[self._index[start]] for start in sorted(seen)]
+
+    def handler_graphs(self):
+        """ Returns the graph() of every root, by name. """
+        return OrderedDict((name, self.graph(entry))
+                                for name, entry in self.roots.items())
+
+class CallGraph(object):
+    """
+    Functions of the ControlFlowGraph |graph|, discovered from its roots and
+    address taken functions by following calls. Each function holds every
+    block it reaches, so blocks shared by several functions, such as a
+    common tail, belong to all of them. Blocks are walked once, by the first
+    function reaching them; the others only walk the shared blocks again.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.functions = OrderedDict()
+        """ Function reached from the roots, by first entry. """
+
+        # First function reaching each block, by first entry.
+        owners = [None] * len(graph.blocks)
+        worklist = list(graph.roots.values()) + graph.address_taken
+        owned = {}
+        shared = {}
+        while worklist:
+            start = worklist.pop()
+            if start in owned:
+                continue
+            owned[start] = []
+            shared[start] = set()
+            stack = [graph._index[graph.block_at(start).start]]
+            while stack:
+                i = stack.pop()
+                if owners[i] == start:
+                    continue
+                if owners[i] is not None:
+                    # A function starting inside or flowing into another
+                    # one shares the blocks reachable from there.
+                    shared[start].add(graph.blocks[i].start)
+                    continue
+                owners[i] = start
+                block = graph.blocks[i]
+                owned[start].append(i)
+                worklist.extend(block.calls)
+                stack.extend(graph._index[successor]
+                                for successor in block.successors)
+
+        tails = {}
+        for start in sorted(owned):
+            indexes = set(owned[start])
+            for entry in shared[start]:
+                if entry not in tails:
+                    tails[entry] = [graph._index[block.start]
+                                        for block in graph.graph(entry)]
+                indexes.update(tails[entry])
+            blocks = [graph.blocks[i] for i in sorted(indexes)]
+            calls = set()
+            for block in blocks:
+                calls.update(block.calls)
+            self.functions[start] = Function(start, blocks[-1].end, blocks,
+                                             tuple(sorted(calls)))
+
+        self.unreachable = []
+        """ (start, end) ranges of the entries no function reaches. """
+        for block, owner in zip(graph.blocks, owners):
+            if owner is not None:
+                continue
+            if self.unreachable and self.unreachable[-1][1] == block.start:
+                self.unreachable[-1] = (self.unreachable[-1][0], block.end)
+            else:
+                self.unreachable.append((block.start, block.end))
+
+    def callers(self, entry):
+        """ Returns the first entry of the functions calling |entry|. """
+        return [function.start for function in self.functions.values()
+                    if entry in function.calls]
+
+    def is_reachable(self, entry):
+        """ Whether a function reaches |entry|. """
+        i = bisect.bisect_right(self.unreachable, (entry, float('inf'))) - 1
+        return i < 0 or entry >= self.unreachable[i][1]
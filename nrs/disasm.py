@@ -0,0 +1,314 @@
+from collections import namedtuple
+
+STR_LANG_FLAG = 1 << 31
+
+# Operand types.
+O_STRING = 'string'
+O_VAR = 'var'
+O_JUMP = 'jump'
+O_INT = 'int'
+
+# NSIS specific instruction flags.
+FLo_IntOp =       0x01
+FLo_PluginCall =  0x02
+
+FLa_CheckNoFlow = 0x04
+FLa_NoFlow =      0x08
+FLa_StackArgs =   0x10
+
+# Control flow of opcodes.
+FLOW_NEXT = 0
+FLOW_STOP = 1
+FLOW_CALL = 2
+
+INTOP_SYM = ['+','-','*','/','|','&','^','!','||','&&','%','<<','>>']
+
+OpcodeDef = namedtuple('OpcodeDef',
+                       ['name', 'operands', 'access', 'flow', 'virtual',
+                        'aux'])
+"""
+Opcode definition. |operands| is a string with one format character per
+parameter decoded:
+    I: integer.
+    S: string offset.
+    V: variable number.
+    J: jump target, entry number + 1.
+    O: IntOp operator.
+    2: integer shifted right by 2 bits (SendMessage).
+|access| has one character per operand read ('r'), written ('w'), both
+('x') or none ('-'). |virtual| returns the opcode of the virtual instruction
+decoded given the opcode and its parameters (eg. PushPop -> Push/Pop/Exch).
+|aux| are FLa_* flags.
+"""
+
+Operand = namedtuple('Operand', ['type', 'value'])
+"""
+Decoded operand. |value| is a string offset, a variable number, the entry
+number targeted by a jump or an integer, given |type|.
+"""
+
+class Instruction(namedtuple('Instruction',
+                             ['opcode', 'operands', 'flags'])):
+    """
+    Decoded entry. |opcode| indexes OPCODES, real or virtual, |flags| are
+    FLa_* flags.
+    """
+    __slots__ = ()
+
+    @property
+    def name(self):
+        return OPCODES[self.opcode].name
+
+# Opcodes used by the virtual instruction decoders and analysis.
+I_INVALID = 0x00
+I_RETURN = 0x01
+I_JMP = 0x02
+I_ABORT = 0x03
+I_QUIT = 0x04
+I_CALL = 0x05
+I_SETFLAG = 0x0d
+I_IFFLAG = 0x0e
+I_EXTRACTFILE = 0x14
+I_STRCPY = 0x19
+I_PUSHPOP = 0x1f
+I_SHOWWINDOW = 0x27
+I_REGISTERDLL = 0x2c
+I_DELETEREGKEY = 0x32
+I_REGENUMKEY = 0x35
+I_FILEWRITE = 0x38
+I_FILEREAD = 0x39
+I_LOGTEXT = 0x3f
+
+# Virtual opcodes, following the real ones.
+I_PUSH = 0x45
+I_POP = 0x46
+I_EXCH = 0x47
+I_CLEARERRORS = 0x48
+I_IFERRORS = 0x49
+I_ASSIGNVAR = 0x4a
+I_ENABLEWINDOW = 0x4b
+I_HIDEWINDOW = 0x4c
+I_DELETEREGVALUE = 0x4d
+I_REGENUMVALUE = 0x4e
+I_FILEWRITEBYTE = 0x4f
+I_FILEREADBYTE = 0x50
+I_LOGSET = 0x51
+I_PLUGINCALL = 0x52
+
+def _virt_pushpop(opcode, params):
+    if params[1]:
+        return I_POP
+    elif params[2]:
+        return I_EXCH
+    else:
+        return I_PUSH
+
+def _virt_setflag(opcode, params):
+    if params[0] == 2 and params[1] == 0xac:
+        return I_CLEARERRORS
+    return opcode
+
+def _virt_ifflag(opcode, params):
+    if params[1] == 0 and params[2] == 2 and params[3] == 0:
+        return I_IFERRORS
+    return opcode
+
+def _virt_strcpy(opcode, params):
+    if params[2] == 0 and params[3] == 0:
+        return I_ASSIGNVAR
+    return opcode
+
+def _virt_showwindow(opcode, params):
+    if params[2]:
+        return I_HIDEWINDOW
+    elif params[3]:
+        return I_ENABLEWINDOW
+    return opcode
+
+def _virt_delreg(opcode, params):
+    if params[4]:
+        return I_DELETEREGKEY
+    return I_DELETEREGVALUE
+
+def _virt_regenum(opcode, params):
+    if params[4]:
+        return I_REGENUMKEY
+    return I_REGENUMVALUE
+
+def _virt_fwrite(opcode, params):
+    if params[2]:
+        return I_FILEWRITEBYTE
+    return I_FILEWRITE
+
+def _virt_fread(opcode, params):
+    if params[3]:
+        return I_FILEREADBYTE
+    return I_FILEREAD
+
+def _virt_log(opcode, params):
+    if params[0]:
+        return I_LOGSET
+    return I_LOGTEXT
+
+def _op(name, operands='', access='', flow=FLOW_NEXT, virtual=None, aux=0):
+    return OpcodeDef(name, operands, access, flow, virtual, aux)
+
+OPCODES = [
+    _op('INVALID'), # 0x00
+    _op('Return', flow=FLOW_STOP), # 0x01
+    _op('Jmp', 'J', 'r', aux=FLa_CheckNoFlow), # 0x02
+    _op('Abort', 'I', 'r', flow=FLOW_STOP), # 0x03
+    _op('Quit', flow=FLOW_STOP), # 0x04
+    _op('Call', 'J', 'r', flow=FLOW_CALL), # 0x05
+    _op('UpdateText', 'S', 'r'), # 0x06
+    _op('Sleep', 'I', 'r'), # 0x07
+    _op('BringToFront'), # 0x08
+    _op('ChDetailsView', 'SS', 'rr'), # 0x09
+    _op('SetFileAttributes', 'SI', 'rr'), # 0x0a
+    _op('CreateDir', 'SI', 'rr'), # 0x0b
+    _op('IfFileExists', 'SJJ', 'rrr', aux=FLa_CheckNoFlow), # 0x0c
+    _op('SetFlag', 'IS', 'rr', virtual=_virt_setflag), # 0x0d
+    _op('IfFlag', 'JJII', 'rrrr', virtual=_virt_ifflag,
+        aux=FLa_CheckNoFlow), # 0x0e
+    _op('GetFlag', 'VI', 'wr'), # 0x0f
+    _op('Rename', 'SSIS', 'wrrr'), # 0x10
+    _op('GetFullPathName', 'SVI', 'rwr'), # 0x11
+    _op('SearchPath', 'VS', 'wr'), # 0x12
+    _op('GetTempFilename', 'VS', 'wr'), # 0x13
+    _op('ExtractFile', 'ISIIII', 'rrrrrr'), # 0x14
+    _op('DeleteFile', 'SI', 'rr'), # 0x15
+    _op('MessageBox', 'ISIJIJ', 'rrrrr'), # 0x16
+    _op('RmDir', 'SI', 'rr'), # 0x17
+    _op('StrLe', 'VS', 'wr', virtual=_virt_setflag), # 0x18
+    _op('StrCpy', 'VSSS', 'wrrr', virtual=_virt_strcpy), # 0x19
+    _op('StrCmp', 'SSJJI', 'rrrrr', aux=FLa_CheckNoFlow), # 0x1a
+    _op('ReadEnv', 'VSI', 'wrr'), # 0x1b
+    _op('IntCmp', 'SSJJJI', 'rrrrrr', aux=FLa_CheckNoFlow), # 0x1c
+    _op('IntOp', 'VSSO', 'wrrr'), # 0x1d
+    _op('IntFmt', 'VSS', 'wrr'), # 0x1e
+    _op('PushPop', virtual=_virt_pushpop), # 0x1f
+    _op('FindWindow', 'VSSSS', 'wrrrr'), # 0x20
+    _op('SendMessage', 'VSSSS2', 'wrrrrr'), # 0x21
+    _op('IsWindow', 'SJJ', 'rrr', aux=FLa_CheckNoFlow), # 0x22
+    _op('GetDlgItem', 'VSS', 'wrr'), # 0x23
+    _op('SetCtlColors', 'SI', 'rr'), # 0x24
+    _op('SetBrandingImage', 'SII', 'rr'), # 0x25
+    _op('CreateFont', 'VSSSI', 'wrrrr'), # 0x26
+    _op('ShowWindow', 'SS', 'rr', virtual=_virt_showwindow), # 0x27
+    _op('ShellExec', 'SSSS', 'rrrr'), # 0x28
+    _op('Execute', 'SII', 'rrr'), # 0x29
+    _op('GetFileTime', 'VVS', 'wwr'), # 0x2a
+    _op('GetDLLVersion', 'VVS', 'wwr'), # 0x2b
+    _op('RegisterDLL', 'SSSI', 'rrrr'), # 0x2c
+    _op('CreateShortcut', 'SSSSS', 'rrrrr'), # 0x2d
+    _op('CopyFiles', 'SSS', 'rrr'), # 0x2e
+    _op('Reboot'), # 0x2f
+    _op('WriteIni', 'SSSS', 'rrrr'), # 0x30
+    _op('ReadIni', 'VSSS', 'wrrr'), # 0x31
+    _op('DeleteRegKey', 'ISSS', 'rrrr', virtual=_virt_delreg), # 0x32
+    _op('WriteRegValue', 'ISSII', 'rrrrr'), # 0x33
+    _op('ReadRegValue', 'VISSI', 'wrrrr'), # 0x34
+    _op('RegEnumKey', 'VISS', 'wrrr', virtual=_virt_regenum), # 0x35
+    _op('FileClose', 'V', 'r'), # 0x36
+    _op('FileOpen', 'VIIS', 'wrrr'), # 0x37
+    _op('FileWrite', 'VS', 'rr', virtual=_virt_fwrite), # 0x38
+    _op('FileRead', 'VVS', 'rwr', virtual=_virt_fread), # 0x39
+    _op('FileSeek', 'VVSI', 'rwrr'), # 0x3a
+    _op('FindClose', 'V', 'r'), # 0x3b
+    _op('FindNext', 'VV', 'wr'), # 0x3c
+    _op('FindFirst', 'VVS', 'wwr'), # 0x3d
+    _op('WriteUninstaller', 'SIIS', 'rrrr'), # 0x3e
+    _op('LogText', 'S', 'r', virtual=_virt_log), # 0x3f
+    _op('SectionSet', 'SII', 'rrr'), # 0x40
+    _op('InstTypeSet', 'SIII', 'rrrr'), # 0x41
+    _op('GetLabelAddr'), # 0x42
+    _op('GetFunctionAddr'), # 0x43
+    _op('LockWindow', 'I', 'r'), # 0x44
+]
+
+# Opcodes found in entries, the virtual ones follow.
+REAL_OPCODES = len(OPCODES)
+
+OPCODES += [
+    _op('Push', 'S', 'r'),
+    _op('Pop', 'V', 'w'),
+    _op('Exch', 'I', 'x'),
+    _op('ClearErrors'),
+    _op('IfErrors', 'J', 'r'),
+    _op('AssignVar', 'VS', 'wr'),
+    _op('EnableWindow', 'SS', 'rr'),
+    _op('HideWindow', 'SS', 'rr'),
+    _op('DeleteRegValue', 'ISSS', 'rrrr'),
+    _op('RegEnumValue', 'VISS', 'wrrr'),
+    _op('FileWriteByte', 'VS', 'rr'),
+    _op('FileReadByte', 'VV', 'rw'),
+    _op('LogSet', 'I', 'r'),
+    _op('PluginCall', access='rrr'),
+]
+
+def _decode_operands(fmt, params):
+    """
+    Returns the operands of |fmt| decoded from |params|, and whether none of
+    its jumps fall through to the next entry.
+    """
+    operands = []
+    no_flow = True
+    for c, p in zip(fmt, params):
+        if c == 'S':
+            operands.append(Operand(O_STRING, p & 0xffffffff))
+        elif c == 'I':
+            operands.append(Operand(O_INT, p))
+        elif c == 'V':
+            if p == -1:
+                operands.append(Operand(O_INT, -1))
+            else:
+                operands.append(Operand(O_VAR, p))
+        elif c == 'J':
+            # Positive jumps are entry numbers + 1, negative ones are read
+            # from variable -p-1 at run time, 0 is the next entry.
+            if p > 0:
+                operands.append(Operand(O_JUMP, p - 1))
+            else:
+                if p < 0:
+                    operands.append(Operand(O_VAR, -p - 1))
+                else:
+                    operands.append(Operand(O_INT, p))
+                no_flow = False
+        elif c == 'O':
+            operands.append(Operand(O_INT, p))
+        elif c == '2':
+            operands.append(Operand(O_INT, p >> 2))
+        else:
+            raise ValueError('Unknown format flag: ' + c)
+    return tuple(operands), no_flow
+
+def decode(which, params):
+    """
+    Returns the Instruction of an entry given its |which| opcode and
+    |params|.
+    """
+    if not 0 <= which < REAL_OPCODES:
+        which = I_INVALID
+    opdef = OPCODES[which]
+    opcode = which
+    if opdef.virtual:
+        opcode = opdef.virtual(which, params)
+        opdef = OPCODES[opcode]
+
+    flags = opdef.aux
+    if not opdef.operands:
+        return Instruction(opcode, (), flags)
+    operands, no_flow = _decode_operands(opdef.operands, params)
+    # Instructions with jumps have no flow to the next entry only if all
+    # their jumps are set.
+    if no_flow and flags & FLa_CheckNoFlow and 'J' in opdef.operands:
+        flags |= FLa_NoFlow
+    return Instruction(opcode, operands, flags)
+
+def decode_entries(entries):
+    """
+    Returns the Instruction of every entry of the fileform.EntryTable
+    |entries|, decoded in one pass over its columns.
+    """
+    return [decode(row[0], row[1:])
+                for row in zip(entries.which, *entries.offsets)]
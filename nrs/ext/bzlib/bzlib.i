@@ -56,35 +56,85 @@ int BZ2_Decompress(State *s) {
 %}
 
 %pythoncode %{
-_OUTBUFSIZE = 0x1000
+_BZ_STREAM_END = 4
+
+# Output buffers start small and grow for long outputs.
+_MIN_OUTBUFSIZE = 0x10000
+_MAX_OUTBUFSIZE = 0x400000
 
 class BzException(Exception):
   pass
 
-def decompress(data):
-  try:
-    state = BZ2_Init()
-    BZ2_SetInBuffer(state, data)
+class BzDecompressor(object):
+  """
+  Incremental NSIS bzip2 decompressor, mirroring zlib.decompressobj.
+  """
+
+  def __init__(self):
+    self._state = BZ2_Init()
+    self._outbufsize = _MIN_OUTBUFSIZE
+
+    self.unconsumed_tail = b''
+    """ Input not consumed because |max_length| output was reached. """
+
+    self.eof = False
+    """ True once the end of stream marker was decoded. """
+
+  def __del__(self):
+    if getattr(self, '_state', None) is not None:
+      BZ2_Free(self._state)
+      self._state = None
+
+  def decompress(self, data, max_length=0):
+    """
+    Decompress |data| and return at most |max_length| bytes, or everything
+    if 0. Input left over is kept in |unconsumed_tail| and must be passed
+    back in the next call. Raises BzException on corrupted data, with the
+    bytes decoded before the error in its |output|.
+    """
+    if self.eof:
+      return b''
+
+    # The state points into |data| until this call returns, input left over
+    # is copied to |unconsumed_tail| for the next call.
+    data = bytes(data)
+    BZ2_SetInBuffer(self._state, data)
 
-    outbuf = bytearray(_OUTBUFSIZE)
     out = bytearray()
-
-    while True:
-      BZ2_SetOutBuffer(state, outbuf)
-      out1 = state.next_out
-
-      err = BZ2_Decompress(state)
-      processed = int(state.next_out) - int(out1)
+    while not max_length or len(out) < max_length:
+      size = self._outbufsize
+      if max_length:
+        size = min(size, max_length - len(out))
+      outbuf = bytearray(size)
+      BZ2_SetOutBuffer(self._state, outbuf)
+
+      err = BZ2_Decompress(self._state)
+      processed = size - self._state.avail_out
+      out += memoryview(outbuf)[:processed]
       if err < 0:
+        e = BzException('bzip2 decompression error: {}'.format(err))
+        e.output = bytes(out)
+        raise e
+
+      if err == _BZ_STREAM_END:
+        self.eof = True
         break
 
-      if processed == 0:
+      # Output buffer not filled, the input is exhausted.
+      if processed < size:
         break
+      self._outbufsize = min(self._outbufsize * 2, _MAX_OUTBUFSIZE)
 
-      out += outbuf[:processed]
-  finally:
-    BZ2_Free(state)
+    self.unconsumed_tail = data[len(data) - self._state.avail_in:]
+    return bytes(out)
 
-  return out
+def decompress(data):
+  """
+  One-shot decompression of |data|. Corrupted data is not an error: the
+  bytes decoded before it are returned.
+  """
+  try:
+    return BzDecompressor().decompress(data)
+  except BzException as e:
+    return e.output
 %}
-
@@ -0,0 +1 @@
+from .strings import *
@@ -0,0 +1,155 @@
+/*
+ * Native NSIS strings symbolization, see nrs.strings for the pure Python
+ * implementation it mirrors.
+ */
+
+#include "strings.h"
+
+typedef struct {
+  unsigned char lang;
+  unsigned char shell;
+  unsigned char var;
+  unsigned char skip;
+} Codes;
+
+static const Codes nsis2_codes = { 255, 254, 253, 252 };
+static const Codes nsis3_codes = { 1, 2, 3, 4 };
+
+static int is_code(const Codes *codes, unsigned char c) {
+  if (codes->skip == nsis3_codes.skip)
+    return c < codes->skip;
+  return c > codes->skip;
+}
+
+static const char *escape(unsigned char c) {
+  switch (c) {
+    case 0x09: return "$\\t";
+    case 0x0a: return "$\\n";
+    case 0x0d: return "$\\r";
+    case 0x22: return "$\\\"";
+    case 0x24: return "$$";
+  }
+  return NULL;
+}
+
+static int append_span(PyObject *spans, PyObject *span) {
+  int err;
+  if (span == NULL)
+    return -1;
+  err = PyList_Append(spans, span);
+  Py_DECREF(span);
+  return err;
+}
+
+static int append_text(PyObject *spans, const char *text, size_t text_size,
+                       size_t start, size_t end) {
+  PyObject *value;
+  if (text_size == 0)
+    return 0;
+  value = PyUnicode_DecodeLatin1(text, text_size, NULL);
+  if (value == NULL)
+    return -1;
+  return append_span(spans, Py_BuildValue("(innN)", SPAN_STRING,
+                                          (Py_ssize_t)start,
+                                          (Py_ssize_t)end, value));
+}
+
+/* Symbolize the string at |offset|, storing its size in |processed|. */
+static PyObject *scan(const unsigned char *data, size_t data_size,
+                      size_t offset, const Codes *codes, size_t *processed) {
+  /* Escapes are at most 3 characters long. */
+  char text[NSIS_MAX_STRLEN * 3];
+  size_t text_size = 0;
+  size_t text_start = offset;
+  size_t end = 0;
+  int terminated = 0;
+  size_t i = offset;
+  size_t limit = offset + NSIS_MAX_STRLEN;
+  PyObject *spans = PyList_New(0);
+  if (spans == NULL)
+    return NULL;
+
+  if (limit > data_size)
+    limit = data_size;
+
+  while (i < limit) {
+    unsigned char c = data[i++];
+    const char *escaped;
+
+    if (c == 0) {
+      end = i - 1;
+      terminated = 1;
+      break;
+    }
+
+    if (is_code(codes, c)) {
+      size_t start = i - 1;
+      unsigned int param1 = i < limit ? data[i] : 0;
+      unsigned int param2 = i + 1 < limit ? data[i + 1] : 0;
+      int kind = SPAN_LANG;
+      if (c == codes->shell)
+        kind = SPAN_SHELL;
+      else if (c == codes->var)
+        kind = SPAN_VAR;
+
+      if (append_text(spans, text, text_size, text_start, start) < 0)
+        goto error;
+      text_size = 0;
+
+      i = i + 2 < limit ? i + 2 : limit;
+      if (append_span(spans, Py_BuildValue("(inni)", kind,
+                                           (Py_ssize_t)start, (Py_ssize_t)i,
+                                           param1 | (param2 << 8))) < 0)
+        goto error;
+      text_start = i;
+    } else if (c == codes->skip) {
+      if (i < limit)
+        text[text_size++] = (char)data[i++];
+    } else if ((escaped = escape(c)) != NULL) {
+      while (*escaped)
+        text[text_size++] = *escaped++;
+    } else {
+      text[text_size++] = (char)c;
+    }
+  }
+
+  if (!terminated)
+    end = i;
+  if (append_text(spans, text, text_size, text_start, end) < 0)
+    goto error;
+
+  *processed = i - offset;
+  return spans;
+
+error:
+  Py_DECREF(spans);
+  return NULL;
+}
+
+PyObject *symbolize(char *data, size_t data_size, size_t offset, long count,
+                    int version) {
+  const Codes *codes = version == 2 ? &nsis2_codes : &nsis3_codes;
+  PyObject *strings = PyList_New(0);
+  if (strings == NULL)
+    return NULL;
+
+  while (offset < data_size && count != 0) {
+    size_t processed = 0;
+    PyObject *spans = scan((const unsigned char *)data, data_size, offset,
+                           codes, &processed);
+    if (spans == NULL)
+      goto error;
+    if (append_span(strings, Py_BuildValue("(nnN)", (Py_ssize_t)offset,
+                                           (Py_ssize_t)processed,
+                                           spans)) < 0)
+      goto error;
+    offset += processed;
+    if (count > 0)
+      count--;
+  }
+  return strings;
+
+error:
+  Py_DECREF(strings);
+  return NULL;
+}
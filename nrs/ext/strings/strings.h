@@ -0,0 +1,22 @@
+#ifndef NRS_STRINGS_H
+#define NRS_STRINGS_H
+
+#include <Python.h>
+
+#define NSIS_MAX_STRLEN 1024
+
+/* Span kinds, using the NSIS 3 code values. */
+#define SPAN_STRING 0
+#define SPAN_LANG 1
+#define SPAN_SHELL 2
+#define SPAN_VAR 3
+
+/*
+ * Symbolize |count| strings (or every string if negative) of the NB_STRINGS
+ * block |data|, starting at |offset|. Returns a list of
+ * (offset, size, spans) tuples, spans being (kind, start, end, value) tuples.
+ */
+PyObject *symbolize(char *data, size_t data_size, size_t offset, long count,
+                    int version);
+
+#endif
@@ -0,0 +1,11 @@
+%module(package="nrs.ext") strings
+%include <pybuffer.i>
+
+%{
+#define SWIG_FILE_WITH_INIT
+#include "strings.h"
+%}
+
+%pybuffer_binary(char *data, size_t data_size);
+PyObject *symbolize(char *data, size_t data_size, size_t offset, long count,
+                    int version);
@@ -1,7 +1,13 @@
 from builtins import bytes
+import array
+import bisect
+import mmap
 import struct
+import sys
+import tempfile
 import zlib
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from . import rangeio
 
 # First header flags.
 FH_FLAGS_UNINSTALL = 1
@@ -13,6 +19,9 @@ FH_FLAGS_FORCE_CRC = 8
 FH_SIG = 0xDEADBEEF
 FH_MAGICS = b'NullsoftInst'
 
+# First header is always aligned on this boundary in the installer file.
+FH_ALIGNMENT = 512
+
 # Common flags.
 CH_FLAGS_DETAILS_SHOWDETAILS = 1
 CH_FLAGS_DETAILS_NEVERSHOW = 2
@@ -105,6 +114,9 @@ DEL_RECURSE = 2
 DEL_REBOOT = 4
 DEL_SIMPLE = 8
 
+# Entry opcodes.
+EW_EXTRACTFILE = 20
+
 # Decoder
 D_LZMA = 1
 D_BZIP2 = 2
@@ -165,6 +177,7 @@ class Header(namedtuple('Header', [
                 'str_wininit'
         ])):
     blocks = []
+    block_bounds = []
     install_types = []
 
 # Block header with location and size.
@@ -204,6 +217,23 @@ class Page(namedtuple('Page', [
         ])):
     params = []
 
+# File extracted from the data block by an EW_EXTRACTFILE entry.
+DataFile = namedtuple('DataFile', [
+        'entry', # Index of the first entry extracting this data item.
+        'name', # Expanded output file name.
+        'offset', # Data item offset in the NB_DATA block.
+    ])
+
+# Installer classification returned by probe().
+Probe = namedtuple('Probe', [
+        'firstheader', # FirstHeader found.
+        'decoder', # D_* enum.
+        'solid', # Whether the header and data share one compressed stream.
+        'header_c_size', # Compressed header size, None if solid.
+        'header_u_size', # Inflated header size.
+        'data_offset', # Offset of the data following the firstheader.
+    ])
+
 CtlColors32 = namedtuple('CtlColors32', [
         'text',
         'bkc',
@@ -219,30 +249,100 @@ _header_pack = struct.Struct("<I64s10I10i{}sIIiii".format(4*(NSIS_MAX_INST_TYPES
 _blockheader_pack = struct.Struct("<II")
 _section_pack_unicode = struct.Struct("<6I{}s".format(NSIS_MAX_STRLEN*2))
 _section_pack = struct.Struct("<6I{}s".format(NSIS_MAX_STRLEN))
+_section_fields_pack = struct.Struct("<6I{}x".format(NSIS_MAX_STRLEN))
+_section_fields_pack_unicode = struct.Struct(
+        "<6I{}x".format(NSIS_MAX_STRLEN*2))
 _entry_pack = struct.Struct("<I{}s".format(MAX_ENTRY_OFFSETS*4))
+_entry_fields_pack = struct.Struct("<I{}i".format(MAX_ENTRY_OFFSETS))
 _page_pack = struct.Struct("<2I9i20s")
+_page_fields_pack = struct.Struct("<2I14i")
 _ctlcolors32_pack = struct.Struct("<6I")
 
-def _find_firstheader(nsis_file):
-    firstheader_offset = 0
-    pos = 0
-    while True:
-        chunk = nsis_file.read(32768 if firstheader_offset else 512)
-        if len(chunk) < _firstheader_pack.size:
-            return None
-
-        if firstheader_offset == 0:
+# Bytes to look for, the signature and magics following the flags field.
+_firstheader_search = struct.pack('<I', FH_SIG) + FH_MAGICS
+_firstheader_search_offset = 4
+
+# Size of the windows read from the file while looking for the first header.
+_SCAN_WINDOW_SIZE = 0x100000
+
+def _pe_overlay_offset(nsis_file):
+    """ Returns the offset following the last PE section, or None. """
+    nsis_file.seek(0)
+    dos_header = nsis_file.read(0x40)
+    if len(dos_header) < 0x40 or dos_header[:2] != b'MZ':
+        return None
+
+    pe_offset, = struct.unpack_from('<I', dos_header, 0x3c)
+    nsis_file.seek(pe_offset)
+    pe_header = nsis_file.read(24)
+    if len(pe_header) < 24 or pe_header[:4] != b'PE\0\0':
+        return None
+
+    sections_count, optional_header_size = \
+            struct.unpack_from('<H12xH', pe_header, 6)
+    nsis_file.seek(pe_offset + 24 + optional_header_size)
+    sections = nsis_file.read(sections_count * 40)
+    overlay_offset = 0
+    for i in range(len(sections) // 40):
+        raw_size, raw_offset = struct.unpack_from('<II', sections, i*40 + 16)
+        overlay_offset = max(overlay_offset, raw_offset + raw_size)
+    return overlay_offset
+
+def _search_firstheader(data, base, start):
+    """
+    Search |data|, read from offset |base| of the file, for a first header
+    aligned on FH_ALIGNMENT at or after |start|.
+    """
+    i = data.find(_firstheader_search, start + _firstheader_search_offset)
+    while i >= 0:
+        offset = i - _firstheader_search_offset
+        if (base + offset) % FH_ALIGNMENT == 0 and \
+                offset + _firstheader_pack.size <= len(data):
             firstheader = FirstHeader._make(
-                    _firstheader_pack.unpack_from(chunk))
-            firstheader.header_offset = pos
-            firstheader.data_offset = pos + _firstheader_pack.size
+                    _firstheader_pack.unpack_from(data, offset))
+            firstheader.header_offset = base + offset
+            firstheader.data_offset = base + offset + _firstheader_pack.size
+            return firstheader
+        i = data.find(_firstheader_search, i + 1)
+    return None
+
+def _find_firstheader(nsis_file, overlay=False, window_size=None):
+    """
+    Returns the FirstHeader found in |nsis_file|, or None. If |overlay| is
+    set, the search starts at the PE overlay instead of the file start. The
+    file is read by windows of |window_size| bytes, doubling up to
+    |_SCAN_WINDOW_SIZE| while nothing is found.
+    """
+    if window_size is None:
+        window_size = _SCAN_WINDOW_SIZE
+    max_window_size = max(window_size, _SCAN_WINDOW_SIZE)
+    pos = 0
+    if overlay:
+        pos = _pe_overlay_offset(nsis_file) or 0
+        pos -= pos % FH_ALIGNMENT
 
-            if firstheader.siginfo == FH_SIG and \
-                    firstheader.magics == FH_MAGICS:
-                # NSIS header found.
-                return firstheader
+    if isinstance(nsis_file, mmap.mmap):
+        return _search_firstheader(nsis_file, 0, pos)
 
-        pos += len(chunk)
+    while True:
+        # Windows overlap by a header size so one crossing a window boundary
+        # is still found.
+        nsis_file.seek(pos)
+        window = nsis_file.read(window_size + _firstheader_pack.size)
+        firstheader = _search_firstheader(window, pos, 0)
+        if firstheader is not None or len(window) <= window_size:
+            return firstheader
+        pos += window_size
+        window_size = min(window_size * 2, max_window_size)
+
+def _find_appended_firstheader(nsis_file, window_size=None):
+    """
+    Returns the FirstHeader found in |nsis_file|, or None. Installers are
+    usually appended to the PE, so the search only falls back to the file
+    start if nothing follows the PE sections.
+    """
+    return _find_firstheader(nsis_file, True, window_size) or \
+           _find_firstheader(nsis_file, False, window_size)
 
 def _is_lzma(data):
     def _is_lzma_header(data):
@@ -254,70 +354,190 @@ def _is_lzma(data):
 def _is_bzip2(data):
     return data[0] == 0x31 and data[1] < 0xe
 
-def _zlib(f, size):
-    data = f.read(size)
-    return zlib.decompress(data, -zlib.MAX_WBITS)
-
-def _bzip2(f, size):
-    from nrs.ext import bzlib
-    data = f.read(size)
-    return bytes(bzlib.decompress(data))
+# Size of the compressed chunks read while streaming inflated data.
+_INFLATE_CHUNK_SIZE = 0x10000
+
+class _InflateStream(object):
+    """
+    Read-only stream of the data inflated by |decoder| from |f|, starting at
+    |offset|, or of stored data if |decoder| is None. At most |size|
+    compressed bytes are read if set. Reads are positioned so several streams
+    can share the same file.
+    """
+
+    def __init__(self, f, offset, decoder, size=None):
+        self._f = f
+        self._pos = offset
+        self._remaining = size
+        self._data = b''
+        self.decompressor = _decompressor(decoder, self._read_input)
+
+    def _read_input(self, size=None):
+        if size is None:
+            size = _INFLATE_CHUNK_SIZE
+        if self._remaining is not None:
+            size = min(size, self._remaining)
+        if size <= 0:
+            return b''
+        self._f.seek(self._pos)
+        data = self._f.read(size)
+        self._pos += len(data)
+        if self._remaining is not None:
+            self._remaining -= len(data)
+        return data
+
+    def read(self, size=-1):
+        """
+        Returns |size| inflated bytes, or everything left if negative. Less
+        bytes are returned only at the end of the stream.
+        """
+        if size < 0:
+            chunks = []
+            chunk = self.read(_INFLATE_CHUNK_SIZE)
+            while chunk:
+                chunks.append(chunk)
+                chunk = self.read(_INFLATE_CHUNK_SIZE)
+            return b''.join(chunks)
+
+        # |decompressor| is either zlib-like, keeping input left over in
+        # |unconsumed_tail|, or lzma-like, buffering it until |needs_input|.
+        decompressor = self.decompressor
+        out = bytearray()
+        while len(out) < size and not _at_eof(decompressor):
+            if not self._data and getattr(decompressor, 'needs_input', True):
+                self._data = self._read_input()
+            chunk = decompressor.decompress(self._data, size - len(out))
+            if not self._data and not chunk:
+                break
+            out += chunk
+            self._data = getattr(decompressor, 'unconsumed_tail', b'')
+        return bytes(out)
+
+    def skip(self, size):
+        """ Inflate and discard |size| bytes. Returns the skipped size. """
+        skipped = 0
+        while skipped < size:
+            chunk = self.read(min(size - skipped, _INFLATE_CHUNK_SIZE))
+            if not chunk:
+                break
+            skipped += len(chunk)
+        return skipped
+
+def _at_eof(decompressor):
+    # Python 2 zlib decompressors have no |eof|, input past the end of the
+    # stream is kept in |unused_data| instead.
+    return getattr(decompressor, 'eof', False) or \
+            bool(getattr(decompressor, 'unused_data', b''))
+
+class _StoredData(object):
+    """ Decompressor-like object for data stored without compression. """
+    eof = False
+    unconsumed_tail = b''
+
+    def decompress(self, data, max_length):
+        self.unconsumed_tail = data[max_length:]
+        return bytes(data[:max_length])
+
+def _decompressor(decoder, read):
+    if decoder is None:
+        return _StoredData()
+    elif decoder == D_LZMA:
+        import lzma
+        props = lzma._decode_filter_properties(lzma.FILTER_LZMA1, read(5))
+        return lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=[props])
+    elif decoder == D_BZIP2:
+        from nrs.ext import bzlib
+        return bzlib.BzDecompressor()
+    else:
+        return zlib.decompressobj(-zlib.MAX_WBITS)
 
-def _lzma(f, size):
-    import lzma
-    data = f.read()
-    props = lzma._decode_filter_properties(lzma.FILTER_LZMA1, data[0:5])
-    return lzma.decompress(data[5:], lzma.FORMAT_RAW, filters=[props])
+# Bytes read after the firstheader to detect the compression method.
+_PROBE_SIZE = 0xc
 
-def inflate_header(nsis_file, data_offset):
-    nsis_file.seek(data_offset)
-    chunk = bytes(nsis_file.read(0xc))
+def _detect_compression(chunk):
+    """
+    Returns the (size prefix, decoder, solid) of the header compressed in
+    the |chunk| following the firstheader. The size prefix has the
+    compression flag masked out in non-solid installers.
+    """
     data_size = struct.unpack_from('<I', chunk)[0]
-    solid = True
-    decoder = None
-
     if _is_lzma(chunk):
-        decoder = D_LZMA
+        return data_size, D_LZMA, True
     elif chunk[3] == 0x80:
-        solid = False
+        data_size &= 0x7fffffff
         if _is_lzma(chunk[4:]):
-            decoder = D_LZMA
+            return data_size, D_LZMA, False
         elif _is_bzip2(chunk[4:]):
-            decoder = D_BZIP2
-        else:
-            decoder = D_ZLIB
+            return data_size, D_BZIP2, False
+        return data_size, D_ZLIB, False
     elif _is_bzip2(chunk):
-        decoder = D_BZIP2
-    else:
-        decoder = D_ZLIB
+        return data_size, D_BZIP2, True
+    return data_size, D_ZLIB, True
+
+def probe(nsis_file):
+    """
+    Classify the installer in |nsis_file| without inflating anything. Returns
+    a Probe, or None if no firstheader is found.
+    """
+    firstheader = _find_firstheader(nsis_file)
+    if firstheader is None:
+        return None
+    nsis_file.seek(firstheader.data_offset)
+    chunk = bytes(nsis_file.read(_PROBE_SIZE))
+    if len(chunk) < _PROBE_SIZE:
+        return None
+    data_size, decoder, solid = _detect_compression(chunk)
+    return Probe(firstheader, decoder, solid,
+                 None if solid else data_size, firstheader.u_size,
+                 firstheader.data_offset)
 
-    if solid:
-        deflated_data = nsis_file.seek(data_offset)
-    else:
-        nsis_file.seek(data_offset+4)
-        data_size &= 0x7fffffff
+def inflate_header(nsis_file, data_offset):
+    return _inflate_header(nsis_file, data_offset)[:4]
 
-    if decoder == D_LZMA:
-        inflated_data = _lzma(nsis_file, data_size)
-    elif decoder == D_BZIP2:
-        inflated_data = _bzip2(nsis_file, data_size)
-    else:
-        inflated_data = _zlib(nsis_file, data_size)
+def _inflate_header(nsis_file, data_offset):
+    """
+    Same as inflate_header, also returning the count of bytes read from
+    |data_offset| to inflate the header.
+    """
+    nsis_file.seek(data_offset)
+    data_size, decoder, solid = _detect_compression(
+            bytes(nsis_file.read(_PROBE_SIZE)))
 
     if solid:
-        data_size, = struct.unpack_from('<I', inflated_data)
-        inflated_data = inflated_data[4:data_size+4]
+        # The compressed size of a solid stream is unknown, only inflate the
+        # size prefix and the header it announces.
+        stream = _InflateStream(nsis_file, data_offset, decoder)
+        data_size, = struct.unpack('<I', stream.read(4))
+        inflated_data = stream.read(data_size)
+    else:
+        stream = _InflateStream(nsis_file, data_offset+4, decoder, data_size)
+        inflated_data = stream.read()
 
-    return inflated_data, data_size, decoder, solid
+    return inflated_data, data_size, decoder, solid, stream._pos - data_offset
 
 def _extract_header(nsis_file, firstheader):
-    inflated_data, data_size, decoder, solid = inflate_header(nsis_file, firstheader.data_offset)
+    inflated_data, data_size, decoder, solid, read_size = \
+            _inflate_header(nsis_file, firstheader.data_offset)
+    firstheader._raw_header_read_size = read_size
+    return _load_header(firstheader, inflated_data, data_size, decoder, solid)
+
+def _load_header(firstheader, inflated_data, data_size, decoder, solid):
+    """
+    Parse the header of |firstheader| from its |inflated_data|, as returned
+    by inflate_header.
+    """
     header = Header._make(_header_pack.unpack_from(inflated_data))
     header.solid = solid
     header.decoder = decoder
     firstheader.header = header
     firstheader._raw_header = bytes(inflated_data)
     firstheader._raw_header_c_size = data_size
+    if solid:
+        # Offset of the data block in the inflated solid stream.
+        firstheader._data_block_offset = 4 + data_size
+    else:
+        firstheader._data_block_offset = \
+                firstheader.data_offset + 4 + data_size
 
     # Parse the block headers.
     block_headers = []
@@ -327,6 +547,7 @@ def _extract_header(nsis_file, firstheader):
             header.raw_blocks[header_offset:]))
         block_headers.append(block_header)
     header.blocks = block_headers
+    header.block_bounds = _block_bounds(block_headers, len(inflated_data))
 
     # Parse the install types.
     header.install_types = [
@@ -336,41 +557,331 @@ def _extract_header(nsis_file, firstheader):
     return header
 
 def _extract_block(nsis_file, firstheader, block_id):
+    """
+    Returns the |block_id| block of the installer. NB_DATA is not part of the
+    inflated header: it is the raw data following the header, compressed
+    items of non-solid installers or the whole compressed stream, header
+    included, of solid ones. Use _iter_data_item() to inflate its items.
+    """
     header = firstheader.header
     if block_id == NB_DATA:
-        nsis_file.seek(firstheader.data_offset + firstheader._raw_header_c_size)
+        # Solid data items are only addressable in the inflated stream, which
+        # starts with the header.
+        if header.solid:
+            data_offset = firstheader.data_offset
+        else:
+            data_offset = firstheader._data_block_offset
+        if isinstance(nsis_file, mmap.mmap):
+            return memoryview(nsis_file)[data_offset:]
+        nsis_file = rangeio.staged(nsis_file, rangeio.STAGE_BLOCK)
+        nsis_file.seek(data_offset)
         return nsis_file.read()
 
-    return firstheader._raw_header[header.blocks[block_id].offset:]
+    start, end = header.block_bounds[block_id]
+    return firstheader._raw_header[start:end]
+
+def _block_bounds(blocks, size):
+    """
+    Returns the (start, end) bounds of |blocks| in an inflated header of
+    |size| bytes. A block ends where the next one in the header starts, or at
+    the end of the header. Blocks are written in order, so a block sharing
+    its offset with a later one is empty. Blocks at offset 0 are absent and
+    empty.
+    """
+    offsets = sorted(set(b.offset for b in blocks if 0 < b.offset < size))
+    offsets.append(size)
+    bounds = []
+    for i, block in enumerate(blocks):
+        if block.offset <= 0:
+            bounds.append((0, 0))
+        elif block.offset >= size:
+            bounds.append((size, size))
+        elif any(b.offset == block.offset for b in blocks[i+1:]):
+            bounds.append((block.offset, block.offset))
+        else:
+            end = offsets[bisect.bisect_right(offsets, block.offset)]
+            bounds.append((block.offset, end))
+    return bounds
+
+# Size of the chunks yielded while extracting data items.
+_EXTRACT_CHUNK_SIZE = 0x100000
+
+def _iter_data_item(nsis_file, firstheader, offset):
+    """
+    Yields the inflated content of the data item at |offset| of the NB_DATA
+    block, in chunks.
+    """
+    header = firstheader.header
+    if header.solid:
+        # Items are size prefixed and stored as is in the solid stream.
+        stream = _InflateStream(nsis_file, firstheader.data_offset,
+                                header.decoder)
+        stream.skip(firstheader._data_block_offset + offset)
+        size = stream.read(4)
+    else:
+        item_offset = firstheader._data_block_offset + offset
+        nsis_file.seek(item_offset)
+        size = nsis_file.read(4)
+    if len(size) < 4:
+        return
+    size, = struct.unpack('<I', size)
+
+    if not header.solid:
+        if size & 0x80000000:
+            # Each item is compressed on its own in non-solid installers.
+            stream = _InflateStream(nsis_file, item_offset + 4,
+                                    header.decoder, size & 0x7fffffff)
+            size = None
+        else:
+            stream = _InflateStream(nsis_file, item_offset + 4, None, size)
+
+    while size is None or size > 0:
+        chunk_size = _EXTRACT_CHUNK_SIZE
+        if size is not None:
+            chunk_size = min(chunk_size, size)
+            size -= chunk_size
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+_SOLID_WINDOW_SIZE = 0x100000
+_SOLID_CACHE_WINDOWS = 16
+
+class _SolidReader(object):
+    """
+    Random access to the data items of a solid installer. The solid stream
+    is inflated forward, recording the offset and size of every item it goes
+    through in |items|. If |spill| is set, inflated data is written to a
+    temporary file so the stream is inflated at most once. Otherwise the
+    last |cache_size| windows of inflated data are kept in memory and the
+    stream is only restarted to read data behind them.
+    """
+
+    def __init__(self, nsis_file, firstheader, spill=True,
+                 cache_size=_SOLID_CACHE_WINDOWS):
+        self.items = OrderedDict()
+        """ Size of the data items found so far, by offset. """
+
+        self.passes = 0
+        """ Number of times the solid stream was (re)started. """
+
+        self._nsis_file = nsis_file
+        self._firstheader = firstheader
+        self._spill = tempfile.TemporaryFile() if spill else None
+        self._windows = OrderedDict()
+        self._cache_size = cache_size
+        self._stream = None
+        self._inflated = 0
+        self._next_item = 0
+        self._prefix = b''
+
+    def close(self):
+        """ Release the spill file and cached windows. """
+        if self._spill is not None:
+            self._spill.close()
+        self._windows.clear()
+        self._stream = None
+
+    def iter_item(self, offset):
+        """
+        Yields the content of the data item at |offset| of the NB_DATA block,
+        in chunks.
+        """
+        size = self.items.get(offset)
+        if size is None:
+            prefix = self._read(offset, 4)
+            if len(prefix) < 4:
+                return
+            size, = struct.unpack('<I', prefix)
+
+        position = offset + 4
+        end = position + size
+        while position < end:
+            chunk = self._read(position,
+                               min(_EXTRACT_CHUNK_SIZE, end - position))
+            if not chunk:
+                break
+            position += len(chunk)
+            yield chunk
+
+    def _restart(self):
+        self._stream = _InflateStream(self._nsis_file,
+                                      self._firstheader.data_offset,
+                                      self._firstheader.header.decoder)
+        self._stream.skip(self._firstheader._data_block_offset)
+        self._inflated = 0
+        self.passes += 1
+
+    def _inflate(self):
+        """ Inflate the next window of the data block, b'' at its end. """
+        if self._stream is None:
+            self._restart()
+        chunk = self._stream.read(_SOLID_WINDOW_SIZE)
+        self._record(chunk, self._inflated)
+        self._inflated += len(chunk)
+        return chunk
+
+    def _record(self, chunk, position):
+        # Walk the size prefixes of the items covered by |chunk|, a prefix can
+        # be split across two windows. Items already seen before a restart
+        # are before |_next_item| and skipped.
+        end = position + len(chunk)
+        while self._next_item + len(self._prefix) < end:
+            start = self._next_item + len(self._prefix) - position
+            self._prefix += chunk[start:start + 4 - len(self._prefix)]
+            if len(self._prefix) < 4:
+                break
+            size, = struct.unpack('<I', self._prefix)
+            self.items[self._next_item] = size
+            self._next_item += 4 + size
+            self._prefix = b''
+
+    def _read(self, position, size):
+        if self._spill is not None:
+            while self._inflated < position + size:
+                chunk = self._inflate()
+                if not chunk:
+                    break
+                self._spill.seek(self._inflated - len(chunk))
+                self._spill.write(chunk)
+            self._spill.seek(position)
+            return self._spill.read(size)
+
+        out = []
+        end = position + size
+        while position < end:
+            index = position // _SOLID_WINDOW_SIZE
+            window = self._window(index)
+            start = position - index * _SOLID_WINDOW_SIZE
+            chunk = window[start:start + end - position]
+            if not chunk:
+                break
+            out.append(chunk)
+            position += len(chunk)
+        return b''.join(out)
+
+    def _window(self, index):
+        window = self._windows.get(index)
+        if window is not None:
+            # Python 2 OrderedDict has no move_to_end.
+            self._windows[index] = self._windows.pop(index)
+            return window
+
+        if self._stream is None or index * _SOLID_WINDOW_SIZE < self._inflated:
+            self._restart()
+        while True:
+            current = self._inflated // _SOLID_WINDOW_SIZE
+            window = self._inflate()
+            if not window:
+                return b''
+            self._windows[current] = window
+            if len(self._windows) > self._cache_size:
+                self._windows.popitem(last=False)
+            if current == index:
+                return window
+
+def _iter_unpack(pack, data):
+    if hasattr(pack, 'iter_unpack'):
+        return pack.iter_unpack(data)
+    # Python 2 Struct has no iter_unpack.
+    return (pack.unpack_from(data, offset)
+                for offset in range(0, len(data), pack.size))
 
 def _parse_sections(block, n, unicode=False):
-    section_pack = _section_pack_unicode if unicode else _section_pack
-    bsize = section_pack.size
-    return [Section._make(section_pack.unpack_from(block[i * bsize:]))
-                for i in range(n)]
+    # Fields are unpacked in one pass over the records, skipping the names.
+    # Names are sliced from |block| so they are views if it is a memoryview.
+    fields_pack = _section_fields_pack_unicode if unicode \
+                    else _section_fields_pack
+    bsize = fields_pack.size
+    name_offset = 6 * 4
+    n = min(n, len(block) // bsize)
+    sections = []
+    for i, fields in enumerate(_iter_unpack(fields_pack, block[:n * bsize])):
+        offset = i * bsize
+        name = block[offset + name_offset:offset + bsize]
+        sections.append(Section._make(fields + (name,)))
+
+    return sections
+
+def _int32_array(block):
+    """
+    Returns the little endian int32 values of |block|, as a memoryview over
+    it when the host byte order allows it, otherwise as an array copy.
+    """
+    if sys.byteorder == 'little':
+        try:
+            return memoryview(block).cast('B').cast('i')
+        except (TypeError, AttributeError):
+            # Python 2 memoryview has no cast.
+            pass
+    values = array.array('i')
+    if hasattr(values, 'frombytes'):
+        values.frombytes(bytes(block))
+    else:
+        values.fromstring(bytes(block))
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+class EntryTable(object):
+    """
+    Installer entries of the NB_ENTRIES |block|, as one int32 array of |n|
+    rows. |which| and |offsets| are columns over the array, Entry tuples are
+    only built when an entry is indexed.
+    """
+
+    def __init__(self, block, n):
+        bsize = _entry_pack.size
+        n = min(n, len(block) // bsize)
+        self.block = block[:n * bsize]
+        self._fields = _int32_array(self.block)
+        self._row_size = bsize // 4
+
+        self.which = self._fields[0::self._row_size]
+        """ EW_* enum of every entry. """
+
+        self.offsets = [self._fields[i+1::self._row_size]
+                            for i in range(MAX_ENTRY_OFFSETS)]
+        """ One column per entry parameter, |offsets[i][n]| of entry |n|. """
+
+    def __len__(self):
+        return len(self.which)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('entry index out of range')
+        row = index * self._row_size
+        offset = row * 4
+        entry = Entry(self.which[index] & 0xffffffff,
+                      self.block[offset + 4:offset + _entry_pack.size])
+        entry.offsets = self._fields[row + 1:row + self._row_size].tolist()
+        return entry
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
 
 def _parse_entries(block, n):
-    bsize = _entry_pack.size
-    entries = []
-    for i in range(n):
-        entry = Entry._make(_entry_pack.unpack_from(block[i * bsize:]))
-        # Parse the install types.
-        entry.offsets = [
-            struct.unpack_from('<i', entry.raw_offsets[j:])[0]
-                for j in range(0, len(entry.raw_offsets), 4)]
-        entries.append(entry)
-
-    return entries
+    return EntryTable(block, n)
 
 def _parse_pages(block, n):
+    # Parameters are unpacked along with the other fields, the raw ones are
+    # sliced from |block|.
     bsize = _page_pack.size
+    params_offset = bsize - 20
+    n = min(n, len(block) // bsize)
     pages = []
-    for i in range(n):
-        page = Page._make(_page_pack.unpack_from(block[i * bsize:]))
-        # Parse the install types.
-        page.params = [
-            struct.unpack_from('<i', page.raw_params[j:])[0]
-                for j in range(0, len(page.raw_params), 4)][::-1]
+    for i, fields in enumerate(_iter_unpack(_page_fields_pack,
+                                            block[:n * bsize])):
+        offset = i * bsize
+        page = Page._make(fields[:11] +
+                          (block[offset + params_offset:offset + bsize],))
+        page.params = list(reversed(fields[11:]))
         pages.append(page)
 
     return pages
@@ -0,0 +1,39 @@
+from . import fileform
+
+def _flag_table(prefix):
+    """
+    Returns the fileform constants named |prefix|*, as (value, name) pairs
+    sorted by value.
+    """
+    return sorted((value, name) for name, value in vars(fileform).items()
+                    if name.startswith(prefix) and isinstance(value, int))
+
+def _enum_table(prefix):
+    """ Returns the names of the constants named |prefix|*, by value. """
+    return dict(_flag_table(prefix))
+
+# Flag tables.
+FH_FLAGS = _flag_table('FH_FLAGS_')
+CH_FLAGS = _flag_table('CH_FLAGS_')
+SF_FLAGS = _flag_table('SF_')
+PF_FLAGS = _flag_table('PF_')
+CC_FLAGS = _flag_table('CC_')
+DEL_FLAGS = _flag_table('DEL_')
+
+# Enum tables.
+NB_ENUM = _enum_table('NB_')
+CB_ENUM = _enum_table('CB_')
+PWP_ENUM = _enum_table('PWP_')
+D_ENUM = _enum_table('D_')
+
+def flag_names(value, table):
+    """ Returns the names of the flags of |table| set in |value|. """
+    return [name for flag, name in table if value & flag]
+
+def format_flags(value, table, separator=' | '):
+    """ Returns the names of the flags set in |value|, joined. """
+    return separator.join(flag_names(value, table))
+
+def enum_name(value, table, default=None):
+    """ Returns the name of |value| in the enum |table|, or |default|. """
+    return table.get(value, default)
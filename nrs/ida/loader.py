@@ -14,7 +14,7 @@ BLOCKS = [
     ('LANGTABLES', fileform.NB_LANGTABLES, 'DATA'),
     ('CTLCOLORS', fileform.NB_CTLCOLORS, 'DATA'),
     ('BGFONT', fileform.NB_BGFONT, 'DATA'),
-    ('DATA', fileform.NB_DATA, 'DATA'),
+    # NB_DATA is not mapped, it is compressed data outside of the header.
 ]
 
 allowed_name_char = string.ascii_letters + string.digits + '$'
@@ -5,6 +5,7 @@ import struct
 import string
 import nrs.strings
 import nrs.fileform
+import nrs.disasm
 import nrs
 
 allowed_name_char = string.ascii_letters + string.digits + '$'
@@ -26,7 +27,7 @@ def str_to_number(sym):
     except:
         return None
 
-STR_LANG_FLAG = 1 << 31
+STR_LANG_FLAG = nrs.disasm.STR_LANG_FLAG
 OP_SIZE = 4
 INST_SIZE = 7 * OP_SIZE
 
@@ -118,15 +119,15 @@ class NsisProcessor(processor_t):
         'a_sizeof_fmt': 'size %s',
     } # Assembler.
 
-    INTOP_SYM = ['+','-','*','/','|','&','^','!','||','&&','%','<<','>>']
+    INTOP_SYM = nrs.disasm.INTOP_SYM
 
     # NSIS specific flags.
-    FLo_IntOp =       0x01
-    FLo_PluginCall =  0x02
+    FLo_IntOp =       nrs.disasm.FLo_IntOp
+    FLo_PluginCall =  nrs.disasm.FLo_PluginCall
 
-    FLa_CheckNoFlow = 0x04
-    FLa_NoFlow =      0x08
-    FLa_StackArgs =   0x10
+    FLa_CheckNoFlow = nrs.disasm.FLa_CheckNoFlow
+    FLa_NoFlow =      nrs.disasm.FLa_NoFlow
+    FLa_StackArgs =   nrs.disasm.FLa_StackArgs
 
     def rebase_string_addr(self, addr):
         if addr & STR_LANG_FLAG:
@@ -467,61 +468,6 @@ class NsisProcessor(processor_t):
             self.cmd.auxpref |= self.FLa_NoFlow
         return True
 
-    def virt_pushpop(self, opcode, params):
-        if params[1]:
-            return self.itype_POP
-        elif params[2]:
-            return self.itype_EXCH
-        else:
-            return self.itype_PUSH
-
-    def virt_setflag(self, opcode, params):
-        if params[0] == 2 and params[1] == 0xac:
-            return self.itype_CLEARERRORS
-        return opcode
-
-    def virt_ifflag(self, opcode, params):
-        if params[1] == 0 and params[2] == 2 and params[3] == 0:
-            return self.itype_IFERRORS
-        return opcode
-
-    def virt_strcpy(self, opcode, params):
-        if params[2] == 0 and params[3] == 0:
-            return self.itype_ASSIGNVAR
-        return opcode
-
-    def virt_showwindow(self, opcode, params):
-        if params[2]:
-            return self.itype_HIDEWINDOW
-        elif params[3]:
-            return self.itype_ENABLEWINDOW
-        return opcode
-
-    def virt_delreg(self, opcode, params):
-        if params[4]:
-            return self.itype_DELETEREGKEY
-        return self.itype_DELETEREGVALUE
-
-    def virt_regenum(self, opcode, params):
-        if params[4]:
-            return self.itype_REGENUMKEY
-        return self.itype_REGENUMVALUE
-
-    def virt_fwrite(self, opcode, params):
-        if params[2]:
-            return self.itype_FILEWRITEBYTE
-        return self.itype_FILEWRITE
-
-    def virt_fread(self, opcode, params):
-        if params[3]:
-            return self.itype_FILEREADBYTE
-        return self.itype_FILEREAD
-
-    def virt_log(self, opcode, params):
-        if params[0]:
-            return self.itype_LOGSET
-        return self.itype_LOGTEXT
-
     def init_instructions(self):
         class idef:
             def __init__(self, name, cf=0, d='', v=None, ap=0):
@@ -531,98 +477,21 @@ class NsisProcessor(processor_t):
                 self.v = v
                 self.ap = ap
 
-        i_invalid = idef(name='INVALID')
-        def notimplemented(n):
-            return idef(name='NotImplemented_' + hex(n))
-
-        self.itable = [
-            i_invalid, # 0x00
-            idef(name='Return', d='', cf=CF_STOP), # 0x01
-            idef(name='Jmp', d='J', cf=CF_USE1, ap=self.FLa_CheckNoFlow), # 0x02
-            idef(name='Abort', d='I', cf=CF_USE1|CF_STOP), # 0x03
-            idef(name='Quit', cf=CF_STOP), #0x04
-            idef(name='Call', d='J', cf=CF_USE1|CF_CALL), # 0x05
-            idef(name='UpdateText', d='S', cf=CF_USE1), # 0x06
-            idef(name='Sleep', d='I', cf=CF_USE1), # 0x07
-            idef(name='BringToFront'), # 0x08
-            idef(name='ChDetailsView', d='SS', cf=CF_USE1|CF_USE2), # 0x09
-            idef(name='SetFileAttributes', d='SI', cf=CF_USE1|CF_USE2), # 0x0a
-            idef(name='CreateDir', d='SI', cf=CF_USE1|CF_USE2), # 0x0b
-            idef(name='IfFileExists', d='SJJ', cf=CF_USE1|CF_USE2|CF_USE3, ap=self.FLa_CheckNoFlow), # 0x0c
-            idef(name='SetFlag', d='IS', v=self.virt_setflag, cf=CF_USE1|CF_USE2), # 0x0d
-            idef(name='IfFlag', d='JJII',v=self.virt_ifflag, cf=CF_USE1|CF_USE2|CF_USE3|CF_USE4, ap=self.FLa_CheckNoFlow), # 0x0e
-            idef(name='GetFlag', d='VI', cf=CF_CHG1|CF_USE2), # 0x0f
-            idef(name='Rename', d='SSIS', cf=CF_CHG1|CF_USE2|CF_USE3|CF_USE4), # 0x10
-            idef(name='GetFullPathName', d='SVI', cf=CF_USE1|CF_CHG2|CF_USE3), # 0x11
-            idef(name='SearchPath', d='VS', cf=CF_CHG1|CF_USE2), # 0x12
-            idef(name='GetTempFilename', d='VS', cf=CF_CHG1|CF_USE2), # 0x13
-            idef(name='ExtractFile', d='ISIIII', cf=CF_USE1|CF_USE2|CF_USE3|CF_USE4|CF_USE5|CF_USE6), # 0x14
-            idef(name='DeleteFile', d='SI', cf=CF_USE1|CF_USE2), # 0x15
-            idef(name='MessageBox', d='ISIJIJ', cf=CF_USE1|CF_USE2|CF_USE3|CF_USE4|CF_USE5), # 0x16
-            idef(name='RmDir', d='SI', cf=CF_USE1|CF_USE2), # 0x17
-            idef(name='StrLe', d='VS', v=self.virt_setflag, cf=CF_CHG1|CF_USE2), # 0x18
-            idef(name='StrCpy', d='VSSS', v=self.virt_strcpy, cf=CF_CHG1|CF_USE2|CF_USE3|CF_USE4), # 0x19
-            idef(name='StrCmp', d='SSJJI', cf=CF_USE1|CF_USE2|CF_USE3|CF_USE4|CF_USE5, ap=self.FLa_CheckNoFlow), # 0x1a
-            idef(name='ReadEnv', d='VSI', cf=CF_CHG1|CF_USE2|CF_USE3), # 0x1b
-            idef(name='IntCmp', d='SSJJJI', cf=CF_USE1|CF_USE2|CF_USE3|CF_USE4|CF_USE5|CF_USE6, ap=self.FLa_CheckNoFlow), # 0x1c
-            idef(name='IntOp', d='VSSO', cf=CF_CHG1|CF_USE2|CF_USE3|CF_USE4), # 0x1d
-            idef(name='IntFmt', d='VSS', cf=CF_CHG1|CF_USE2|CF_USE3), # 0x1d
-            idef(name='PushPop', v=self.virt_pushpop), # 0x1f
-            idef(name='FindWindow', d='VSSSS', cf=CF_CHG1|CF_USE2|CF_USE3|CF_USE4|CF_USE5), # 0x20
-            idef(name='SendMessage', d='VSSSS2', cf=CF_CHG1|CF_USE2|CF_USE3|CF_USE4|CF_USE5|CF_USE6), # 0x21
-            idef(name='IsWindow', d='SJJ', cf=CF_USE1|CF_USE2|CF_USE3, ap=self.FLa_CheckNoFlow), # 0x22
-            idef(name='GetDlgItem', d='VSS', cf=CF_CHG1|CF_USE2|CF_USE3), # 0x23
-            idef(name='SetCtlColors', d='SI', cf=CF_USE1|CF_USE2), # 0x24
-            idef(name='SetBrandingImage', d='SII', cf=CF_USE1|CF_USE2), # 0x25
-            idef(name='CreateFont', d='VSSSI', cf=CF_CHG1|CF_USE2|CF_USE3|CF_USE4|CF_USE5), # 0x26
-            idef(name='ShowWindow', d='SS', v=self.virt_showwindow, cf=CF_USE1|CF_USE2), # 0x27
-            idef(name='ShellExec', d='SSSS', cf=CF_USE1|CF_USE2|CF_USE3|CF_USE4), # 0x28
-            idef(name='Execute', d='SII', cf=CF_USE1|CF_USE2|CF_USE3), # 0x29
-            idef(name='GetFileTime', d='VVS', cf=CF_CHG1|CF_CHG2|CF_USE3), # 0x2a
-            idef(name='GetDLLVersion', d='VVS', cf=CF_CHG1|CF_CHG2|CF_USE3), # 0x2b
-            idef(name='RegisterDLL', d='SSSI', cf=CF_USE1|CF_USE2|CF_USE3|CF_USE4), # 0x2c
-            idef(name='CreateShortcut', d='SSSSS', cf=CF_USE1|CF_USE2|CF_USE3|CF_USE4|CF_USE5), # 0x2d
-            idef(name='CopyFiles', d='SSS', cf=CF_USE1|CF_USE2|CF_USE3), # 0x2e
-            idef(name='Reboot'), # 0x2f
-            idef(name='WriteIni', d='SSSS', cf=CF_USE1|CF_USE2|CF_USE3|CF_USE4), # 0x30
-            idef(name='ReadIni', d='VSSS', cf=CF_CHG1|CF_USE2|CF_USE3|CF_USE4), # 0x31
-            idef(name='DeleteRegKey', d='ISSS', v=self.virt_delreg, cf=CF_USE1|CF_USE2|CF_USE3|CF_USE4), # 0x32
-            idef(name='WriteRegValue', d='ISSII', cf=CF_USE1|CF_USE2|CF_USE3|CF_USE4|CF_USE5), # 0x33
-            idef(name='ReadRegValue', d='VISSI', cf=CF_CHG1|CF_USE2|CF_USE3|CF_USE4|CF_USE5), # 0x34
-            idef(name='RegEnumKey', d='VISS', v=self.virt_regenum, cf=CF_CHG1|CF_USE2|CF_USE3|CF_USE4), # 0x35
-            idef(name='FileClose', d='V', cf=CF_USE1), # 0x36
-            idef(name='FileOpen', d='VIIS', cf=CF_CHG1|CF_USE2|CF_USE3|CF_USE4), # 0x37
-            idef(name='FileWrite', d='VS', v=self.virt_fwrite, cf=CF_USE1|CF_USE2), # 0x38
-            idef(name='FileRead', d='VVS', v=self.virt_fread, cf=CF_USE1|CF_CHG2|CF_USE3), # 0x39
-            idef(name='FileSeek', d='VVSI', cf=CF_USE1|CF_CHG2|CF_USE3|CF_USE4), # 0x3a
-            idef(name='FindClose', d='V', cf=CF_USE1), # 0x3b
-            idef(name='FindNext', d='VV', cf=CF_CHG1|CF_USE2), # 0x3c
-            idef(name='FindFirst', d='VVS', cf=CF_CHG1|CF_CHG2|CF_USE3), # 0x3d
-            idef(name='WriteUninstaller', d='SIIS', cf=CF_USE1|CF_USE2|CF_USE3|CF_USE4), # 0x3e
-            idef(name='LogText', d='S', v=self.virt_log, cf=CF_USE1), # 0x3f
-            idef(name='SectionSet', d='SII', cf=CF_USE1|CF_USE2|CF_USE3), # 0x40
-            idef(name='InstTypeSet', d='SIII', cf=CF_USE1|CF_USE2|CF_USE3|CF_USE4), # 0x41
-            idef(name='GetLabelAddr'), # 0x42
-            idef(name='GetFunctionAddr'), # 0x43
-            idef(name='LockWindow', d='I', cf=CF_USE1), # 0x44
-        ]
-
-        self.itable += [
-            idef(name='Push', d='S', cf=CF_USE1),
-            idef(name='Pop', d='V', cf=CF_CHG1),
-            idef(name='Exch', d='I', cf=CF_USE1|CF_CHG1),
-            idef(name='ClearErrors'),
-            idef(name='IfErrors', d='J', cf=CF_USE1),
-            idef(name='AssignVar', d='VS', cf=CF_CHG1|CF_USE2),
-            idef(name='EnableWindow', d='SS', cf=CF_USE1|CF_USE2),
-            idef(name='HideWindow', d='SS', cf=CF_USE1|CF_USE2),
-            idef(name='DeleteRegValue', d='ISSS', cf=CF_USE1|CF_USE2|CF_USE3|CF_USE4),
-            idef(name='RegEnumValue', d='VISS', cf=CF_CHG1|CF_USE2|CF_USE3|CF_USE4),
-            idef(name='FileWriteByte', d='VS', cf=CF_USE1|CF_USE2),
-            idef(name='FileReadByte', d='VV', cf=CF_USE1|CF_CHG2),
-            idef(name='LogSet', d='I', cf=CF_USE1),
-            idef(name='PluginCall', cf=CF_USE1|CF_USE2|CF_USE3),
-        ]
+        use = [CF_USE1, CF_USE2, CF_USE3, CF_USE4, CF_USE5, CF_USE6]
+        chg = [CF_CHG1, CF_CHG2, CF_CHG3, CF_CHG4, CF_CHG5, CF_CHG6]
+        flow = {nrs.disasm.FLOW_STOP: CF_STOP, nrs.disasm.FLOW_CALL: CF_CALL}
+
+        # The opcode table is shared with the IDA-independent disassembler.
+        self.itable = []
+        for x in nrs.disasm.OPCODES:
+            cf = flow.get(x.flow, 0)
+            for i, access in enumerate(x.access):
+                if access in 'rx':
+                    cf |= use[i]
+                if access in 'wx':
+                    cf |= chg[i]
+            self.itable.append(idef(name=x.name, cf=cf, d=x.operands,
+                                    v=x.virtual, ap=x.aux))
 
         # Now create an instruction table compatible with IDA processor module requirements
         instructions = []
@@ -1,6 +1,10 @@
+import os
 import re
+import mmap as _mmap
+import struct
 from builtins import bytes
-from . import fileform, strings
+from . import cfg, disasm, fileform, plugins, rangeio, strings, \
+        version
 
 from .fileform import NB_BGFONT, NB_DATA, NB_PAGES, NB_ENTRIES, NB_ENTRIES, \
                       NB_STRINGS, NB_SECTIONS, NB_CTLCOLORS, NB_LANGTABLES
@@ -8,146 +12,531 @@ from .fileform import NB_BGFONT, NB_DATA, NB_PAGES, NB_ENTRIES, NB_ENTRIES, \
 def _flatten(l):
     return [i for sl in l for i in sl]
 
+def _safe_path(name):
+    """
+    Convert an NSIS file |name| to a relative path that cannot escape the
+    extraction directory.
+    """
+    parts = [p for p in re.split(r'[\\/]', name)
+                if p not in ('', '.', '..') and ':' not in p]
+    return os.path.join(*parts) if parts else '_'
+
+# Parse levels, how much of an installer is parsed when it is opened.
+# Anything not parsed yet is parsed on first access.
+PARSE_HEADER = 0 # Only locate the firstheader.
+PARSE_METADATA = 1 # Inflate the header and detect the NSIS version.
+PARSE_FULL = 2 # Also parse pages, sections and entries.
+
+# Offset of the language string offsets in a language table.
+_LANGTABLE_STRINGS_OFFSET = 10
+
+# Size of the first window searched for the firstheader of read_at sources.
+_READ_AT_WINDOW_SIZE = 0x1000
+
 class HeaderNotFound(Exception):
     pass
 
 class NSIS:
     @staticmethod
-    def from_path(path):
+    def from_path(path, mmap=False, parse_level=PARSE_FULL, cache=None):
+        """
+        Create a new NSIS instance from the installer at |path|. If |mmap| is
+        set, the file is memory mapped and data is exposed as memoryview,
+        which needs Python 3.
+        """
         with open(path, 'rb') as fd:
-            return NSIS(fd)
+            if not mmap or not os.fstat(fd.fileno()).st_size:
+                nsis = NSIS(fd, parse_level, cache)
+                nsis.path = path
+                return nsis
+            mapped = _mmap.mmap(fd.fileno(), 0, access=_mmap.ACCESS_READ)
 
-    def __init__(self, fd):
+        try:
+            nsis = NSIS(mapped, parse_level, cache)
+        except:
+            mapped.close()
+            raise
+        nsis.path = path
+        return nsis
+
+    @staticmethod
+    def from_read_at(source, parse_level=PARSE_FULL, io_hook=None):
+        """
+        Create a new NSIS instance from |source|, an object with a
+        read_at(offset, size) method returning the installer bytes in that
+        range. Reads are reported to |io_hook|(stage, offset, size) with a
+        rangeio.STAGE_* |stage|, see rangeio.IOStats. The firstheader is
+        searched from the PE overlay first so only its neighbourhood is read.
+        """
+        fd = rangeio.ReadAtFile(source, io_hook)
+        firstheader = fileform._find_appended_firstheader(
+                rangeio.staged(fd, rangeio.STAGE_FIRSTHEADER),
+                _READ_AT_WINDOW_SIZE)
+        if firstheader is None:
+            raise HeaderNotFound()
+        return NSIS(fd, parse_level, firstheader=firstheader)
+
+    @staticmethod
+    def open_async(reader, parse_level=PARSE_FULL):
+        """
+        Coroutine creating a new NSIS instance from |reader|, an object with
+        a read_at(offset, size) coroutine returning the bytes of the
+        installer in that range, less only at its end. Only the ranges needed
+        are read: use parse_async() and file_data_async() to read more of it.
+        """
+        from . import aio
+        return aio.open_nsis(reader, parse_level)
+
+    def __init__(self, fd, parse_level=PARSE_FULL, cache=None,
+                 firstheader=None):
         """
         Create a new NSIS instance given an NSIS installer loaded in |fd|.
+        If |fd| is an mmap object, blocks, sections, entries and raw strings
+        are memoryview into the mapped file or inflated header instead of
+        bytes copies. |parse_level| is a PARSE_* value, see parse(). If
+        |cache| is a cache.ParseCache, the header and strings index are
+        loaded from it, or stored in it once the header is inflated and
+        again with what was parsed by close().
+        |firstheader| skips the search if the firstheader of |fd| was already
+        found.
         """
         self._block_cache = {}
+        self._string_table = None
         self._pe = None
+        self._solid_reader = None
+        self._data_fd = None
+        self._cache_key = None
+        self._views = isinstance(fd, _mmap.mmap)
+        self._header = None
+        self._raw_header = None
+        self._version = None
+        self._build = None
+        self._pages = None
+        self._sections = None
+        self._entries = None
+        self._instructions = None
+        self._control_flow = None
+        self._call_graph = None
+        self._plugin_calls = None
 
         self.fd = fd
         """ Parsed installer file. """
 
+        self.cache = cache
+        """ ParseCache holding parsed installers, or None. """
+
+        self.reader = None
+        """ Ranged reader of an installer opened with open_async. """
+
+        self.path = None
+        """ Installer path, reopened to read data once |fd| is closed. """
+
+        self.raw = memoryview(fd) if self._views else None
+        """ Memory view over the whole installer file, if memory mapped. """
+
         self.firstheader = None
         """ Firstheader structure found at the beginning of the NSIS blob. """
 
-        self.header = None
+        self.solid_spill = True
+        """
+        Spill the inflated data of solid installers to a temporary file, so
+        the solid stream is inflated once, instead of keeping a bounded cache
+        of inflated windows. Must be set before the first extraction.
+        """
+
+        try:
+            self.firstheader = firstheader or fileform._find_firstheader(
+                    rangeio.staged(self.fd, rangeio.STAGE_FIRSTHEADER))
+            if self.firstheader is None:
+                raise HeaderNotFound()
+            self.parse(parse_level)
+        except:
+            if self._views:
+                self.raw.release()
+            raise
+
+    def parse(self, parse_level=PARSE_FULL):
+        """
+        Parse the installer up to |parse_level| now rather than on first
+        access:
+            PARSE_HEADER only locates the firstheader,
+            PARSE_METADATA inflates the header and detects the version,
+            PARSE_FULL parses pages, sections and entries.
+        """
+        # Properties parse what they expose on first access.
+        if parse_level >= PARSE_METADATA:
+            self.version_major
+        if parse_level >= PARSE_FULL:
+            self.pages, self.sections, self.entries
+
+    def parse_async(self, parse_level=PARSE_FULL):
+        """
+        Coroutine parsing an installer opened with open_async, see parse().
+        """
+        from . import aio
+        return aio.parse(self, parse_level)
+
+    @property
+    def header(self):
         """
         Header structure found at the beginning of the uncompressed NSIS blob.
         """
+        if self._header is None:
+            self._parse_header()
+        return self._header
+
+    @property
+    def raw_header(self):
+        """
+        Inflated header data, as a memoryview if the installer is memory
+        mapped.
+        """
+        if self._header is None:
+            self._parse_header()
+        return self._raw_header
+
+    @property
+    def version_major(self):
+        if self._version is None:
+            self._version = (version.string_version(self.block(NB_STRINGS),
+                                                    self.header.unicode),
+                             None)
+        return self._version[0]
+
+    @property
+    def version_minor(self):
+        """
+        Minor version from the stub manifest, or '?'. The stub is only
+        searched on first access, as stripped installers have no manifest
+        and all of it is then read. It is '?' too if |fd| was closed since
+        and there is no path to reopen it from.
+        """
+        major = self.version_major
+        if self._version[1] is None:
+            self._version = (major, self._detect_version_minor(major))
+        return self._version[1]
+
+    @property
+    def build(self):
+        """
+        version.Build of the installer, telling Unicode, logging and Park's
+        builds apart from the opcode histogram of the entries.
+        """
+        if self._build is None:
+            unicode = self.header.unicode
+            park = unicode and self.version_major == '2'
+            self._build = version.Build(
+                    self.version_major, self.version_minor, unicode,
+                    version.is_log_build(
+                            version.opcode_histogram(self.entries),
+                            unicode, park),
+                    park)
+        return self._build
 
-        self.sections = []
+    @property
+    def pages(self):
+        """ Installer pages. """
+        if self._pages is None:
+            self._pages = fileform._parse_pages(
+                    self.block(NB_PAGES),
+                    self.header.blocks[NB_PAGES].num)
+        return self._pages
+
+    @property
+    def sections(self):
         """ List of sections installable by the installer. """
+        if self._sections is None:
+            self._sections = fileform._parse_sections(
+                    self.block(NB_SECTIONS),
+                    self.header.blocks[NB_SECTIONS].num,
+                    self.header.unicode)
+        return self._sections
 
-        self.entries = []
+    @property
+    def entries(self):
         """ Installer instructions. """
+        if self._entries is None:
+            self._entries = fileform._parse_entries(
+                    self.block(NB_ENTRIES),
+                    self.header.blocks[NB_ENTRIES].num)
+        return self._entries
 
-        self.pages = []
-        """ Installer pages. """
+    @property
+    def instructions(self):
+        """ disasm.Instruction of every entry, decoded on first use. """
+        if self._instructions is None:
+            self._instructions = disasm.decode_entries(self.entries)
+        return self._instructions
 
-        if not self._parse():
-            raise HeaderNotFound()
+    @property
+    def control_flow(self):
+        """
+        cfg.ControlFlowGraph of the entries, rooted at the sections, page
+        callbacks and code_on* handlers, built on first use.
+        """
+        if self._control_flow is None:
+            self._control_flow = cfg.ControlFlowGraph(
+                    self.instructions, cfg.handlers(self),
+                    cfg.address_taken(self))
+        return self._control_flow
 
-        self.version_major, self.version_minor = self._detect_version()
+    @property
+    def call_graph(self):
+        """
+        cfg.CallGraph of the functions reached from the handlers, built on
+        first use.
+        """
+        if self._call_graph is None:
+            self._call_graph = cfg.CallGraph(self.control_flow)
+        return self._call_graph
 
-    def get_string(self, address):
-        """ Returns an NSIS expanded string given its |address|. """
-        return self._parse_string(address)[0]
+    @property
+    def plugin_calls(self):
+        """ plugins.PluginCall of every plugin invocation, found once. """
+        if self._plugin_calls is None:
+            self._plugin_calls = plugins.plugin_calls(self)
+        return self._plugin_calls
 
-    def get_raw_string(self, address):
-        """ Returns a raw NSIS string given its |address|. """
-        string = bytearray()
-        for c in self.block(NB_STRINGS)[address:]:
-            if c == 0:
-                break
-            string.append(c)
-        return string
+    def get_string(self, address, strict=False):
+        """
+        Returns an NSIS expanded string given its |address|, in characters
+        from the start of the strings block. Language string addresses are
+        resolved in the first language table, unknown language strings are
+        empty unless |strict| is set, then ValueError is raised.
+        """
+        offset = self._string_offset(address, strict)
+        if offset is None:
+            return ''
+        return self.string_table().string(offset)
+
+    def get_raw_string(self, address, strict=False):
+        """ Returns a raw NSIS string given its |address|, see get_string. """
+        offset = self._string_offset(address, strict)
+        if offset is None:
+            string = memoryview(b'')
+        else:
+            string = strings.raw_string(self.block(NB_STRINGS), offset,
+                                        self.header.unicode)
+        if self._views:
+            return string
+        return bytearray(string)
 
     def get_all_strings(self):
         """ Returns all NSIS strings extracted from the strings section. """
-        string_block_size = len(self.block(NB_STRINGS))
-        offset = 0
-        strings = []
-        while offset < string_block_size:
-            string, processed = self._parse_string(offset)
-            if string:
-                strings.append(string)
-            offset += processed
-
-        return strings
+        return [string for string in self.string_table().strings() if string]
 
     def get_all_raw_strings(self):
         """
         Returns all raw NSIS strings extracted from the strings section.
         """
-        string_block_size = len(self.block(NB_STRINGS))
-        offset = 0
-        strings = []
-        while offset < string_block_size:
-            string = self.get_raw_string(offset)
-            if string:
-                strings.append(string)
-            offset += len(string) + 1
+        return [bytearray(string) if not self._views else string
+                    for string in strings.raw_strings(self.block(NB_STRINGS),
+                                                      self.header.unicode)
+                        if string]
 
-        return strings
+    def string_table(self):
+        """
+        Returns the StringTable indexing the strings section, built on first
+        use. The table is keyed by byte offsets, twice the string addresses
+        of Unicode installers.
+        """
+        if self._string_table is None:
+            self._string_table = strings.StringTable(self.block(NB_STRINGS),
+                    self.version_major, self.header.unicode)
+        return self._string_table
 
     def block(self, n):
         """ Return a block data given a NB_* enum |n| value. """
         if n not in self._block_cache:
-            start = self.header.blocks[n].offset
-            try:
-                end = next(b.offset for b
-                        in self.header.blocks[n+1:] if b.offset > 0)
-            except StopIteration:
-                end = len(self.header.blocks)
-            self._block_cache[n] = self.firstheader._raw_header[start:end]
+            start, end = self.header.block_bounds[n]
+            self._block_cache[n] = self.raw_header[start:end]
         return self._block_cache[n]
 
+    def iter_files(self):
+        """
+        Yields a DataFile for every data item extracted by an EW_EXTRACTFILE
+        entry, once per item.
+        """
+        names = self.entries.offsets[1]
+        data_offsets = self.entries.offsets[2]
+        offsets = set()
+        for i, which in enumerate(self.entries.which):
+            if which != fileform.EW_EXTRACTFILE:
+                continue
+            offset = data_offsets[i]
+            if offset in offsets:
+                continue
+            offsets.add(offset)
+            yield fileform.DataFile(i, self.get_string(names[i]), offset)
+
+    def iter_file_data(self, offset):
+        """
+        Yields the content of the data item at |offset| in chunks, without
+        holding the whole item in memory.
+        """
+        if self.header.solid:
+            return self.solid_reader().iter_item(offset)
+        return fileform._iter_data_item(
+                rangeio.staged(self._data_file(), rangeio.STAGE_EXTRACT),
+                self.firstheader, offset)
+
+    def file_data_async(self, offset):
+        """
+        Coroutine returning the content of the data item at |offset| of an
+        installer opened with open_async.
+        """
+        from . import aio
+        return aio.file_data(self, offset)
+
+    def solid_reader(self):
+        """
+        Returns the reader giving access to the data items of a solid
+        installer, built on first use.
+        """
+        if self._solid_reader is None:
+            self._solid_reader = fileform._SolidReader(
+                    rangeio.staged(self._data_file(), rangeio.STAGE_EXTRACT),
+                    self.firstheader, self.solid_spill)
+        return self._solid_reader
+
+    def _data_file(self):
+        """
+        Returns a file to read data from, reopened from |path| if |fd| is
+        closed. The reopened file is kept until close().
+        """
+        if not getattr(self.fd, 'closed', False):
+            return self.fd
+        if self.path is None:
+            raise ValueError('Installer file is closed and has no path to '
+                             'reopen it from')
+        if self._data_fd is None:
+            self._data_fd = open(self.path, 'rb')
+        return self._data_fd
+
+    def extract(self, path):
+        """
+        Extract every data file into the |path| directory. Returns the list of
+        written file paths.
+        """
+        paths = []
+        for data_file in self.iter_files():
+            file_path = os.path.join(path, _safe_path(data_file.name))
+            if os.path.exists(file_path) or file_path in paths:
+                file_path += '.{}'.format(data_file.offset)
+            directory = os.path.dirname(file_path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(file_path, 'wb') as f:
+                for chunk in self.iter_file_data(data_file.offset):
+                    f.write(chunk)
+            paths.append(file_path)
+        return paths
+
+    def get_section_name(self, section):
+        """ Returns the expanded inline name of |section|. """
+        return strings.decode(section.name, 0, self.version_major,
+                              self.header.unicode)[0]
+
     def size(self):
-        return len(self.firstheader._raw_header)
+        return len(self.raw_header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     def close(self):
+        """
+        Release the files opened by the instance: the installer reopened by
+        from_path() to read past the parse level, solid and PE readers and
+        memory mappings.
+        """
+        if self._cache_key is not None:
+            self.cache.store(self, self._cache_key)
+            self._cache_key = None
         if self._pe is not None:
             self._pe.close()
+        if self._solid_reader is not None:
+            self._solid_reader.close()
+            self._solid_reader = None
+        if self._data_fd is not None:
+            self._data_fd.close()
+            self._data_fd = None
+        if self._views:
+            # Views into the mapping must be released before it is closed.
+            # Slices of |raw| held by the caller keep it exported, it is then
+            # unmapped once they are garbage collected.
+            self._block_cache.clear()
+            self.raw.release()
+            try:
+                self.fd.close()
+            except BufferError:
+                pass
 
-    def _detect_version(self):
-        # Try to parse string and get
-        nsis2_codes = 0
-        nsis3_codes = 0
-        for string in self.get_all_raw_strings():
-            c = string[0]
-            if c <= 4:
-                nsis3_codes += 1
-            elif c >= 252:
-                nsis2_codes += 1
-
-        if nsis2_codes > nsis3_codes:
-            return '2', '?'
-        else:
-            return '3', '?'
+    def _detect_version_minor(self, major):
+        if getattr(self.fd, 'closed', False) and self.path is None:
+            return '?'
+        stub = version.stub_version(
+                rangeio.staged(self._data_file(), rangeio.STAGE_STUB),
+                self.firstheader.header_offset)
+        if stub is not None and stub[0] == major:
+            return stub[1]
+        return '?'
+
+    def _string_offset(self, address, strict=True):
+        """
+        Returns the strings block offset, in bytes, of the string at
+        |address|. Addresses with STR_LANG_FLAG set, negative once signed,
+        are language string ids -(id + 1), read from the language table of
+        the default language: a LANGID, the dialogs offset and RTL flag,
+        then the address of every language string. Addresses count
+        characters, UTF-16 code units of Unicode installers. Unknown
+        language strings raise ValueError if |strict| is set, or are None.
+        """
+        if address & disasm.STR_LANG_FLAG:
+            lang_id = ~address & 0xffffffff
+            langtable = self.block(NB_LANGTABLES)
+            offset = _LANGTABLE_STRINGS_OFFSET + lang_id * 4
+            if offset + 4 > min(self.header.langtable_size, len(langtable)):
+                if not strict:
+                    return None
+                raise ValueError('Unknown language string: {}'.format(
+                                    lang_id))
+            address = struct.unpack_from('<i', langtable, offset)[0]
+        if self.header.unicode:
+            return address * 2
+        return address
 
     def _parse_string(self, address):
         """ Returns an NSIS expanded string given its |address|. """
-        return strings.decode(self.block(NB_STRINGS), address)
-
-    def _parse(self):
-        self.firstheader = fileform._find_firstheader(self.fd)
-        if self.firstheader is None:
-            return False
-
-        self.header = fileform._extract_header(self.fd, self.firstheader)
+        return self.string_table().decode(self._string_offset(address))
 
-        self.header.unicode = self.block(NB_STRINGS)[0] == self.block(NB_STRINGS)[1] == 0
+    def _parse_header(self):
+        fd = rangeio.staged(self._data_file(), rangeio.STAGE_HEADER)
+        cached = index = None
+        if self.cache is not None:
+            cached = self.cache.load(fd, self.firstheader)
+        if cached is None:
+            header = fileform._extract_header(fd, self.firstheader)
+        else:
+            header, self._version, index = cached
 
-        self.pages = fileform._parse_pages(
-                self.block(NB_PAGES),
-                self.header.blocks[NB_PAGES].num)
+        self._header = header
+        if self._views:
+            self._raw_header = memoryview(self.firstheader._raw_header)
+        else:
+            self._raw_header = self.firstheader._raw_header
 
-        self.sections = fileform._parse_sections(
-                self.block(NB_SECTIONS),
-                self.header.blocks[NB_SECTIONS].num,
-                self.header.unicode)
+        strings_block = self.block(NB_STRINGS)
+        self._header.unicode = strings_block[0] == strings_block[1] == 0
 
-        self.entries = fileform._parse_entries(
-                self.block(NB_ENTRIES),
-                self.header.blocks[NB_ENTRIES].num)
-        return True
+        if index is not None:
+            self._string_table = strings.StringTable(strings_block,
+                    self.version_major, self._header.unicode, index)
+        if self.cache is not None and (cached is None or index is None):
+            # Stored now so instances that are never closed are cached too,
+            # and stored again on close() with whatever was parsed by then.
+            self._cache_key = self.cache.key(fd, self.firstheader)
+            if cached is None:
+                self.cache.store(self, self._cache_key)
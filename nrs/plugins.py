@@ -0,0 +1,60 @@
+import ntpath
+from collections import Counter, namedtuple
+from . import disasm
+
+PluginCall = namedtuple('PluginCall', [
+        'entry', # Entry number of the Call starting the invocation.
+        'dll', # Plugin DLL file name.
+        'function', # Exported function called.
+        'args', # Expanded arguments, in the order the script passes them.
+    ])
+
+def find_plugin_calls(entries):
+    """
+    Returns the (entry, dll address, function address, argument addresses)
+    of every plugin invocation of the fileform.EntryTable |entries|, found
+    in one scan. Invocations are compiled as:
+        Call <$PLUGINSDIR init>
+        ExtractFile <dll>
+        SetFlag
+        Push <argument>, last argument first
+        RegisterDLL <dll>, <function>
+    so each RegisterDLL is matched backward.
+    """
+    which = entries.which
+    params = entries.offsets
+    calls = []
+    for i in [i for i, opcode in enumerate(which)
+                if opcode == disasm.I_REGISTERDLL]:
+        first = i
+        # Pushes are PushPop entries with no variable to pop to nor stack
+        # entry to exchange.
+        while first > 0 and which[first-1] == disasm.I_PUSHPOP and \
+                params[1][first-1] == 0 and params[2][first-1] == 0:
+            first -= 1
+        start = first - 3
+        if start < 0 or which[start] != disasm.I_CALL or \
+                which[start+1] != disasm.I_EXTRACTFILE or \
+                which[start+2] != disasm.I_SETFLAG:
+            continue
+        args = [params[0][j] & 0xffffffff
+                    for j in range(i - 1, first - 1, -1)]
+        calls.append((start, params[0][i] & 0xffffffff,
+                      params[1][i] & 0xffffffff, args))
+    return calls
+
+def plugin_calls(nsis):
+    """ Returns the PluginCall of every plugin invocation of |nsis|. """
+    return [PluginCall(entry, ntpath.basename(nsis.get_string(dll)),
+                       nsis.get_string(function),
+                       [nsis.get_string(arg) for arg in args])
+                for entry, dll, function, args
+                    in find_plugin_calls(nsis.entries)]
+
+def inventory(calls):
+    """
+    Returns the number of invocations of every plugin function of the
+    PluginCall list |calls|, by (dll, function). DLL names are lower case as
+    Windows matches them.
+    """
+    return Counter((call.dll.lower(), call.function) for call in calls)
@@ -0,0 +1,173 @@
+import bisect
+
+# Parsing stages reported to I/O accounting hooks.
+STAGE_FIRSTHEADER = 'firstheader'
+STAGE_STUB = 'stub'
+STAGE_HEADER = 'header'
+STAGE_BLOCK = 'block'
+STAGE_EXTRACT = 'extract'
+
+# Size of the reads of ReadAtFile.read() without a size.
+_READ_ALL_SIZE = 0x100000
+
+class MissingRange(Exception):
+    """
+    Raised when reading bytes of a RangeFile that were not fetched yet.
+    |size| is -1 if everything up to the end of the file is needed.
+    """
+
+    def __init__(self, offset, size):
+        super(MissingRange, self).__init__(offset, size)
+        self.offset = offset
+        self.size = size
+
+class RangeFile(object):
+    """
+    Read-only file over the ranges of an installer fetched so far. Reading
+    bytes that were not added raises MissingRange with the range to fetch,
+    so a parser can be run again once it is added.
+    """
+    closed = False
+
+    def __init__(self):
+        self.size = None
+        """ File size, known once a fetch reached the end of the file. """
+
+        self._starts = []
+        self._chunks = []
+        self._pos = 0
+
+    def add(self, offset, data, eof=False):
+        """
+        Add the |data| fetched at |offset|. If |eof| is set, the file ends
+        after it.
+        """
+        if eof:
+            self.size = offset + len(data)
+        if not data:
+            return
+
+        # Merge the chunks overlapping or touching the new one.
+        end = offset + len(data)
+        i = bisect.bisect_left(self._starts, offset)
+        if i > 0 and self._starts[i-1] + len(self._chunks[i-1]) >= offset:
+            i -= 1
+        j = i
+        while j < len(self._starts) and self._starts[j] <= end:
+            j += 1
+        if i < j:
+            start = min(offset, self._starts[i])
+            merged = bytearray(max(end, self._starts[j-1] +
+                                        len(self._chunks[j-1])) - start)
+            for k in range(i, j):
+                chunk_start = self._starts[k] - start
+                merged[chunk_start:chunk_start + len(self._chunks[k])] = \
+                        self._chunks[k]
+            merged[offset - start:end - start] = data
+            offset, data = start, merged
+        self._starts[i:j] = [offset]
+        self._chunks[i:j] = [bytes(data)]
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            if self.size is None:
+                raise MissingRange(self._pos, -1)
+            offset += self.size
+        self._pos = offset
+        return offset
+
+    def tell(self):
+        return self._pos
+
+    def read(self, size=-1):
+        start = self._pos
+        if size is None or size < 0:
+            if self.size is None:
+                raise MissingRange(start, -1)
+            end = self.size
+        else:
+            end = start + size
+            if self.size is not None:
+                end = min(end, self.size)
+        if end <= start:
+            return b''
+
+        i = bisect.bisect_right(self._starts, start) - 1
+        chunk_end = self._starts[i] + len(self._chunks[i]) if i >= 0 else 0
+        if chunk_end < end:
+            # Only ask for the bytes following the part already fetched.
+            missing = max(start, chunk_end)
+            raise MissingRange(missing, end - missing)
+
+        chunk_start = start - self._starts[i]
+        self._pos = end
+        return self._chunks[i][chunk_start:chunk_start + end - start]
+
+class ReadAtFile(object):
+    """
+    Read-only file over |source|, any object with a read_at(offset, size)
+    method returning the bytes in that range, less only at its end. Every
+    read is reported to |hook|(stage, offset, size) if set.
+    """
+    closed = False
+
+    def __init__(self, source, hook=None, stage=None):
+        self.source = source
+        self.hook = hook
+        self.stage = stage
+        self._pos = 0
+
+    def staged(self, stage):
+        """ Returns a file over the same source reporting reads as |stage|. """
+        return ReadAtFile(self.source, self.hook, stage)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            raise ValueError('ReadAtFile cannot seek from the end')
+        self._pos = offset
+        return offset
+
+    def tell(self):
+        return self._pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            chunks = []
+            chunk = self.read(_READ_ALL_SIZE)
+            while chunk:
+                chunks.append(chunk)
+                chunk = self.read(_READ_ALL_SIZE)
+            return b''.join(chunks)
+
+        data = self.source.read_at(self._pos, size)
+        if self.hook is not None:
+            self.hook(self.stage, self._pos, len(data))
+        self._pos += len(data)
+        return data
+
+def staged(nsis_file, stage):
+    """
+    Returns |nsis_file| reporting its reads as |stage| if it supports I/O
+    accounting, |nsis_file| itself otherwise.
+    """
+    if isinstance(nsis_file, ReadAtFile):
+        return nsis_file.staged(stage)
+    return nsis_file
+
+class IOStats(object):
+    """ I/O accounting hook counting the reads and bytes read by stage. """
+
+    def __init__(self):
+        self.reads = {}
+        self.bytes = {}
+
+    def __call__(self, stage, offset, size):
+        self.reads[stage] = self.reads.get(stage, 0) + 1
+        self.bytes[stage] = self.bytes.get(stage, 0) + size
+
+    def total_bytes(self):
+        return sum(self.bytes.values())
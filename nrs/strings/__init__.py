@@ -1,8 +1,15 @@
-from builtins import bytes
+from builtins import bytes, str
+import codecs
+import re
 import struct
-from . import nsis2, nsis3
+from . import nsis2, nsis3, park
 from .. import fileform
 
+try:
+    from ..ext import strings as _native
+except ImportError:
+    _native = None
+
 SYSVAR_NAMES = {
     20: 'COMMANDLINE',
     21: 'INSTALLDIR',
@@ -25,6 +32,12 @@ ESCAPE_MAP = {
     0x24:'$$',
 }
 
+# Span kinds, using the NSIS 3 code values.
+SPAN_STRING = 0
+SPAN_LANG = nsis3.NS_LANG_CODE
+SPAN_SHELL = nsis3.NS_SHELL_CODE
+SPAN_VAR = nsis3.NS_VAR_CODE
+
 class Symbol(object):
     def is_reg(self):
         return False
@@ -87,61 +100,341 @@ class String(Symbol, str):
     def is_string(self):
         return True
 
-def _symbolize(block, offset, code_helper):
-    """ Decode special characters found in NSIS strings. """
+def _byte(c):
+    # Not bytes([c]), re.escape() iterates it as ints on Python 2.
+    return struct.pack('B', c)
+
+def _special_chars(code_helper):
+    """ Returns a regex matching the bytes that are not copied as is. """
+    if not hasattr(code_helper, '_special_chars'):
+        chars = [0, code_helper.NS_SKIP_CODE] + list(ESCAPE_MAP.keys()) + \
+                [c for c in range(256) if code_helper.is_code(c)]
+        code_helper._special_chars = re.compile(b'[' + b''.join(
+            re.escape(_byte(c)) for c in sorted(set(chars))) + b']')
+    return code_helper._special_chars
 
-    symbols = []
-    cur_string = ""
-    data = bytes(block[offset:offset + fileform.NSIS_MAX_STRLEN])
-    i = 0
-    while i < len(data):
-        c = data[i]
-        i += 1
+def _scan(block, offset, code_helper):
+    """
+    Decode special characters of the string at |offset|. Returns the
+    (kind, start, end, value) spans of the string and its size in bytes.
+    """
+    special_chars = _special_chars(code_helper)
+    limit = min(offset + fileform.NSIS_MAX_STRLEN, len(block))
+    spans = []
+    text = []
+    text_start = i = offset
+    end = None
+    while i < limit:
+        match = special_chars.search(block, i, limit)
+        j = match.start() if match else limit
+        if j > i:
+            text.append(codecs.latin_1_decode(block[i:j])[0])
+        if match is None:
+            i = limit
+            break
 
+        c = block[j]
+        i = j + 1
         if c == 0:
+            end = j
             break
 
         if code_helper.is_code(c):
-            if cur_string:
-                symbols.append(String(cur_string))
-                cur_string = ""
+            if text:
+                spans.append((SPAN_STRING, text_start, j, ''.join(text)))
+                text = []
+
+            param1 = block[i] if i < limit else 0
+            param2 = block[i+1] if i + 1 < limit else 0
+            i = min(i + 2, limit)
+            if c == code_helper.NS_SHELL_CODE:
+                kind = SPAN_SHELL
+            elif c == code_helper.NS_VAR_CODE:
+                kind = SPAN_VAR
+            else:
+                kind = SPAN_LANG
+            spans.append((kind, j, i, param1 | (param2 << 8)))
+            text_start = i
+        elif c == code_helper.NS_SKIP_CODE:
+            if i < limit:
+                text.append(codecs.latin_1_decode(block[i:i+1])[0])
+                i += 1
+        else:
+            text.append(ESCAPE_MAP[c])
+
+    if text:
+        spans.append((SPAN_STRING, text_start, i if end is None else end,
+                      ''.join(text)))
+
+    return spans, i - offset
 
-            param1 = data[i]
-            param2 = data[i+1]
-            param = (param1 & 0x7f) | ((param2 & 0x7f) << 7)
+def _byte_class(values, negate=False):
+    return b'[' + (b'^' if negate else b'') + \
+            b''.join(re.escape(_byte(c)) for c in sorted(values)) + b']'
 
-            i += 2
+def _unicode_text_run(code_helper):
+    """
+    Returns a regex matching a run of UTF-16LE code units that are copied as
+    is, ie. all but the NUL, escaped and NSIS code units.
+    """
+    if not hasattr(code_helper, '_unicode_text_run'):
+        units = [0, code_helper.NS_SKIP_CODE] + list(ESCAPE_MAP.keys()) + \
+                [c for c in range(0x10000) if code_helper.is_code(c)]
+        low_bytes = {}
+        for unit in set(units):
+            low_bytes.setdefault(unit >> 8, []).append(unit & 0xff)
+        # A unit is copied if no special unit has its high byte, or if its
+        # low byte is not one of theirs.
+        run = [b'.' + _byte_class(low_bytes, True)] + \
+              [_byte_class(low_bytes[high], True) + re.escape(_byte(high))
+                  for high in sorted(low_bytes)]
+        code_helper._unicode_text_run = re.compile(
+                b'(?:' + b'|'.join(run) + b')*', re.S)
+    return code_helper._unicode_text_run
+
+def _scan_unicode(block, offset, code_helper):
+    """
+    Same as _scan, for UTF-16LE strings of Unicode installers. Text runs are
+    decoded in one codec call, codes are followed by a single code unit whose
+    bytes are the code parameters. Park's code units are translated to the
+    NSIS 3 parameters.
+    """
+    text_run = _unicode_text_run(code_helper)
+    limit = min(offset + fileform.NSIS_MAX_STRLEN * 2, len(block))
+    spans = []
+    text = []
+    text_start = i = offset
+    end = None
+    while i < limit:
+        j = text_run.match(block, i, limit).end()
+        if j > i:
+            text.append(codecs.utf_16_le_decode(block[i:j], 'surrogatepass')[0])
+        if j + 2 > limit:
+            i = limit
+            break
+
+        c = block[j] | (block[j+1] << 8)
+        i = j + 2
+        if c == 0:
+            end = j
+            break
+
+        if code_helper.is_code(c):
+            if text:
+                spans.append((SPAN_STRING, text_start, j, ''.join(text)))
+                text = []
+
+            param1 = block[i] if i < limit else 0
+            param2 = block[i+1] if i + 1 < limit else 0
+            i = min(i + 2, limit)
+            value = param1 | (param2 << 8)
             if c == code_helper.NS_SHELL_CODE:
-                symbols.append(Shell(param1, param2))
+                kind = SPAN_SHELL
             elif c == code_helper.NS_VAR_CODE:
-                symbols.append(NVar(param))
-            elif c == code_helper.NS_LANG_CODE:
-                symbols.append(LangCode(param))
+                kind = SPAN_VAR
+            else:
+                kind = SPAN_LANG
+            if code_helper is park and kind != SPAN_SHELL:
+                value = park.encode_short(value)
+            spans.append((kind, j, i, value))
+            text_start = i
         elif c == code_helper.NS_SKIP_CODE:
-            cur_string += data[i]
-            i += 1
-        elif c in ESCAPE_MAP:
-            cur_string += ESCAPE_MAP[c]
+            if i + 2 <= limit:
+                text.append(codecs.utf_16_le_decode(block[i:i+2],
+                                                    'surrogatepass')[0])
+                i += 2
         else:
-            cur_string += chr(c)
+            text.append(ESCAPE_MAP[c])
 
-    if cur_string:
-        symbols.append(String(cur_string))
+    if text:
+        spans.append((SPAN_STRING, text_start, i if end is None else end,
+                      ''.join(text)))
 
-    return symbols, i
+    return spans, i - offset
 
-def symbolize(block, offset, version='3'):
+def _code_helper(version, unicode=False):
     if version == '3':
-        return _symbolize(block, offset, nsis3)
+        return nsis3
     elif version == '2':
-        return _symbolize(block, offset, nsis2)
+        # Only Park's fork of NSIS 2 has Unicode strings.
+        return park if unicode else nsis2
     else:
         raise Exception('Unknown NSIS version: ' + repr(version))
 
-def decode(block, offset=0, version='3'):
-    symbols, i = symbolize(block, offset, version)
-    string = ''
-    for s in symbols:
-        string += str(s)
-    return string, i
+def _span_symbol(span):
+    kind, _, _, value = span
+    if kind == SPAN_STRING:
+        return String(value)
+    elif kind == SPAN_SHELL:
+        return Shell(value & 0xff, value >> 8)
+
+    param = (value & 0x7f) | ((value >> 8 & 0x7f) << 7)
+    if kind == SPAN_VAR:
+        return NVar(param)
+    return LangCode(param)
+
+def _block_offset(block, offset):
+    if offset < 0:
+        # Negative addresses reference language strings, they are resolved
+        # through the language tables by NSIS.get_string().
+        raise ValueError('Language string address: {}'.format(offset))
+    return offset
+
+def _scan_strings(block, offset, count, version, unicode=False):
+    """
+    Returns the (offset, size, spans) of |count| strings starting at
+    |offset|, or of every following string if |count| is negative.
+    """
+    code_helper = _code_helper(version, unicode)
+    if type(block) is type(b''):
+        # Python 2 native strings are indexed as characters.
+        block = bytes(block)
+    offset = _block_offset(block, offset)
+    if _native is not None and not unicode:
+        return _native.symbolize(block, offset, count, int(version))
+
+    scan = _scan_unicode if unicode else _scan
+    strings = []
+    while offset < len(block) and count != 0:
+        spans, size = scan(block, offset, code_helper)
+        strings.append((offset, size, spans))
+        offset += size
+        count -= 1
+    return strings
+
+def symbolize_block(block, version='3', unicode=False):
+    """
+    Symbolize every string of a NB_STRINGS |block| in one pass. Returns a list
+    of (offset, size, spans), spans being (kind, start, end, value) tuples
+    with SPAN_* |kind|. Offsets and sizes are in bytes, including for
+    |unicode| blocks.
+    """
+    return _scan_strings(block, 0, -1, version, unicode)
+
+def decode_block(block, version='3', unicode=False):
+    """
+    Decode every string of a NB_STRINGS |block| in one pass. Returns a list of
+    (offset, size, string).
+    """
+    return [(offset, size, _spans_string(spans)) for offset, size, spans
+                in symbolize_block(block, version, unicode)]
+
+def _spans_string(spans):
+    return ''.join(span[3] if span[0] == SPAN_STRING
+                   else str(_span_symbol(span)) for span in spans)
+
+def symbolize(block, offset, version='3', unicode=False):
+    strings = _scan_strings(block, offset, 1, version, unicode)
+    if not strings:
+        return [], 0
+    _, size, spans = strings[0]
+    return [_span_symbol(span) for span in spans], size
+
+def decode(block, offset=0, version='3', unicode=False):
+    strings = _scan_strings(block, offset, 1, version, unicode)
+    if not strings:
+        return '', 0
+    _, size, spans = strings[0]
+    return _spans_string(spans), size
+
+_nul = re.compile(b'\0')
+_unicode_nul = re.compile(b'\0\0')
+
+def _find_nul(block, offset, unicode=False):
+    """ Returns the offset of the NUL terminating the string at |offset|. """
+    if not unicode:
+        match = _nul.search(block, offset)
+        return match.start() if match else len(block)
+
+    # Unicode NUL must be aligned on the string code units.
+    match = _unicode_nul.search(block, offset)
+    while match and (match.start() - offset) % 2:
+        match = _unicode_nul.search(block, match.start() + 1)
+    if match:
+        return match.start()
+    return len(block) - (len(block) - offset) % 2
+
+def raw_string(block, offset, unicode=False):
+    """ Returns the raw bytes of the string at |offset|, without NUL. """
+    offset = _block_offset(block, offset)
+    return block[offset:_find_nul(block, offset, unicode)]
+
+def raw_strings(block, unicode=False):
+    """ Returns every NUL terminated raw string of |block|, in order. """
+    nul_size = 2 if unicode else 1
+    strings = []
+    offset = 0
+    while offset < len(block):
+        end = _find_nul(block, offset, unicode)
+        strings.append(block[offset:end])
+        offset = end + nul_size
+    return strings
+
+class StringTable(object):
+    """
+    Index of the strings of a NB_STRINGS |block|, symbolized in a single pass
+    on creation unless the |index| returned by symbolize_block is given.
+    Addresses pointing inside a string are symbolized on first lookup and
+    cached. Addresses are byte offsets, entries of |unicode| installers
+    address UTF-16 code units: see NSIS.get_string().
+    """
+
+    def __init__(self, block, version='3', unicode=False, index=None):
+        self.block = block
+        self.version = version
+        self.unicode = unicode
+
+        self.offsets = []
+        """ Offsets of the strings found by scanning the block in order. """
+
+        self._entries = {}
+        self._strings = {}
+        if index is None:
+            index = symbolize_block(block, version, unicode)
+        for offset, size, spans in index:
+            self._entries[offset] = (size, spans)
+            self.offsets.append(offset)
+
+    def _entry(self, offset):
+        entry = self._entries.get(offset)
+        if entry is None:
+            strings = _scan_strings(self.block, offset, 1, self.version,
+                                    self.unicode)
+            entry = strings[0][1:] if strings else (0, [])
+            self._entries[offset] = entry
+        return entry
+
+    def decode(self, offset):
+        """ Returns the string at |offset| and its size in bytes. """
+        string = self._strings.get(offset)
+        size, spans = self._entry(offset)
+        if string is None:
+            string = self._strings[offset] = _spans_string(spans)
+        return string, size
+
+    def string(self, offset):
+        """ Returns the expanded string at |offset|. """
+        return self.decode(offset)[0]
+
+    def symbols(self, offset):
+        """ Returns the symbols of the string at |offset|. """
+        return [_span_symbol(span) for span in self._entry(offset)[1]]
+
+    def raw(self, offset):
+        """ Returns the raw bytes of the string at |offset|, without NUL. """
+        return raw_string(self.block, offset, self.unicode)
+
+    def index(self):
+        """
+        Returns the (offset, size, spans) of the strings found by scanning
+        the block, as symbolize_block does, to rebuild the table from.
+        """
+        return [(offset,) + self._entries[offset] for offset in self.offsets]
+
+    def strings(self):
+        """ Returns every string of the block, in order. """
+        return [self.string(offset) for offset in self.offsets]
 
+    def raw_strings(self):
+        """ Returns every NUL terminated raw string of the block, in order. """
+        return raw_strings(self.block, self.unicode)
@@ -0,0 +1,16 @@
+# Strings escape code units of Jim Park's Unicode NSIS 2 fork.
+NS_SKIP_CODE = 0xe000
+NS_VAR_CODE = 0xe001
+NS_SHELL_CODE = 0xe002
+NS_LANG_CODE = 0xe003
+
+def is_code(c):
+    return NS_SKIP_CODE < c <= NS_LANG_CODE
+
+def encode_short(param):
+    """
+    Returns the variable or language id of the code unit |param|, whose high
+    bit is set so it is never NUL, packed by 7 bits as NSIS 2 and 3 do.
+    """
+    param &= 0x7fff
+    return (param & 0x7f) | ((param >> 7 & 0x7f) << 8)
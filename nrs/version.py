@@ -0,0 +1,119 @@
+import re
+from collections import Counter, namedtuple
+
+Build = namedtuple('Build', [
+        'major', # '2' or '3'.
+        'minor', # Minor version from the stub manifest, or '?'.
+        'unicode', # UTF-16LE strings.
+        'log', # Built with NSIS_CONFIG_LOG, entries have an EW_LOG opcode.
+        'park', # Jim Park's Unicode NSIS 2 fork.
+    ])
+
+# Strings are counted by chunks of |_SAMPLE_SIZE| bytes until one version
+# has at least |_MIN_CODES| codes and |_CONFIDENCE| times more than the
+# other.
+_SAMPLE_SIZE = 0x4000
+_MIN_CODES = 16
+_CONFIDENCE = 4
+
+# Codes starting a string: ANSI strings of NSIS 2 use 252-255, NSIS 3 1-4.
+# Unicode strings of NSIS 3 use the same code units, Park's NSIS 2 fork
+# U+E000-U+E003.
+_ANSI_CODES = {
+    '2': [b'\0' + bytes(bytearray([c])) for c in range(252, 256)],
+    '3': [b'\0' + bytes(bytearray([c])) for c in range(1, 5)],
+}
+_UNICODE_CODES = {
+    '2': [b'\0\0' + bytes(bytearray([c, 0xe0])) for c in range(4)],
+    '3': [b'\0\0' + bytes(bytearray([c, 0])) for c in range(1, 5)],
+}
+
+# Manifest description of the installer stub.
+_STUB_VERSION_RE = re.compile(
+        br'Nullsoft Install System v(\d+)\.(\d+(?:(?:a|b|rc)\d+)?)')
+# Bytes searched at the end of the stub for its manifest, by windows of at
+# least |_STUB_WINDOW_SIZE| bytes.
+_STUB_SEARCH_SIZE = 0x100000
+_STUB_WINDOW_SIZE = 0x1000
+# Longest description matched.
+_STUB_VERSION_SIZE = 0x40
+
+# Opcode of WriteUninstaller in ANSI builds. Unicode builds insert
+# FileWriteUTF16LE and FileReadUTF16LE before it, Park's also GetFontVersion
+# and GetFontName. Logging builds insert EW_LOG after it.
+_WRITEUNINSTALLER = 0x3e
+_UNICODE_OPCODES = 2
+_PARK_OPCODES = 2
+
+def _decided(counts):
+    low, high = sorted(counts.values())
+    return high >= _MIN_CODES and high >= low * _CONFIDENCE
+
+def string_version(block, unicode=False):
+    """
+    Returns the NSIS major version, '2' or '3', whose codes start the most
+    strings of the NB_STRINGS |block|. The block is counted by chunks until
+    one version leads clearly, so only large ambiguous blocks are fully read.
+    """
+    codes = _UNICODE_CODES if unicode else _ANSI_CODES
+    # Chunks overlap by a code minus one byte, so codes starting in a chunk
+    # are counted once.
+    overlap = len(codes['3'][0]) - 1
+    counts = {'2': 0, '3': 0}
+    for start in range(0, len(block), _SAMPLE_SIZE):
+        chunk = bytes(block[start:start + _SAMPLE_SIZE + overlap])
+        for version in counts:
+            counts[version] += sum(chunk.count(code)
+                                   for code in codes[version])
+        if _decided(counts):
+            break
+
+    if counts['2'] > counts['3']:
+        return '2'
+    return '3'
+
+def stub_version(nsis_file, header_offset):
+    """
+    Returns the (major, minor) version in the manifest of the installer stub
+    preceding the firstheader at |header_offset|, or None. The manifest is
+    in the last resources of the stub, so it is searched backward from the
+    firstheader in windows doubling in size.
+    """
+    end = header_offset
+    limit = max(header_offset - _STUB_SEARCH_SIZE, 0)
+    window_size = _STUB_WINDOW_SIZE
+    while end > limit:
+        start = max(end - window_size, limit)
+        # Windows overlap so a description across two windows is found.
+        nsis_file.seek(start)
+        data = nsis_file.read(min(end + _STUB_VERSION_SIZE, header_offset)
+                              - start)
+        match = _STUB_VERSION_RE.search(data)
+        if match is not None:
+            return match.group(1).decode(), match.group(2).decode()
+        end = start
+        window_size *= 2
+    return None
+
+def opcode_histogram(entries):
+    """ Returns the count of every opcode of the fileform.EntryTable. """
+    return Counter(entries.which)
+
+def is_log_build(histogram, unicode=False, park=False):
+    """
+    Whether the opcode |histogram| of an installer has an EW_LOG opcode,
+    given its string |unicode| and |park| build. GetLabelAddr and
+    GetFunctionAddr are resolved by the compiler and never found in
+    entries, so the opcodes found around them tell whether EW_LOG shifts
+    the following ones.
+    """
+    log = _WRITEUNINSTALLER + 1
+    if unicode:
+        log += _UNICODE_OPCODES
+    if park:
+        log += _PARK_OPCODES
+    # InstTypeSet and LockWindow of logging builds fall on GetLabelAddr
+    # and after the last opcode of the others, LockWindow of the others
+    # on GetFunctionAddr of logging builds.
+    votes = histogram.get(log + 2, 0) + histogram.get(log + 5, 0)
+    return votes > histogram.get(log + 4, 0)
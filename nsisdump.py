@@ -2,66 +2,13 @@
 
 from builtins import bytes
 from nrs.nsisfile import NSIS, HeaderNotFound
-from nrs import fileform, strings
+from nrs import flags
+import argparse
+import glob
+import json
 import sys
 import os
 
-FH_FLAGS = [
-    'FH_FLAGS_UNINSTALL',
-    'FH_FLAGS_SILENT',
-    'FH_FLAGS_NO_CRC',
-    'FH_FLAGS_FORCE_CRC',
-]
-
-CF_FLAGS = [
-    'CH_FLAGS_DETAILS_SHOWDETAILS',
-    'CH_FLAGS_DETAILS_NEVERSHOW',
-    'CH_FLAGS_PROGRESS_COLORED',
-    'CH_FLAGS_SILENT',
-    'CH_FLAGS_SILENT_LOG',
-    'CH_FLAGS_AUTO_CLOSE',
-    'CH_FLAGS_DIR_NO_SHOW',
-    'CH_FLAGS_NO_ROOT_DIR',
-    'CH_FLAGS_COMP_ONLY_ON_CUSTOM',
-    'CH_FLAGS_NO_CUSTOM',
-]
-
-SF_FLAGS = [
-    'SF_SELECTED',
-    'SF_SECGRP',
-    'SF_SECGRPEND',
-    'SF_BOLD',
-    'SF_RO',
-    'SF_EXPAND',
-    'SF_PSELECTED',
-    'SF_TOGGLED',
-    'SF_NAMECHG',
-]
-
-PF_FLAGS = [
-    'PF_LICENSE_SELECTED',
-    'PF_NEXT_ENABLE',
-    'PF_CANCEL_ENABLE',
-    'PF_BACK_SHOW',
-    'PF_LICENSE_STREAM',
-    'PF_LICENSE_FORCE_SELECTION',
-    'PF_LICENSE_NO_FORCE_SELECTION',
-    'PF_NO_NEXT_FOCUS',
-    'PF_BACK_ENABLE',
-    'PF_PAGE_EX',
-    'PF_DIR_NO_BTN_DISABLE',
-]
-
-PWP_ENUM = [
-    'PWP_LICENSE',
-    'PWP_SELCOM',
-    'PWP_DIR',
-    'PWP_INSTFILES',
-    'PWP_UNINST',
-    'PWP_COMPLETED',
-    'PWP_CUSTOM',
-]
-
 BLOCK_NAMES = [
     'Pages',
     'Sections',
@@ -89,19 +36,16 @@ def print_property(key, value, indent=0):
     else:
         print('{}: "{}"'.format(format_key(key, indent), value))
 
-def print_property_flag(key, value, flags_set, indent=0):
-    flags = ' | '.join([flag for flag in flags_set
-                if value & eval(flag, fileform.__dict__)])
-    print(format_key(key, indent) + '0x{:08x} ( {} )'.format(value, flags))
+def print_property_flag(key, value, flag_table, indent=0):
+    print(format_key(key, indent) + '0x{:08x} ( {} )'.format(
+            value, flags.format_flags(value, flag_table)))
 
-def print_property_enum(key, value, enum_set, indent=0):
-    flag = '<unknown>'
-    if value < len(enum_set):
-        flag = enum_set[value]
+def print_property_enum(key, value, enum_table, indent=0):
+    flag = flags.enum_name(value, enum_table, '<unknown>')
     print(format_key(key, indent) + '0x{:08x} ( {} )'.format(value, flag))
 
 def print_property_string(key, value, nsis, indent=0):
-    if value != 0xffffffff:
+    if value & 0xffffffff != 0xffffffff:
         string = nsis.get_string(value)
         print(format_key(key, indent) + '{} @ 0x{:08x}'.format(string, value))
     else:
@@ -126,7 +70,7 @@ def dump_all(path):
         print('')
         print_header('FirstHeader @ 0x{:x}'
                 .format(nsis.firstheader.header_offset))
-        print_property_flag('Flags', nsis.firstheader.flags, FH_FLAGS)
+        print_property_flag('Flags', nsis.firstheader.flags, flags.FH_FLAGS)
         print_property('Siginfo', nsis.firstheader.siginfo)
         print_property('Magics', nsis.firstheader.magics.decode())
         print_property('Header Size', nsis.firstheader.c_size)
@@ -136,7 +80,7 @@ def dump_all(path):
         header = nsis.header
         print('')
         print_header('Inflated header')
-        print_property_flag('Flags', header.flags, CF_FLAGS)
+        print_property_flag('Flags', header.flags, flags.CH_FLAGS)
         print_header('Blocks[{}]:'.format(len(header.blocks)))
         for block, name, i in zip(header.blocks, BLOCK_NAMES, range(8)):
             print_header('Block[{}] - {}:'.format(i, name), indent=1)
@@ -188,11 +132,12 @@ def dump_all(path):
         for i, page in enumerate(nsis.pages):
             print_header('Page[{}]' .format(i), indent=1)
             print_property('dlg_id', page.dlg_id, indent=1)
-            print_property_enum('wndproc_id', page.flags, PWP_ENUM, indent=1)
+            print_property_enum('wndproc_id', page.flags, flags.PWP_ENUM,
+                                indent=1)
             print_property('prefunc', page.prefunc, indent=1)
             print_property('showfunc', page.showfunc, indent=1)
             print_property('leavefunc', page.leavefunc, indent=1)
-            print_property_flag('flags', page.flags, PF_FLAGS, indent=1)
+            print_property_flag('flags', page.flags, flags.PF_FLAGS, indent=1)
             print_property('caption', page.caption, indent=1)
             print_property('back', page.back, indent=1)
             print_property('next', page.next, indent=1)
@@ -213,18 +158,294 @@ def dump_all(path):
                 .format(i, nsis.get_string(section.name_ptr)), indent=1)
             print_property_string('name_ptr', section.name_ptr, nsis, indent=1)
             print_property('install_types', section.install_types, indent=1)
-            print_property_flag('flags', section.flags, SF_FLAGS, indent=1)
+            print_property_flag('flags', section.flags, flags.SF_FLAGS,
+                                indent=1)
             print_property('code', section.code, indent=1)
             print_property('code_size', section.code_size, indent=1)
             print_property('size_kb', section.size_kb, indent=1)
-            print_property('name', strings.decode(bytes(section.name))[0], indent=1)
+            print_property('name', nsis.get_section_name(section), indent=1)
+
+
+    except HeaderNotFound:
+        sys.stderr.write('Error: Target it not an NSIS installer.' + os.linesep)
+        sys.exit(1)
+
+
+class StructuredWriter(object):
+    """
+    Writes an installer to |out| as one JSON document, or if |ndjson| is set
+    as JSON lines: an 'installer' record followed by one record per item.
+    Items are serialized one at a time as they are produced.
+    """
+
+    def __init__(self, out, ndjson=False):
+        self.out = out
+        self.ndjson = ndjson
+        self._encode = json.JSONEncoder(ensure_ascii=False).encode
+
+    def write_installer(self, properties, item_lists):
+        """
+        Writes the installer described by the |properties| dict, then its
+        (key, record_type, items) |item_lists|. Items are dicts written as
+        the |key| list of the document or as |record_type| lines.
+        """
+        if self.ndjson:
+            self._write_record('installer', properties)
+            for _, record_type, items in item_lists:
+                for item in items:
+                    self._write_record(record_type, item)
+        else:
+            # Members are written one by one so item lists are streamed
+            # into the document.
+            write = self.out.write
+            write('{')
+            separator = ''
+            for key, value in properties.items():
+                write(separator + self._encode(key) + ': ')
+                write(self._encode(value))
+                separator = ', '
+            for key, _, items in item_lists:
+                write(separator + self._encode(key) + ': ')
+                self._write_list(items)
+                separator = ', '
+            write('}\n')
+        self.out.flush()
+
+    def _write_record(self, record_type, item):
+        record = {'type': record_type}
+        record.update(item)
+        self.out.write(self._encode(record) + '\n')
+
+    def _write_list(self, items):
+        write = self.out.write
+        write('[')
+        separator = ''
+        for item in items:
+            write(separator + self._encode(item))
+            separator = ', '
+        write(']')
 
+def _string_property(nsis, address):
+    if address & 0xffffffff == 0xffffffff:
+        return None
+    return {'address': address, 'value': nsis.get_string(address)}
 
+def installer_properties(nsis, path):
+    """ Returns the JSON serializable firstheader and header of |nsis|. """
+    firstheader = nsis.firstheader
+    header = nsis.header
+    properties = {
+        'path': path,
+        'version': '{}.{}'.format(nsis.version_major, nsis.version_minor),
+        'firstheader': {
+            'offset': firstheader.header_offset,
+            'flags': firstheader.flags,
+            'flag_names': flags.flag_names(firstheader.flags, flags.FH_FLAGS),
+            'siginfo': firstheader.siginfo,
+            'magics': bytes(firstheader.magics).decode('latin-1'),
+            'header_size': firstheader.c_size,
+            'inflated_size': firstheader.u_size,
+        },
+        'header': {
+            'flags': header.flags,
+            'flag_names': flags.flag_names(header.flags, flags.CH_FLAGS),
+            'decoder': flags.enum_name(header.decoder, flags.D_ENUM),
+            'solid': header.solid,
+            'unicode': header.unicode,
+            'blocks': [{'name': name, 'offset': block.offset,
+                        'num': block.num}
+                            for block, name in zip(header.blocks,
+                                                   BLOCK_NAMES)],
+            'install_types': header.install_types,
+        },
+    }
+    for field in ['install_reg_rootkey', 'install_reg_key_ptr',
+                  'install_reg_value_ptr', 'bg_color1s', 'bg_color2',
+                  'bg_textcolor', 'lb_bg', 'lb_fg', 'langtable_size',
+                  'license_bg', 'code_onInit', 'code_onInstSuccess',
+                  'code_onInstFailed', 'code_onUserAbort', 'code_onGUIInit',
+                  'code_onGUIEnd', 'code_onMouseOverSection',
+                  'code_onVerifyInstDir', 'code_onSelChange',
+                  'code_onRebootFailed']:
+        properties['header'][field] = getattr(header, field)
+    for field in ['install_directory_ptr', 'install_directory_auto_append',
+                  'str_uninstchild', 'str_uninstcmd', 'str_wininit']:
+        properties['header'][field] = \
+                _string_property(nsis, getattr(header, field))
+    return properties
+
+def iter_string_items(nsis):
+    table = nsis.string_table()
+    # Addresses count characters, as get_string() takes them.
+    char_size = 2 if nsis.header.unicode else 1
+    for offset in table.offsets:
+        string = table.string(offset)
+        if string:
+            yield {'address': offset // char_size, 'value': string}
+
+def iter_page_items(nsis):
+    for i, page in enumerate(nsis.pages):
+        yield {
+            'index': i,
+            'dlg_id': page.dlg_id,
+            'wndproc_id': page.wndproc_id,
+            'wndproc_name': flags.enum_name(page.wndproc_id, flags.PWP_ENUM),
+            'prefunc': page.prefunc,
+            'showfunc': page.showfunc,
+            'leavefunc': page.leavefunc,
+            'flags': page.flags,
+            'flag_names': flags.flag_names(page.flags, flags.PF_FLAGS),
+            'caption': page.caption,
+            'back': page.back,
+            'next': page.next,
+            'clicknext': page.clicknext,
+            'cancel': page.cancel,
+            'params': page.params,
+        }
+
+def iter_section_items(nsis):
+    for i, section in enumerate(nsis.sections):
+        yield {
+            'index': i,
+            'name': nsis.get_section_name(section),
+            'name_ptr': _string_property(nsis, section.name_ptr),
+            'install_types': section.install_types,
+            'flags': section.flags,
+            'flag_names': flags.flag_names(section.flags, flags.SF_FLAGS),
+            'code': section.code,
+            'code_size': section.code_size,
+            'size_kb': section.size_kb,
+        }
+
+def iter_entry_items(nsis):
+    entries = nsis.entries
+    offsets = entries.offsets
+    for i, which in enumerate(entries.which):
+        yield {'index': i, 'which': which,
+               'offsets': [column[i] for column in offsets]}
+
+def dump_structured(path, out=sys.stdout, ndjson=False):
+    """
+    Dump the installer at |path| to |out| as JSON, or JSON lines if |ndjson|
+    is set.
+    """
+    try:
+        nsis = NSIS.from_path(path)
     except HeaderNotFound:
         sys.stderr.write('Error: Target it not an NSIS installer.' + os.linesep)
         sys.exit(1)
 
+    with nsis:
+        writer = StructuredWriter(out, ndjson)
+        writer.write_installer(installer_properties(nsis, path), [
+                ('strings', 'string', iter_string_items(nsis)),
+                ('pages', 'page', iter_page_items(nsis)),
+                ('sections', 'section', iter_section_items(nsis)),
+                ('entries', 'entry', iter_entry_items(nsis)),
+            ])
+
+def scan_summary(path):
+    """ Returns a JSON serializable summary of the installer at |path|. """
+    summary = {'path': path, 'nsis': False, 'error': None}
+    try:
+        nsis = NSIS.from_path(path, mmap=True)
+    except HeaderNotFound:
+        return summary
+    except Exception as e:
+        summary['error'] = '{}: {}'.format(type(e).__name__, e)
+        return summary
+
+    try:
+        firstheader = nsis.firstheader
+        summary.update({
+            'nsis': True,
+            'firstheader': {
+                'offset': firstheader.header_offset,
+                'flags': firstheader.flags,
+                'header_size': firstheader.c_size,
+                'inflated_size': firstheader.u_size,
+            },
+            'decoder': flags.enum_name(nsis.header.decoder, flags.D_ENUM),
+            'solid': nsis.header.solid,
+            'unicode': nsis.header.unicode,
+            'version': '{}.{}'.format(nsis.version_major, nsis.version_minor),
+            'counts': {
+                'pages': len(nsis.pages),
+                'sections': len(nsis.sections),
+                'entries': len(nsis.entries),
+                'strings': len(nsis.string_table().offsets),
+            },
+        })
+    except Exception as e:
+        summary['error'] = '{}: {}'.format(type(e).__name__, e)
+    finally:
+        nsis.close()
+    return summary
+
+def iter_scan_paths(targets):
+    """ Yields the files found in |targets| directories, globs or paths. """
+    for target in targets:
+        if os.path.isdir(target):
+            for root, _, files in os.walk(target):
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        elif os.path.isfile(target):
+            yield target
+        else:
+            for path in sorted(glob.glob(target, recursive=True)):
+                if os.path.isfile(path):
+                    yield path
+
+def scan(targets, jobs=None, out=sys.stdout):
+    """
+    Summarize every installer of |targets| with |jobs| worker processes,
+    writing one JSON line per file to |out| in completion order. Scan mode
+    needs Python 3, the other dumps also run on Python 2.
+    """
+    import concurrent.futures
+    jobs = jobs or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        # Bound the pending futures so huge corpora are not queued at once.
+        pending = set()
+        for path in iter_scan_paths(targets):
+            pending.add(executor.submit(scan_summary, path))
+            if len(pending) >= jobs * 4:
+                done, pending = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                write_summaries(done, out)
+        write_summaries(concurrent.futures.as_completed(pending), out)
+
+def write_summaries(futures, out):
+    for future in futures:
+        out.write(json.dumps(future.result(), sort_keys=True) + '\n')
+    out.flush()
+
+def scan_main(argv):
+    parser = argparse.ArgumentParser(prog='nsisdump.py scan',
+            description='Summarize NSIS installers as JSON lines.')
+    parser.add_argument('targets', nargs='+',
+            help='Installer files, directories or glob patterns.')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+            help='Number of worker processes (default: CPU count).')
+    args = parser.parse_args(argv)
+    scan(args.targets, args.jobs)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='nsisdump.py',
+            description='Dump the structures of an NSIS installer.')
+    parser.add_argument('target', help='Installer file.')
+    parser.add_argument('--format', choices=['text', 'json', 'ndjson'],
+            default='text', help='Output format (default: text).')
+    args = parser.parse_args(argv)
+    if args.format == 'text':
+        dump_all(args.target)
+    else:
+        dump_structured(args.target, ndjson=args.format == 'ndjson')
+
 
 if __name__ == '__main__':
-    nsis_target = sys.argv[1]
-    dump_all(nsis_target)
+    if sys.argv[1:2] == ['scan']:
+        scan_main(sys.argv[2:])
+    else:
+        main(sys.argv[1:])
@@ -9,6 +9,12 @@ bzlib = Extension('nrs.ext.bzlib._bzlib', [
     'nrs/ext/bzlib/huffman.c'
 ], depends=['nrs/ext/bzlib/bzlib.h'])
 
+# Optional accelerator, nrs.strings falls back to pure Python without it.
+strings = Extension('nrs.ext.strings._strings', [
+    'nrs/ext/strings/strings.i',
+    'nrs/ext/strings/strings.c',
+], depends=['nrs/ext/strings/strings.h'], optional=True)
+
 setup(name='nrs',
       version='0.2.6',
       description='NSIS Reversing Suite',
@@ -16,12 +22,12 @@ setup(name='nrs',
       author='isra17',
       author_email='isra017@gmail.com',
       url='https://github.com/isra17/nrs',
-      packages=['nrs','nrs.ext', 'nrs.ext.bzlib', 'nrs.ida', \
-                'nrs.strings'],
+      packages=['nrs','nrs.ext', 'nrs.ext.bzlib', 'nrs.ext.strings', \
+                'nrs.ida', 'nrs.strings'],
 
       install_requires=['future'],
       setup_requires=['pytest-runner'],
       tests_require=['pytest'],
-      ext_modules=[bzlib]
+      ext_modules=[bzlib, strings]
     )
 
@@ -0,0 +1,58 @@
+from nrs import aio, nsisfile
+import asyncio
+import os
+import pytest
+import utils
+
+class FileRangeReader(object):
+    """ Serves byte ranges of a local file, counting the reads. """
+
+    def __init__(self, path):
+        self.path = path
+        self.reads = []
+
+    async def read_at(self, offset, size):
+        self.reads.append((offset, size))
+        await asyncio.sleep(0)
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+@pytest.mark.parametrize('sample', [
+    'example1.exe', 'example_bzip.exe', 'example_lzma_solid.exe',
+    'vopackage'])
+def test_open_async(sample):
+    path = os.path.join(utils.SAMPLES_DIR, sample)
+    reader = FileRangeReader(path)
+    nsis = asyncio.run(nsisfile.NSIS.open_async(reader))
+    expected = nsisfile.NSIS.from_path(path)
+    assert nsis.header == expected.header
+    assert nsis.get_all_strings() == expected.get_all_strings()
+    assert [e.offsets for e in nsis.entries] == \
+            [e.offsets for e in expected.entries]
+
+    data_file = next(nsis.iter_files())
+    data = asyncio.run(nsis.file_data_async(data_file.offset))
+    assert data == b''.join(expected.iter_file_data(data_file.offset))
+
+def test_open_async_ranges(monkeypatch):
+    monkeypatch.setattr(aio, '_MIN_FETCH_SIZE', 0x200)
+    monkeypatch.setattr(aio, '_SCAN_WINDOW_SIZE', 0x1000)
+    path = os.path.join(utils.SAMPLES_DIR, 'example1.exe')
+    reader = FileRangeReader(path)
+    nsis = asyncio.run(nsisfile.NSIS.open_async(
+            reader, parse_level=nsisfile.PARSE_HEADER))
+    # The firstheader is found from the PE overlay.
+    assert nsis.firstheader.header_offset == 0x8a00
+    assert nsis._header is None
+    assert sum(size for _, size in reader.reads) < 0x2000
+
+    asyncio.run(nsis.parse_async())
+    assert nsis.version_major == '3'
+    assert sum(size for _, size in reader.reads) < \
+            os.path.getsize(path) // 2
+
+def test_open_async_not_found():
+    reader = FileRangeReader(os.path.join(utils.SAMPLES_DIR, 'empty'))
+    with pytest.raises(nsisfile.HeaderNotFound):
+        asyncio.run(nsisfile.NSIS.open_async(reader))
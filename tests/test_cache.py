@@ -0,0 +1,101 @@
+from nrs import cache, fileform, nsisfile
+import os
+import utils
+
+EXAMPLE1_PATH = os.path.join(utils.SAMPLES_DIR, 'example1.exe')
+VOPACKAGE_PATH = os.path.join(utils.SAMPLES_DIR, 'vopackage')
+
+def test_cache_load(tmp_path, monkeypatch):
+    parse_cache = cache.ParseCache(str(tmp_path))
+    cold = nsisfile.NSIS.from_path(VOPACKAGE_PATH, cache=parse_cache)
+    cold.get_all_strings()
+    assert parse_cache.misses == 1
+    # The header is stored once inflated, the strings index on close.
+    assert len(os.listdir(str(tmp_path))) == 1
+    cold.close()
+    assert len(os.listdir(str(tmp_path))) == 1
+
+    # Warm loads skip header inflation and string symbolization.
+    def fail(*args):
+        raise AssertionError('header inflated')
+    monkeypatch.setattr(fileform, '_inflate_header', fail)
+    monkeypatch.setattr(nsisfile.strings, 'symbolize_block', fail)
+    warm = nsisfile.NSIS.from_path(VOPACKAGE_PATH, mmap=True,
+                                   cache=parse_cache)
+    assert parse_cache.hits == 1
+    assert warm.header == cold.header
+    assert warm.version_major == cold.version_major == '2'
+    assert warm.get_all_strings() == cold.get_all_strings()
+    assert [f.name for f in warm.iter_files()] == \
+            [f.name for f in cold.iter_files()]
+    warm.close()
+
+def test_cache_invalid_entry(tmp_path):
+    parse_cache = cache.ParseCache(str(tmp_path))
+    nsisfile.NSIS.from_path(EXAMPLE1_PATH, cache=parse_cache).close()
+    entry_path = os.path.join(str(tmp_path), os.listdir(str(tmp_path))[0])
+    with open(entry_path, 'r+b') as f:
+        f.seek(10)
+        f.write(b'\xff' * 4)
+
+    # A digest mismatch is a miss, and the entry is stored again.
+    nsis = nsisfile.NSIS.from_path(EXAMPLE1_PATH, cache=parse_cache)
+    assert parse_cache.misses == 2 and parse_cache.hits == 0
+    assert nsis.get_string(0x4e) == 'Example1'
+    nsis.close()
+    nsisfile.NSIS.from_path(EXAMPLE1_PATH, cache=parse_cache)
+    assert parse_cache.hits == 1
+
+def test_cache_lazy(tmp_path, monkeypatch):
+    parse_cache = cache.ParseCache(str(tmp_path))
+    with nsisfile.NSIS.from_path(VOPACKAGE_PATH, cache=parse_cache,
+                                 parse_level=nsisfile.PARSE_HEADER) as nsis:
+        nsis.header
+
+    # Only the header was parsed and stored, the next load detects the
+    # version and symbolizes strings, and completes the entry.
+    with nsisfile.NSIS.from_path(VOPACKAGE_PATH, cache=parse_cache) as nsis:
+        assert parse_cache.hits == 1
+        assert nsis._string_table is None
+        strings = nsis.get_all_strings()
+
+    def fail(*args):
+        raise AssertionError('strings symbolized')
+    monkeypatch.setattr(nsisfile.strings, 'symbolize_block', fail)
+    with nsisfile.NSIS.from_path(VOPACKAGE_PATH, cache=parse_cache) as nsis:
+        assert parse_cache.hits == 2
+        # The minor version was never read, it is left out.
+        assert nsis._version == ('2', None)
+        assert nsis.get_all_strings() == strings
+
+def test_cache_not_closed(tmp_path):
+    parse_cache = cache.ParseCache(str(tmp_path))
+    nsisfile.NSIS.from_path(EXAMPLE1_PATH, cache=parse_cache)
+    nsis = nsisfile.NSIS.from_path(EXAMPLE1_PATH, cache=parse_cache)
+    assert parse_cache.hits == 1
+    assert nsis._string_table is None
+    assert nsis.get_string(0x4e) == 'Example1'
+
+def test_cache_running_size(tmp_path, monkeypatch):
+    parse_cache = cache.ParseCache(str(tmp_path))
+    nsisfile.NSIS.from_path(EXAMPLE1_PATH, cache=parse_cache).close()
+
+    # Under the limit, stores do not list the cache directory again.
+    def fail(*args):
+        raise AssertionError('cache directory listed')
+    monkeypatch.setattr(cache.os, 'listdir', fail)
+    nsisfile.NSIS.from_path(VOPACKAGE_PATH, cache=parse_cache).close()
+    monkeypatch.undo()
+    assert parse_cache._size == sum(
+            os.path.getsize(os.path.join(str(tmp_path), name))
+            for name in os.listdir(str(tmp_path)))
+
+def test_cache_eviction(tmp_path):
+    parse_cache = cache.ParseCache(str(tmp_path), max_size=0x4000)
+    nsisfile.NSIS.from_path(EXAMPLE1_PATH, cache=parse_cache).close()
+    nsisfile.NSIS.from_path(VOPACKAGE_PATH, cache=parse_cache).close()
+    # The vopackage entry alone is over the limit, evicting everything.
+    assert os.listdir(str(tmp_path)) == []
+    parse_cache.max_size = cache.DEFAULT_MAX_SIZE
+    nsisfile.NSIS.from_path(EXAMPLE1_PATH, cache=parse_cache).close()
+    assert len(os.listdir(str(tmp_path))) == 1
@@ -0,0 +1,147 @@
+from collections import OrderedDict
+from nrs import cfg, disasm
+from nrs.nsisfile import NSIS
+import os
+import utils
+
+def _ins(opcode, *params):
+    return disasm.decode(opcode, list(params) + [0] * (6 - len(params)))
+
+def test_basic_blocks():
+    instructions = [
+        _ins(disasm.I_CALL, 6), # 0: Calls 5.
+        _ins(0x1a, 0, 0, 4, 0), # 1: StrCmp, falls through or jumps to 3.
+        _ins(disasm.I_JMP, 6), # 2: Jumps to 5.
+        _ins(0x06, 0), # 3: UpdateText.
+        _ins(disasm.I_RETURN), # 4
+        _ins(0x07, 1), # 5: Sleep.
+        _ins(disasm.I_RETURN), # 6
+    ]
+    graph = cfg.ControlFlowGraph(instructions, OrderedDict(main=0))
+    assert graph.blocks == [
+            cfg.BasicBlock(0, 2, (2, 3), (5,)),
+            cfg.BasicBlock(2, 3, (5,), ()),
+            cfg.BasicBlock(3, 5, (), ()),
+            cfg.BasicBlock(5, 7, (), ()),
+        ]
+    assert graph.block_at(4).start == 3
+    assert [block.start for block in graph.graph(0)] == [0, 2, 3, 5]
+    assert [block.start for block in graph.graph(3)] == [3]
+    assert list(graph.handler_graphs()) == ['main']
+
+def test_control_flow_nsis():
+    nsis = NSIS.from_path(os.path.join(utils.SAMPLES_DIR, 'vopackage'))
+    graph = nsis.control_flow
+    assert graph is nsis.control_flow
+    assert list(graph.roots.items()) == [
+            ('section_0', 1762), ('page_0_prefunc', 797),
+            ('page_0_showfunc', 800), ('page_0_leavefunc', 806),
+            ('onInit', 1324), ('onUserAbort', 839), ('onGUIInit', 814)]
+    assert graph.blocks[0].start == 0
+    assert graph.blocks[-1].end == len(nsis.entries)
+    for block, following in zip(graph.blocks, graph.blocks[1:]):
+        assert block.end == following.start
+    for blocks in graph.handler_graphs().values():
+        for block in blocks:
+            last = nsis.instructions[block.end - 1]
+            if last.opcode == disasm.I_RETURN:
+                assert block.successors == ()
+
+def test_control_flow_example():
+    with open(os.path.join(utils.SAMPLES_DIR, 'example1.exe'), 'rb') as fd:
+        graph = NSIS(fd).control_flow
+        assert graph.roots == OrderedDict(section_0=0)
+        assert graph.blocks == [cfg.BasicBlock(0, 3, (), ())]
+
+def test_call_graph():
+    instructions = [
+        _ins(disasm.I_CALL, 4), # 0: Calls 3.
+        _ins(disasm.I_RETURN), # 1
+        _ins(0x07, 1), # 2: Dead Sleep.
+        _ins(disasm.I_CALL, 6), # 3: Calls 5.
+        _ins(disasm.I_RETURN), # 4
+        _ins(disasm.I_RETURN), # 5
+        _ins(disasm.I_JMP, 7), # 6: Dead loop.
+        _ins(disasm.I_RETURN), # 7: Address taken.
+    ]
+    graph = cfg.CallGraph(cfg.ControlFlowGraph(
+            instructions, OrderedDict(main=0), address_taken=[7]))
+    assert list(graph.functions) == [0, 3, 5, 7]
+    assert graph.functions[0] == cfg.Function(
+            0, 2, [cfg.BasicBlock(0, 2, (), (3,))], (3,))
+    assert graph.functions[3].calls == (5,)
+    assert graph.callers(5) == [3]
+    assert graph.unreachable == [(2, 3), (6, 7)]
+    assert graph.is_reachable(1)
+    assert not graph.is_reachable(2)
+    assert not graph.is_reachable(6)
+    assert graph.is_reachable(7)
+
+def test_call_graph_shared_tail():
+    instructions = [
+        _ins(disasm.I_JMP, 3), # 0: Jumps to 2.
+        _ins(disasm.I_JMP, 3), # 1: Jumps to 2.
+        _ins(disasm.I_CALL, 5), # 2: Shared tail, calls 4.
+        _ins(disasm.I_RETURN), # 3
+        _ins(disasm.I_RETURN), # 4
+    ]
+    graph = cfg.CallGraph(cfg.ControlFlowGraph(
+            instructions, OrderedDict(first=0, second=1)))
+    tail = cfg.BasicBlock(2, 4, (), (4,))
+    assert graph.functions[0] == cfg.Function(
+            0, 4, [cfg.BasicBlock(0, 1, (2,), ()), tail], (4,))
+    assert graph.functions[1] == cfg.Function(
+            1, 4, [cfg.BasicBlock(1, 2, (2,), ()), tail], (4,))
+    assert graph.callers(4) == [0, 1]
+    assert graph.unreachable == []
+
+def test_call_graph_fall_through():
+    instructions = [
+        _ins(disasm.I_PUSHPOP, 0, 1), # 0: Falls through to 1.
+        _ins(disasm.I_CALL, 4), # 1: Second function, calls 3.
+        _ins(disasm.I_RETURN), # 2
+        _ins(disasm.I_RETURN), # 3
+    ]
+    # Whichever function is walked first, both get the blocks of the second.
+    for roots in [OrderedDict(first=0, second=1),
+                  OrderedDict(second=1, first=0)]:
+        graph = cfg.CallGraph(cfg.ControlFlowGraph(instructions, roots))
+        second = [cfg.BasicBlock(1, 3, (), (3,))]
+        assert graph.functions[0] == cfg.Function(
+                0, 3, [cfg.BasicBlock(0, 1, (1,), ())] + second, (3,))
+        assert graph.functions[1] == cfg.Function(1, 3, second, (3,))
+        assert graph.unreachable == []
+
+def test_call_graph_nsis():
+    nsis = NSIS.from_path(os.path.join(utils.SAMPLES_DIR, 'vopackage'))
+    graph = nsis.call_graph
+    assert graph is nsis.call_graph
+    for root in nsis.control_flow.roots.values():
+        assert root in graph.functions
+    for function in graph.functions.values():
+        for callee in function.calls:
+            assert function.start in graph.callers(callee)
+    # Reachable and unreachable entries cover the whole table once.
+    reached = set(block for function in graph.functions.values()
+                      for block in function.blocks)
+    covered = sum(end - start for start, end in graph.unreachable) + \
+            sum(block.end - block.start for block in reached)
+    assert covered == len(nsis.entries)
+
+class StringsStub(object):
+    def __init__(self, instructions, strings):
+        self.instructions = instructions
+        self.strings = strings
+
+    def get_string(self, address):
+        return self.strings[address]
+
+def test_address_taken():
+    nsis = StringsStub([
+        _ins(disasm.I_STRCPY, 0, 1), # 0: AssignVar $0 "4"
+        _ins(disasm.I_STRCPY, 1, 2), # 1: AssignVar $1 "3", a label.
+        _ins(disasm.I_RETURN), # 2
+        _ins(disasm.I_RETURN), # 3: Function read by GetFunctionAddress.
+        _ins(disasm.I_STRCPY, 2, 3), # 4: AssignVar $2 "text"
+    ], ['', '4', '3', 'text'])
+    assert cfg.address_taken(nsis) == [3]
@@ -0,0 +1,58 @@
+from nrs import disasm
+from nrs.nsisfile import NSIS
+import os
+import utils
+
+def test_opcode_table():
+    for name in ['RETURN', 'JMP', 'CALL', 'EXTRACTFILE', 'PUSHPOP',
+                 'REGISTERDLL', 'PUSH', 'POP', 'EXCH', 'CLEARERRORS',
+                 'ASSIGNVAR', 'LOGSET', 'PLUGINCALL']:
+        opcode = getattr(disasm, 'I_' + name)
+        assert disasm.OPCODES[opcode].name.upper() == name
+    assert disasm.REAL_OPCODES == 0x45
+    for opdef in disasm.OPCODES:
+        assert len(opdef.access) <= 6
+        assert set(opdef.operands) <= set('ISVJO2')
+
+def test_decode_virtual():
+    push = disasm.decode(disasm.I_PUSHPOP, [0x10, 0, 0, 0, 0, 0])
+    assert push.name == 'Push'
+    assert push.operands == (disasm.Operand(disasm.O_STRING, 0x10),)
+    pop = disasm.decode(disasm.I_PUSHPOP, [0, 3, 0, 0, 0, 0])
+    assert pop.opcode == disasm.I_POP
+    assert pop.operands == (disasm.Operand(disasm.O_VAR, 0),)
+    assert disasm.decode(disasm.I_SETFLAG, [2, 0xac, 0, 0, 0, 0]).opcode \
+            == disasm.I_CLEARERRORS
+    assert disasm.decode(0x1000, [0] * 6).opcode == disasm.I_INVALID
+
+def test_decode_jumps():
+    jmp = disasm.decode(disasm.I_JMP, [6, 0, 0, 0, 0, 0])
+    assert jmp.operands == (disasm.Operand(disasm.O_JUMP, 5),)
+    assert jmp.flags & disasm.FLa_NoFlow
+
+    # Jumps to the next entry or read from a variable fall through.
+    nop = disasm.decode(disasm.I_JMP, [0, 0, 0, 0, 0, 0])
+    assert nop.operands == (disasm.Operand(disasm.O_INT, 0),)
+    assert not nop.flags & disasm.FLa_NoFlow
+    strcmp = disasm.decode(0x1a, [1, 2, 4, -3, 0, 0])
+    assert strcmp.operands[2:4] == (disasm.Operand(disasm.O_JUMP, 3),
+                                    disasm.Operand(disasm.O_VAR, 2))
+    assert not strcmp.flags & disasm.FLa_NoFlow
+
+def test_decode_entries():
+    with open(os.path.join(utils.SAMPLES_DIR, 'example1.exe'), 'rb') as fd:
+        nsis = NSIS(fd)
+        assert [i.name for i in nsis.instructions] == \
+                ['CreateDir', 'ExtractFile', 'Return']
+        extract = nsis.instructions[1]
+        assert extract.operands[1].type == disasm.O_STRING
+        assert nsis.get_string(extract.operands[1].value) == 'example1.nsi'
+
+def test_decode_entries_nsis2():
+    nsis = NSIS.from_path(os.path.join(utils.SAMPLES_DIR, 'vopackage'))
+    instructions = disasm.decode_entries(nsis.entries)
+    assert len(instructions) == len(nsis.entries) == 1815
+    assert instructions[0].name == 'Call'
+    assert instructions[0].operands == (disasm.Operand(disasm.O_JUMP, 2),)
+    assert [i.name for i in instructions[10:14]] == \
+            ['ExtractFile', 'SetFlag', 'Push', 'RegisterDLL']
@@ -1,4 +1,6 @@
 from nrs import fileform
+import io
+import mmap
 import os
 import pytest
 import utils
@@ -24,6 +26,43 @@ def test_findheader_found():
         assert firstheader.magics == b'NullsoftInst'
         assert firstheader.c_size < firstheader.u_size
 
+def test_findheader_overlay():
+    # Scanning from the PE overlay finds the same header.
+    with open(os.path.join(utils.SAMPLES_DIR, 'example1.exe'), 'rb') \
+            as nsis_file:
+        overlay_offset = fileform._pe_overlay_offset(nsis_file)
+        firstheader = fileform._find_firstheader(nsis_file, overlay=True)
+        assert firstheader.header_offset >= overlay_offset
+        assert firstheader.header_offset == \
+                fileform._find_firstheader(nsis_file).header_offset
+
+def test_findheader_mmap():
+    with open(os.path.join(utils.SAMPLES_DIR, 'example1.exe'), 'rb') \
+            as nsis_file:
+        firstheader = fileform._find_firstheader(nsis_file)
+        mapped = mmap.mmap(nsis_file.fileno(), 0, access=mmap.ACCESS_READ)
+        assert fileform._find_firstheader(mapped) == firstheader
+        assert fileform._find_firstheader(mapped).header_offset == \
+                firstheader.header_offset
+        mapped.close()
+
+def test_findheader_alignment():
+    with open(os.path.join(utils.SAMPLES_DIR, 'example1.exe'), 'rb') \
+            as nsis_file:
+        firstheader = fileform._find_firstheader(nsis_file)
+        nsis_file.seek(firstheader.header_offset)
+        raw_firstheader = nsis_file.read(28)
+
+    # Unaligned headers are ignored, aligned ones are found across windows.
+    unaligned = b'\0' * 100 + raw_firstheader + b'\0' * 1000
+    assert fileform._find_firstheader(io.BytesIO(unaligned)) is None
+
+    for offset in [fileform._SCAN_WINDOW_SIZE,
+                   fileform._SCAN_WINDOW_SIZE + fileform.FH_ALIGNMENT]:
+        data = unaligned + b'\0' * (offset - len(unaligned)) + raw_firstheader
+        firstheader = fileform._find_firstheader(io.BytesIO(data))
+        assert firstheader.header_offset == offset
+
 def test_extract_header():
     with open(os.path.join(utils.SAMPLES_DIR, 'example1.exe'), 'rb') \
             as nsis_file:
@@ -88,3 +127,176 @@ def test_extract_lzma_solid():
         firstheader = fileform._find_firstheader(nsis_file)
         header = fileform._extract_header(nsis_file, firstheader)
         assert header is not None
+
+# bzip2 needs a whole block, which spans the entire sample, before output.
+@pytest.mark.parametrize('sample, decoder, bounded', [
+    ('example_zlib_solid.exe', fileform.D_ZLIB, True),
+    ('example_bzip_solid.exe', fileform.D_BZIP2, False),
+    pytest.param('example_lzma_solid.exe', fileform.D_LZMA, True,
+        marks=pytest.mark.skipif(not has_lzma, reason="no lzma support")),
+])
+def test_inflate_solid_streaming(monkeypatch, sample, decoder, bounded):
+    # Only the compressed data needed for the header should be read.
+    monkeypatch.setattr(fileform, '_INFLATE_CHUNK_SIZE', 0x100)
+    path = os.path.join(utils.SAMPLES_DIR, sample)
+    with open(path, 'rb') as nsis_file:
+        firstheader = fileform._find_firstheader(nsis_file)
+        inflated_data, data_size, header_decoder, solid = \
+                fileform.inflate_header(nsis_file, firstheader.data_offset)
+        assert header_decoder == decoder
+        assert solid
+        assert data_size == firstheader.u_size == len(inflated_data)
+        if bounded:
+            assert nsis_file.tell() < os.path.getsize(path)
+
+def test_bzip2_decompressor():
+    from nrs.ext import bzlib
+    with open(os.path.join(utils.SAMPLES_DIR, 'example_bzip.exe'), 'rb') \
+            as nsis_file:
+        firstheader = fileform._find_firstheader(nsis_file)
+        nsis_file.seek(firstheader.data_offset)
+        size = fileform.struct.unpack('<I', nsis_file.read(4))[0] & 0x7fffffff
+        data = nsis_file.read(size)
+
+    expected = bzlib.decompress(data)
+    assert len(expected) == firstheader.u_size
+
+    # Bounded output, resumed from the unconsumed tail.
+    decompressor = bzlib.BzDecompressor()
+    out = b''
+    while not decompressor.eof and len(out) < len(expected):
+        chunk = decompressor.decompress(data, 100)
+        assert len(chunk) <= 100
+        out += chunk
+        data = decompressor.unconsumed_tail
+    assert out == expected
+
+def test_bzip2_decompress_error():
+    from nrs.ext import bzlib
+    with open(os.path.join(utils.SAMPLES_DIR, 'example_bzip.exe'), 'rb') \
+            as nsis_file:
+        firstheader = fileform._find_firstheader(nsis_file)
+        nsis_file.seek(firstheader.data_offset)
+        size = fileform.struct.unpack('<I', nsis_file.read(4))[0] & 0x7fffffff
+        data = nsis_file.read(size)
+    # Corrupted end of stream marker.
+    corrupted = bytearray(data)
+    corrupted[-1] ^= 0xff
+    corrupted = bytes(corrupted)
+
+    with pytest.raises(bzlib.BzException) as e:
+        bzlib.BzDecompressor().decompress(corrupted)
+    assert e.value.output == bzlib.decompress(data)
+    # The one-shot decompress returns the output decoded before the error.
+    assert bzlib.decompress(corrupted) == e.value.output
+
+@pytest.mark.parametrize('spill', [True, False])
+def test_solid_reader(monkeypatch, spill):
+    # Small windows so items span several of them and the cache overflows.
+    monkeypatch.setattr(fileform, '_SOLID_WINDOW_SIZE', 0x1000)
+    with open(os.path.join(utils.SAMPLES_DIR, 'vopackage'), 'rb') as fd:
+        firstheader = fileform._find_firstheader(fd)
+        fileform._extract_header(fd, firstheader)
+        offsets = [0, 11268, 32264, 149516]
+        expected = [b''.join(fileform._iter_data_item(fd, firstheader, o))
+                        for o in offsets]
+
+        reader = fileform._SolidReader(fd, firstheader, spill, cache_size=4)
+        for offset, data in reversed(list(zip(offsets, expected))):
+            assert b''.join(reader.iter_item(offset)) == data
+        for offset, data in zip(offsets, expected):
+            assert b''.join(reader.iter_item(offset)) == data
+        reader.close()
+
+    assert all(reader.items[o] == len(d) for o, d in zip(offsets, expected))
+    if spill:
+        assert reader.passes == 1
+    else:
+        assert reader.passes > 1
+
+def test_entry_table():
+    rows = [(i, i, -1, 2 * i, 0, 0, i + 7) for i in range(10)]
+    block = b''.join(fileform._entry_fields_pack.pack(*r) for r in rows)
+    # A truncated trailing entry is ignored.
+    entries = fileform._parse_entries(block + b'\0' * 8, 11)
+    assert len(entries) == 10
+    assert list(entries.which) == list(range(10))
+    assert list(entries.offsets[1]) == [-1] * 10
+    assert list(entries.offsets[5]) == [i + 7 for i in range(10)]
+    assert entries[3].which == 3
+    assert entries[3].offsets == [3, -1, 6, 0, 0, 10]
+    assert entries[-1].raw_offsets == block[9*28+4:10*28]
+    assert [e.which for e in entries[2:4]] == [2, 3]
+    with pytest.raises(IndexError):
+        entries[10]
+
+def test_parse_pages_sections():
+    page = fileform._page_fields_pack.pack(1, 2, -1, 3, 4, 5, 6, 7, 8, 9,
+                                           10, 11, 12, 13, 14, 15)
+    pages = fileform._parse_pages(page * 3, 3)
+    assert len(pages) == 3
+    assert pages[2].dlg_id == 1 and pages[2].prefunc == -1
+    assert pages[2].cancel == 10
+    assert pages[2].params == [15, 14, 13, 12, 11]
+    assert pages[2].raw_params == page[-20:]
+
+    for unicode in (False, True):
+        pack = fileform._section_pack_unicode if unicode \
+                else fileform._section_pack
+        name = 'Main'.encode('utf-16le' if unicode else 'ascii')
+        section = pack.pack(1, 2, 3, 4, 5, 6, name)
+        sections = fileform._parse_sections(memoryview(section * 2), 2,
+                                            unicode)
+        assert len(sections) == 2
+        assert sections[1][:6] == (1, 2, 3, 4, 5, 6)
+        assert isinstance(sections[1].name, memoryview)
+        assert sections[1].name.tobytes() == section[24:]
+
+def test_block_bounds():
+    blocks = [fileform.BlockHeader(o, 0) for o in
+                (300, 492, 1540, 1624, 2490, 2720, 0, 0)]
+    assert fileform._block_bounds(blocks, 2720) == [
+            (300, 492), (492, 1540), (1540, 1624), (1624, 2490),
+            (2490, 2720), (2720, 2720), (0, 0), (0, 0)]
+    # Out of order blocks end at the next offset, the last one at the end of
+    # the header.
+    blocks = [fileform.BlockHeader(o, 0) for o in (300, 0, 900, 500)]
+    assert fileform._block_bounds(blocks, 1000) == [
+            (300, 500), (0, 0), (900, 1000), (500, 900)]
+    # Empty blocks share their offset with the following one.
+    blocks = [fileform.BlockHeader(o, 0) for o in
+                (300, 300, 400, 500, 500, 600, 0, 0)]
+    assert fileform._block_bounds(blocks, 700) == [
+            (300, 300), (300, 400), (400, 500), (500, 500), (500, 600),
+            (600, 700), (0, 0), (0, 0)]
+
+@pytest.mark.parametrize('sample, decoder, solid', [
+    ('example_zlib.exe', fileform.D_ZLIB, False),
+    ('example_zlib_solid.exe', fileform.D_ZLIB, True),
+    ('example_bzip.exe', fileform.D_BZIP2, False),
+    ('example_bzip_solid.exe', fileform.D_BZIP2, True),
+    pytest.param('example_lzma.exe', fileform.D_LZMA, False,
+        marks=pytest.mark.skipif(not has_lzma, reason="no lzma support")),
+    pytest.param('example_lzma_solid.exe', fileform.D_LZMA, True,
+        marks=pytest.mark.skipif(not has_lzma, reason="no lzma support")),
+])
+def test_probe(sample, decoder, solid):
+    with open(os.path.join(utils.SAMPLES_DIR, sample), 'rb') as nsis_file:
+        info = fileform.probe(nsis_file)
+        assert nsis_file.tell() == info.data_offset + fileform._PROBE_SIZE
+        firstheader = fileform._find_firstheader(nsis_file)
+        header = fileform._extract_header(nsis_file, firstheader)
+
+    assert info.firstheader == firstheader
+    assert info.data_offset == firstheader.data_offset
+    assert (info.decoder, info.solid) == (decoder, solid)
+    assert (header.decoder, header.solid) == (decoder, solid)
+    assert info.header_u_size == len(firstheader._raw_header)
+    if solid:
+        assert info.header_c_size is None
+    else:
+        assert info.header_c_size == firstheader._raw_header_c_size
+
+def test_probe_not_found():
+    with open(os.path.join(utils.SAMPLES_DIR, 'empty'), 'rb') as nsis_file:
+        assert fileform.probe(nsis_file) is None
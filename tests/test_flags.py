@@ -0,0 +1,16 @@
+from nrs import fileform, flags
+
+def test_flag_names():
+    value = fileform.SF_SELECTED | fileform.SF_BOLD | 0x10000
+    assert flags.flag_names(value, flags.SF_FLAGS) == ['SF_SELECTED', 'SF_BOLD']
+    assert flags.format_flags(value, flags.SF_FLAGS) == 'SF_SELECTED | SF_BOLD'
+    assert flags.format_flags(0, flags.CH_FLAGS) == ''
+    assert [name for _, name in flags.FH_FLAGS] == [
+            'FH_FLAGS_UNINSTALL', 'FH_FLAGS_SILENT', 'FH_FLAGS_NO_CRC',
+            'FH_FLAGS_FORCE_CRC']
+
+def test_enum_name():
+    assert flags.enum_name(fileform.PWP_CUSTOM, flags.PWP_ENUM) == 'PWP_CUSTOM'
+    assert flags.enum_name(42, flags.PWP_ENUM) is None
+    assert flags.enum_name(-1, flags.PWP_ENUM, '<unknown>') == '<unknown>'
+    assert flags.enum_name(fileform.NB_DATA, flags.NB_ENUM) == 'NB_DATA'
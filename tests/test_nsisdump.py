@@ -0,0 +1,62 @@
+import io
+import json
+import os
+import utils
+import nsisdump
+
+def test_scan_summary():
+    summary = nsisdump.scan_summary(
+            os.path.join(utils.SAMPLES_DIR, 'example_lzma_solid.exe'))
+    assert summary['nsis']
+    assert summary['error'] is None
+    assert summary['decoder'] == 'D_LZMA'
+    assert summary['solid']
+    assert summary['counts']['entries'] == 3
+
+    summary = nsisdump.scan_summary(os.path.join(utils.SAMPLES_DIR, 'empty'))
+    assert not summary['nsis']
+
+def test_scan():
+    out = io.StringIO()
+    nsisdump.scan([utils.SAMPLES_DIR,
+                   os.path.join(utils.SAMPLES_DIR, 'example1.*')], 2, out)
+    summaries = [json.loads(line) for line in out.getvalue().splitlines()]
+    paths = [s['path'] for s in summaries]
+    assert len(paths) == len(os.listdir(utils.SAMPLES_DIR)) + 1
+    assert paths.count(os.path.join(utils.SAMPLES_DIR, 'example1.exe')) == 2
+    assert sum(s['nsis'] for s in summaries) == len(summaries) - 1
+
+def test_dump_json():
+    out = io.StringIO()
+    nsisdump.dump_structured(
+            os.path.join(utils.SAMPLES_DIR, 'example1.exe'), out)
+    dump = json.loads(out.getvalue())
+    assert dump['version'] == '3.0b3'
+    assert dump['header']['decoder'] == 'D_ZLIB'
+    assert 'CH_FLAGS_NO_ROOT_DIR' in dump['header']['flag_names']
+    assert {'address': 87, 'value': '$INSTALLDIR'} in dump['strings']
+    assert len(dump['entries']) == 3
+    assert len(dump['pages']) == 3
+    assert dump['sections'][0]['index'] == 0
+
+def test_dump_json_unicode(tmp_path):
+    path = str(tmp_path / 'unicode.exe')
+    utils.write_unicode_installer(path)
+    out = io.StringIO()
+    nsisdump.dump_structured(path, out)
+    dump = json.loads(out.getvalue())
+    # String addresses count UTF-16 code units, as entry operands.
+    assert dump['strings'] == [{'address': 1, 'value': 'Example'},
+                               {'address': 9, 'value': 'file.txt'}]
+    assert dump['entries'][0]['offsets'][1] == 9
+
+def test_dump_ndjson():
+    out = io.StringIO()
+    nsisdump.dump_structured(os.path.join(utils.SAMPLES_DIR, 'vopackage'),
+                             out, ndjson=True)
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert records[0]['type'] == 'installer'
+    assert records[0]['version'] == '2.?'
+    entries = [r for r in records if r['type'] == 'entry']
+    assert len(entries) == 1815
+    assert entries[5]['index'] == 5 and len(entries[5]['offsets']) == 6
@@ -1,6 +1,7 @@
 from nrs import nsisfile
 import pytest
 import utils
+import hashlib
 import os
 import sys
 
@@ -8,6 +9,9 @@ EMPTY_PATH = os.path.join(utils.SAMPLES_DIR, 'empty')
 EXAMPLE1_PATH = os.path.join(utils.SAMPLES_DIR, 'example1.exe')
 EMPTY_PATH = os.path.join(utils.SAMPLES_DIR, 'vopackage.exe')
 
+requires_lzma = pytest.mark.skipif(utils.lzma is None,
+                                   reason="no lzma support")
+
 def test_non_nsis():
     with pytest.raises(nsisfile.HeaderNotFound):
         nsis = nsisfile.NSIS.from_path(os.path.join(utils.SAMPLES_DIR, 'empty'))
@@ -24,6 +28,15 @@ def test_get_string():
         assert nsis.get_string(0x4a) == '$__SHELL_16_25__\\Example1'
         assert nsis.get_string(0x57) == '$INSTALLDIR'
         assert nsis.get_string(0x87) == '$(LangString2) Setup'
+        # Language strings -(id + 1) of the default language.
+        assert nsis.get_string(~2) == 'Example1'
+        assert nsis.get_string(~2 & 0xffffffff) == 'Example1'
+        assert nsis.get_string(~1) == '$(LangString2) Setup'
+        # Out of range language strings are empty unless strict.
+        assert nsis.get_string(~1000) == ''
+        assert nsis.get_string(~0x7fffffff) == ''
+        with pytest.raises(ValueError):
+            nsis.get_string(~1000, strict=True)
 
 def test_get_raw_string():
     with open(EXAMPLE1_PATH, 'rb') as fd:
@@ -32,6 +45,8 @@ def test_get_raw_string():
         assert nsis.get_raw_string(0x4a) == b'\x02\x10\x19\\Example1'
         assert nsis.get_raw_string(0x57) == b'\x03\x95\x80'
         assert nsis.get_raw_string(0x87) == b'\x01\x82\x80 Setup'
+        assert nsis.get_raw_string(~2) == b'Example1'
+        assert nsis.get_raw_string(~1000) == b''
 
 def test_get_all_strings():
     with open(EXAMPLE1_PATH, 'rb') as fd:
@@ -49,5 +64,140 @@ def test_block():
         assert len(nsis.block(nsisfile.NB_STRINGS)) == 0x362
         assert len(nsis.block(nsisfile.NB_LANGTABLES)) == 0xe6
         assert len(nsis.block(nsisfile.NB_CTLCOLORS)) == 0x0
-        assert len(nsis.block(nsisfile.NB_BGFONT)) == 0x8
-        assert len(nsis.block(nsisfile.NB_DATA)) == 0x8
+        assert len(nsis.block(nsisfile.NB_BGFONT)) == 0x0
+        assert len(nsis.block(nsisfile.NB_DATA)) == 0x0
+
+@pytest.mark.skipif('sys.version_info < (3,)',
+                    reason='no mmap views on Python 2')
+def test_mmap_views():
+    nsis = nsisfile.NSIS.from_path(EXAMPLE1_PATH, mmap=True)
+    with open(EXAMPLE1_PATH, 'rb') as fd:
+        copy = nsisfile.NSIS(fd)
+
+    assert isinstance(nsis.raw, memoryview)
+    assert isinstance(nsis.raw_header, memoryview)
+    assert isinstance(nsis.block(nsisfile.NB_STRINGS), memoryview)
+    assert isinstance(nsis.get_raw_string(0x4e), memoryview)
+    assert isinstance(nsis.sections[0].name, memoryview)
+    assert nsis.get_raw_string(0x4e) == b'Example1'
+    assert nsis.get_string(0x4a) == copy.get_string(0x4a)
+    assert nsis.get_all_strings() == copy.get_all_strings()
+    assert [e.offsets for e in nsis.entries] == \
+            [e.offsets for e in copy.entries]
+    assert bytes(nsis.sections[0].name) == copy.sections[0].name
+    nsis.close()
+
+@pytest.mark.skipif('sys.version_info < (3,)',
+                    reason='no mmap views on Python 2')
+def test_mmap_close_with_views():
+    with nsisfile.NSIS.from_path(EXAMPLE1_PATH, mmap=True) as nsis:
+        header = nsis.raw[0:16]
+    # The mapping is kept until the slice is released.
+    assert not nsis.fd.closed
+    assert header.tobytes()[:2] == b'MZ'
+    header.release()
+    nsis.close()
+    assert nsis.fd.closed
+
+def test_unicode_string_addresses(tmp_path):
+    path = str(tmp_path / 'unicode.exe')
+    utils.write_unicode_installer(path)
+    with nsisfile.NSIS.from_path(path) as nsis:
+        assert nsis.header.unicode
+        assert nsis.get_string(1) == 'Example'
+        assert nsis.get_string(4) == 'mple'
+        assert nsis.get_string(9) == 'file.txt'
+        assert nsis.get_raw_string(9) == u'file.txt'.encode('utf-16le')
+        # Language string 0.
+        assert nsis.get_string(-1) == 'Example'
+        files = list(nsis.iter_files())
+        assert [f.name for f in files] == ['file.txt']
+        assert b''.join(nsis.iter_file_data(files[0].offset)) == b'hello'
+
+def test_string_table():
+    with open(EXAMPLE1_PATH, 'rb') as fd:
+        nsis = nsisfile.NSIS(fd)
+    table = nsis.string_table()
+    assert table is nsis.string_table()
+    assert table.offsets[:3] == [0, 1, 17]
+    assert table.string(1) == 'ProgramFilesDir'
+    assert table.decode(0x4a) == ('$__SHELL_16_25__\\Example1', 13)
+    # Address inside another string.
+    assert 0x4e not in table.offsets
+    assert table.decode(0x4e) == ('Example1', 9)
+    assert table.raw(0x4e) == b'Example1'
+    assert [str(s) for s in table.symbols(0x57)] == ['$INSTALLDIR']
+    assert nsis.get_all_raw_strings()[0] == b'ProgramFilesDir'
+    assert len(nsis.get_all_raw_strings()) == len(nsis.get_all_strings())
+
+@pytest.mark.parametrize('name', [
+    'example1.exe', 'example_zlib.exe', 'example_zlib_solid.exe',
+    'example_bzip.exe', 'example_bzip_solid.exe',
+    pytest.param('example_lzma.exe', marks=requires_lzma),
+    pytest.param('example_lzma_solid.exe', marks=requires_lzma)])
+def test_extract(tmp_path, name):
+    nsis = nsisfile.NSIS.from_path(os.path.join(utils.SAMPLES_DIR, name))
+    paths = nsis.extract(str(tmp_path))
+    nsis.close()
+    assert [os.path.basename(p) for p in paths] == ['example1.nsi']
+    with open(paths[0], 'rb') as fd:
+        data = fd.read()
+    assert len(data) == 908
+    assert data.startswith(b'; example1.nsi\r\n')
+    assert hashlib.md5(data).hexdigest() == 'd19ff68b5250aaccccc6155f84568d71'
+
+def test_iter_files_nsis2():
+    nsis = nsisfile.NSIS.from_path(os.path.join(utils.SAMPLES_DIR,
+                                                'vopackage'))
+    files = list(nsis.iter_files())
+    assert len(files) == 7
+    assert files[0].name == '$PLUGINSDIR\\System.dll'
+    assert files[0].offset == 0
+    data = b''.join(nsis.iter_file_data(files[0].offset))
+    assert data[:2] == b'MZ'
+    assert len(data) == files[1].offset - 4
+
+def test_closed_file():
+    with open(EXAMPLE1_PATH, 'rb') as fd:
+        nsis = nsisfile.NSIS(fd, parse_level=nsisfile.PARSE_HEADER)
+    # Without a path, the closed file cannot be reopened.
+    with pytest.raises(ValueError):
+        nsis.header
+
+    with nsisfile.NSIS.from_path(EXAMPLE1_PATH,
+                                 parse_level=nsisfile.PARSE_HEADER) as nsis:
+        assert nsis.version_major == '3'
+        assert nsis._data_fd is not None
+    assert nsis._data_fd is None
+
+def test_closed_file_version():
+    with open(EXAMPLE1_PATH, 'rb') as fd:
+        nsis = nsisfile.NSIS(fd)
+        assert nsis.version_major == '3'
+    # The stub cannot be searched anymore, the minor version is unknown.
+    assert nsis.version_minor == '?'
+    assert nsis.build.major == '3'
+    assert nsis.build.minor == '?'
+
+@pytest.mark.skipif('sys.version_info < (3,)',
+                    reason='no mmap views on Python 2')
+def test_parse_level():
+    nsis = nsisfile.NSIS.from_path(EXAMPLE1_PATH,
+                                   parse_level=nsisfile.PARSE_HEADER)
+    assert nsis.firstheader is not None
+    assert nsis._header is None
+    # The installer is reopened to inflate the header on first access.
+    assert nsis.version_major == '3'
+    assert nsis._entries is None
+    assert len(nsis.entries) == 3
+    full = nsisfile.NSIS.from_path(EXAMPLE1_PATH)
+    assert [e.offsets for e in nsis.entries] == \
+            [e.offsets for e in full.entries]
+    nsis.close()
+
+    nsis = nsisfile.NSIS.from_path(EXAMPLE1_PATH, mmap=True,
+                                   parse_level=nsisfile.PARSE_METADATA)
+    assert nsis._header is not None and nsis._sections is None
+    nsis.parse()
+    assert nsis._sections is not None
+    nsis.close()
@@ -0,0 +1,68 @@
+from nrs import disasm, fileform, plugins
+from nrs.nsisfile import NSIS
+import os
+import struct
+import utils
+
+def _entries(rows):
+    block = b''.join(struct.pack('<7I', *(row + (0,) * (7 - len(row))))
+                        for row in rows)
+    return fileform.EntryTable(block, len(rows))
+
+def test_find_plugin_calls():
+    entries = _entries([
+        (disasm.I_CALL, 100),
+        (disasm.I_EXTRACTFILE, 0, 10),
+        (disasm.I_SETFLAG, 13),
+        (disasm.I_PUSHPOP, 30),
+        (disasm.I_PUSHPOP, 20),
+        (disasm.I_REGISTERDLL, 10, 15),
+        (disasm.I_PUSHPOP, 0, 1), # Pop $0
+        # RegDLL, not a plugin call.
+        (disasm.I_REGISTERDLL, 40, 45),
+        # No arguments.
+        (disasm.I_CALL, 100),
+        (disasm.I_EXTRACTFILE, 0, 10),
+        (disasm.I_SETFLAG, 13),
+        (disasm.I_REGISTERDLL, 10, 50),
+    ])
+    assert plugins.find_plugin_calls(entries) == [
+            (0, 10, 15, [20, 30]),
+            (8, 10, 50, [])]
+
+def test_plugin_calls_nsis():
+    nsis = NSIS.from_path(os.path.join(utils.SAMPLES_DIR, 'vopackage'))
+    calls = nsis.plugin_calls
+    assert calls is nsis.plugin_calls
+    assert len(calls) == 55
+    assert calls[0] == plugins.PluginCall(9, 'System.dll', 'Alloc', ['156'])
+    get = [call for call in calls if call.function == 'get'][0]
+    assert get.dll == 'inetc.dll'
+    assert get.args[:3] == ['/NOCANCEL', '/SILENT', '/NOPROXY']
+    assert get.args[-1] == '/end'
+
+    inventory = plugins.inventory(calls)
+    assert inventory[('system.dll', 'Call')] == 18
+    assert inventory[('inetc.dll', 'get')] == 10
+    assert sum(inventory.values()) == len(calls)
+
+def test_plugin_calls_none():
+    with open(os.path.join(utils.SAMPLES_DIR, 'example1.exe'), 'rb') as fd:
+        nsis = NSIS(fd)
+        assert nsis.plugin_calls == []
+        assert plugins.inventory(nsis.plugin_calls) == {}
+
+def test_plugin_calls_language_strings():
+    with open(os.path.join(utils.SAMPLES_DIR, 'example1.exe'), 'rb') as fd:
+        nsis = NSIS(fd)
+        # Arguments are expanded as get_string does, resolving language
+        # strings -(id + 1).
+        nsis._entries = _entries([
+            (disasm.I_CALL, 100),
+            (disasm.I_EXTRACTFILE, 0, 0x4e),
+            (disasm.I_SETFLAG, 13),
+            (disasm.I_PUSHPOP, ~2 & 0xffffffff),
+            (disasm.I_REGISTERDLL, 0x4e, 0x4e),
+        ])
+        assert nsis.plugin_calls == [plugins.PluginCall(
+                0, 'Example1', 'Example1', ['Example1'])]
@@ -0,0 +1,84 @@
+from nrs import fileform, nsisfile, rangeio
+import os
+import pytest
+import utils
+
+class BytesSource(object):
+    """ read_at() source over a local file. """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = f.read()
+
+    def read_at(self, offset, size):
+        return self.data[offset:offset + size]
+
+def test_range_file():
+    f = rangeio.RangeFile()
+    f.add(10, b'abcd')
+    f.add(20, b'klmn')
+    f.seek(11)
+    assert f.read(2) == b'bc'
+    with pytest.raises(rangeio.MissingRange) as e:
+        f.read(10)
+    assert (e.value.offset, e.value.size) == (14, 9)
+    f.add(14, b'efghij', eof=False)
+    f.seek(10)
+    assert f.read(14) == b'abcdefghijklmn'
+    with pytest.raises(rangeio.MissingRange):
+        f.read()
+    f.add(24, b'op', eof=True)
+    f.seek(22)
+    assert f.read(100) == b'mnop'
+    assert f.read(1) == b''
+
+@pytest.mark.parametrize('sample', ['example_zlib.exe', 'vopackage'])
+def test_read_at(sample):
+    path = os.path.join(utils.SAMPLES_DIR, sample)
+    stats = rangeio.IOStats()
+    nsis = nsisfile.NSIS.from_read_at(BytesSource(path), io_hook=stats)
+    expected = nsisfile.NSIS.from_path(path)
+    assert nsis.header == expected.header
+    assert nsis.get_all_strings() == expected.get_all_strings()
+    assert set(stats.reads) == {rangeio.STAGE_FIRSTHEADER,
+                                rangeio.STAGE_HEADER}
+    # The firstheader follows the PE sections, only headers and the first
+    # window after them are read.
+    assert stats.bytes[rangeio.STAGE_FIRSTHEADER] < 0x2000
+    # The minor version is read from the manifest of the stub on demand.
+    assert nsis.version_minor == expected.version_minor
+    if nsis.firstheader.header_offset:
+        assert stats.bytes[rangeio.STAGE_STUB] < 0x2000
+
+    data_file = next(nsis.iter_files())
+    data = b''.join(nsis.iter_file_data(data_file.offset))
+    assert data == b''.join(expected.iter_file_data(data_file.offset))
+    assert stats.reads[rangeio.STAGE_EXTRACT] > 0
+    assert stats.total_bytes() == sum(stats.bytes.values())
+
+def test_read_at_no_manifest():
+    # A stripped stub without manifest: metadata parsing reads nothing of
+    # it, the whole search window is only read for the minor version.
+    with open(os.path.join(utils.SAMPLES_DIR, 'example_zlib.exe'), 'rb') as f:
+        data = f.read()
+    data = data.replace(b'Nullsoft Install System', b'\0' * 23)
+    source = BytesSource(os.path.join(utils.SAMPLES_DIR, 'example_zlib.exe'))
+    source.data = data
+    stats = rangeio.IOStats()
+    nsis = nsisfile.NSIS.from_read_at(source,
+                                      parse_level=nsisfile.PARSE_METADATA,
+                                      io_hook=stats)
+    assert nsis.version_major == '3'
+    assert rangeio.STAGE_STUB not in stats.reads
+    assert stats.total_bytes() < 0x4000
+    assert nsis.version_minor == '?'
+    assert stats.bytes[rangeio.STAGE_STUB] >= nsis.firstheader.header_offset
+
+def test_read_at_block_stage():
+    path = os.path.join(utils.SAMPLES_DIR, 'example_zlib.exe')
+    stats = rangeio.IOStats()
+    nsis_file = rangeio.ReadAtFile(BytesSource(path), stats)
+    firstheader = fileform._find_firstheader(nsis_file)
+    fileform._extract_header(nsis_file, firstheader)
+    block = fileform._extract_block(nsis_file, firstheader, fileform.NB_DATA)
+    assert stats.bytes[rangeio.STAGE_BLOCK] == len(block) > 0
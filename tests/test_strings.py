@@ -0,0 +1,117 @@
+from __future__ import unicode_literals
+from builtins import str
+from nrs import nsisfile, strings
+import os
+import pytest
+import utils
+
+EXAMPLE1_PATH = os.path.join(utils.SAMPLES_DIR, 'example1.exe')
+
+@pytest.fixture(params=['native', 'python'])
+def implementation(request, monkeypatch):
+    if request.param == 'native':
+        if strings._native is None:
+            pytest.skip('native strings extension not built')
+    else:
+        monkeypatch.setattr(strings, '_native', None)
+    return request.param
+
+def test_symbolize(implementation):
+    symbols, size = strings.symbolize(b'\x02\x10\x19\\Example1\x00', 0)
+    assert size == 13
+    assert symbols[0].is_shell()
+    assert (symbols[0].param1, symbols[0].param2) == (0x10, 0x19)
+    assert symbols[1].is_string() and symbols[1] == '\\Example1'
+
+    symbols, size = strings.symbolize(b'\xfd\x95\x80$\x00', 0, '2')
+    assert size == 5
+    assert symbols[0].is_var() and str(symbols[0]) == '$INSTALLDIR'
+    assert symbols[1] == '$$'
+
+def test_decode_skip_code(implementation):
+    assert strings.decode(b'a\x04\x01b\x00') == ('a\x01b', 5)
+    assert strings.decode(b'a\xfc\xfdb\x00', 0, '2') == ('a\xfdb', 5)
+
+def test_symbolize_block(implementation):
+    with open(EXAMPLE1_PATH, 'rb') as fd:
+        nsis = nsisfile.NSIS(fd)
+    block = nsis.block(nsisfile.NB_STRINGS)
+
+    offset = 0
+    for string_offset, size, spans in strings.symbolize_block(block):
+        assert string_offset == offset
+        string, processed = strings.decode(block, offset)
+        assert processed == size
+        assert string == strings._spans_string(spans)
+        for kind, start, end, value in spans:
+            assert offset <= start < end <= offset + size
+        offset += size
+    assert offset == len(block)
+
+    assert (0x4a, 13, '$__SHELL_16_25__\\Example1') in \
+            strings.decode_block(block)
+
+def test_native_matches_python(monkeypatch):
+    if strings._native is None:
+        pytest.skip('native strings extension not built')
+    with open(EXAMPLE1_PATH, 'rb') as fd:
+        block = nsisfile.NSIS(fd).block(nsisfile.NB_STRINGS)
+    data = bytes(block) + b'\x03\x01\x04$\t\xfd\xfe\xff\x00' + b'A' * 2000
+
+    native = [strings.symbolize_block(data, version) for version in '23']
+    monkeypatch.setattr(strings, '_native', None)
+    python = [strings.symbolize_block(data, version) for version in '23']
+    assert native == python
+
+def test_decode_negative_offset(implementation):
+    # Negative addresses are language strings, not block offsets.
+    with pytest.raises(ValueError):
+        strings.decode(b'abc\x00de\x00', -3)
+    with pytest.raises(ValueError):
+        strings.raw_string(b'abc\x00de\x00', -3)
+
+def _utf16(string):
+    return string.encode('utf-16-le')
+
+UNICODE_BLOCK = b''.join([
+    _utf16(u'\0'),
+    _utf16(u'ab\t\u0100'), b'\x03\x00\x95\x80', _utf16(u'\xe9\U0001f600\0'),
+    b'\x04\x00\x01\x00', _utf16(u'x\0'),
+    b'\x02\x00\x10\x19', _utf16(u'\\Example1\0'),
+])
+
+def test_decode_unicode():
+    table = strings.StringTable(UNICODE_BLOCK, unicode=True)
+    assert table.offsets == [0, 2, 22, 30]
+    assert table.decode(2) == (u'ab$\\t\u0100$INSTALLDIR\xe9\U0001f600', 20)
+    assert table.string(22) == u'\x01x'
+    assert table.string(30) == u'$__SHELL_16_25__\\Example1'
+    assert [str(s) for s in table.symbols(2)] == \
+            [u'ab$\\t\u0100', '$INSTALLDIR', u'\xe9\U0001f600']
+    assert strings.symbolize_block(UNICODE_BLOCK, unicode=True)[1][2][1] == \
+            (strings.SPAN_VAR, 10, 14, 0x8095)
+
+PARK_BLOCK = b''.join([
+    _utf16(u'\0'),
+    _utf16(u'a\xfd'), b'\x01\xe0\x15\x80', b'\x00\xe0\x01\xe0',
+    _utf16(u'\0'),
+    b'\x03\xe0\x05\x80', b'\x02\xe0\x10\x19', _utf16(u'\0'),
+])
+
+def test_decode_park():
+    # NSIS 2 Unicode strings are Park's, escaped by U+E000-U+E003 code units
+    # followed by a code unit with the high bit set.
+    table = strings.StringTable(PARK_BLOCK, version='2', unicode=True)
+    assert table.offsets == [0, 2, 16]
+    assert table.string(2) == u'a\xfd$INSTALLDIR\ue001'
+    assert table.string(16) == u'$(LangString5)$__SHELL_16_25__'
+    assert [type(s) for s in table.symbols(2)] == \
+            [strings.String, strings.NVar, strings.String]
+
+def test_raw_unicode():
+    table = strings.StringTable(UNICODE_BLOCK, unicode=True)
+    # The 0x0100 code unit is followed by a misaligned NUL byte pair.
+    assert table.raw(2) == _utf16(u'ab\t\u0100') + b'\x03\x00\x95\x80' + \
+            _utf16(u'\xe9\U0001f600')
+    assert len(table.raw_strings()) == 4
+    assert table.raw_strings()[0] == b''
@@ -0,0 +1,52 @@
+from collections import Counter
+from nrs import version
+from nrs.nsisfile import NSIS
+import io
+import os
+import utils
+
+def test_string_version():
+    nsis2 = b'\0' + b'\xfdab\0' * 4 + b'text\0'
+    nsis3 = b'\0' + b'\x03ab\0' * 4 + b'text\0'
+    assert version.string_version(nsis2) == '2'
+    assert version.string_version(nsis3) == '3'
+    assert version.string_version(b'\0text\0') == '3'
+    unicode3 = b'\0\0' + b'\x03\0a\x80\0\0' * 4
+    unicode2 = b'\0\0' + b'\x01\xe0a\x80\0\0' * 4
+    assert version.string_version(unicode3, unicode=True) == '3'
+    assert version.string_version(unicode2, unicode=True) == '2'
+
+def test_string_version_early_exit():
+    # Once the first chunk is decided, the following ones are not counted.
+    first = b'\0' + b'\x03ab\0' * version._MIN_CODES
+    first += b'\0' * (version._SAMPLE_SIZE - len(first))
+    assert version.string_version(first + b'\xfdab\0' * 0x10000) == '3'
+    assert version.string_version(b'\0' * version._SAMPLE_SIZE +
+                                  b'\xfdab\0' * 0x10000) == '2'
+
+def test_stub_version():
+    with open(os.path.join(utils.SAMPLES_DIR, 'example1.exe'), 'rb') as fd:
+        assert version.stub_version(fd, 0x8a00) == ('3', '0b3')
+        assert version.stub_version(fd, 0) is None
+
+    # Descriptions across two windows are found.
+    description = b'Nullsoft Install System v2.46'
+    stub = b'MZ' + b'\0' * 0x3000 + description + \
+            b'\0' * (version._STUB_WINDOW_SIZE - 8)
+    assert version.stub_version(io.BytesIO(stub), len(stub)) == ('2', '46')
+
+def test_is_log_build():
+    # LockWindow is 0x43 in ANSI builds, 0x44 in logging ones.
+    assert not version.is_log_build(Counter({0x43: 2, 0x3f: 1}))
+    assert version.is_log_build(Counter({0x44: 1, 0x3f: 3}))
+    assert not version.is_log_build(Counter({0x44: 1}), unicode=True)
+    assert version.is_log_build(Counter({0x46: 1}), unicode=True)
+    assert not version.is_log_build(Counter({0x14: 3}))
+
+def test_build():
+    with open(os.path.join(utils.SAMPLES_DIR, 'example1.exe'), 'rb') as fd:
+        nsis = NSIS(fd)
+        assert nsis.version_minor == '0b3'
+        assert nsis.build == version.Build('3', '0b3', False, False, False)
+    nsis = NSIS.from_path(os.path.join(utils.SAMPLES_DIR, 'vopackage'))
+    assert nsis.build == version.Build('2', '?', False, False, False)
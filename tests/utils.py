@@ -1,3 +1,51 @@
+from nrs import fileform
 import os
+import struct
+import zlib
 TEST_DIR = os.path.dirname(os.path.realpath(__file__))
 SAMPLES_DIR = os.path.join(TEST_DIR, 'samples')
+
+try:
+    import lzma
+except ImportError:
+    # Python 2 has no lzma module.
+    lzma = None
+
+def write_unicode_installer(path):
+    """
+    Writes a non-solid Unicode NSIS 3 installer with a zlib header to
+    |path|: a language string and an entry extracting a stored file, whose
+    name address counts UTF-16 code units.
+    """
+    strings_block = u'\0Example\0file.txt\0'.encode('utf-16le')
+    entries_block = fileform._entry_fields_pack.pack(
+            fileform.EW_EXTRACTFILE, 0, 9, 0, 0, 0, 0)
+    # LANGID, dialogs offset, RTL flag and the language string addresses.
+    langtable_block = struct.pack('<Hiii', 0x409, 0, 0, 1)
+
+    blocks = [(0, 0)] * fileform.BLOCKS_COUNT
+    offset = fileform._header_pack.size
+    for block_id, block, num in [
+            (fileform.NB_ENTRIES, entries_block, 1),
+            (fileform.NB_STRINGS, strings_block, 0),
+            (fileform.NB_LANGTABLES, langtable_block, 1)]:
+        blocks[block_id] = (offset, num)
+        offset += len(block)
+    fields = [0] * len(fileform.Header._fields)
+    fields[1] = b''.join(fileform._blockheader_pack.pack(*b) for b in blocks)
+    fields[fileform.Header._fields.index('langtable_size')] = \
+            len(langtable_block)
+    fields[fileform.Header._fields.index('raw_install_types')] = b''
+    header = fileform._header_pack.pack(*fields) + entries_block + \
+            strings_block + langtable_block
+
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = compressor.compress(header) + compressor.flush()
+    data = struct.pack('<I', len(data) | 0x80000000) + data
+    # A stored data item.
+    data += struct.pack('<I', 5) + b'hello'
+    firstheader = fileform._firstheader_pack.pack(0, fileform.FH_SIG,
+            fileform.FH_MAGICS, len(header),
+            fileform._firstheader_pack.size + len(data))
+    with open(path, 'wb') as fd:
+        fd.write(firstheader + data)